@@ -1,5 +1,22 @@
-from django.contrib import admin
-from .models import User, Product, Order, Report
+import csv
+import io
+from datetime import datetime, time, timedelta
+from django.contrib import admin, messages
+from django.contrib.admin.views.main import PAGE_VAR
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.db import models
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.template.response import TemplateResponse
+from django.urls import path
+from .models import User, Product, Order, OrderArchive, Report, StockMovement, StockSnapshot
+from .catalogue import FORMATS, import_catalogue, read_records
+from .auth import user_cache
+from .stock import stock, transition_orders
+from .search import matching
+from .forms import save_edited_product
+from .db import estimated_count
 from django.contrib.auth.admin import UserAdmin
 
 class CustomUserAdmin(UserAdmin):
@@ -8,11 +25,207 @@ class CustomUserAdmin(UserAdmin):
     )
 
     def save_model(self, request, obj, form, change):
-        if change and obj.password != User.objects.get(pk=obj.pk).password:
+        if change and obj.password != form.initial.get("password", obj.password):  # the hash the form was loaded with
             obj.set_password(obj.password)
         super().save_model(request, obj, form, change)
+        user_cache.evict(obj.pk)  # a changed role or is_active applies from this user's next request
+
+class EstimatedCountPaginator(Paginator):
+    """Changelist pages without an exact ``COUNT(*)`` over the whole table.
+
+    An unfiltered list takes its size from the planner's statistics. A filtered one is counted up to
+    ``COUNT_LIMIT`` rows or ``PAGES_AHEAD`` pages past the one asked for, whichever is more; a list longer
+    than that is ``capped``, shown as "10000+ orders", and its last page link leads to the next window.
+    """
+    COUNT_LIMIT = 10000
+    PAGES_AHEAD = 10
+
+    def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True, page_number=1):
+        super().__init__(object_list, per_page, orphans, allow_empty_first_page)
+        self.page_number = page_number
+        self.capped = False
+
+    @cached_property
+    def count(self):
+        if not self.object_list.query.has_filters():
+            estimate = estimated_count(self.object_list.model)
+            if estimate is not None and estimate > self.COUNT_LIMIT:
+                return estimate
+        limit = max(self.COUNT_LIMIT, (self.page_number + self.PAGES_AHEAD) * self.per_page)
+        count = self.object_list[:limit + 1].count()  # one more row tells a list of exactly ``limit`` from a longer one
+        self.capped = count > limit
+        return min(count, limit)
+
+class SkipScanQuerySet(models.QuerySet):
+    def datetimes(self, field_name, kind, order="ASC", tzinfo=None):
+        """The date hierarchy's years, months or days, found with one index seek each.
+
+        Django truncates the date of every row in the list to find them; here each is the ``MIN()``
+        past the end of the previous one, so a drill-down costs as many queries as it shows links.
+        """
+        if kind not in ("year", "month", "day"):
+            return super().datetimes(field_name, kind, order, tzinfo)
+        values = []
+        first = self.aggregate(first=models.Min(field_name))["first"]
+        while first is not None:
+            local = timezone.localtime(first, tzinfo)
+            start = datetime(local.year, local.month if kind != "year" else 1, local.day if kind == "day" else 1, tzinfo=local.tzinfo)
+            if kind == "year":
+                end = start.replace(year=start.year + 1)
+            elif kind == "month":
+                end = start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+            else:
+                end = datetime.combine(start.date() + timedelta(days=1), time.min, tzinfo=local.tzinfo)
+            values.append(start)
+            first = self.filter(**{f"{field_name}__gte": end}).aggregate(first=models.Min(field_name))["first"]
+        return values[::-1] if order == "DESC" else values
+
+class LargeTableAdmin(admin.ModelAdmin):  # changelists that stay fast on tables of millions of rows
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False  # no second COUNT(*) of the unfiltered table next to a filtered one
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        try:
+            page_number = max(int(request.GET.get(PAGE_VAR, 1)), 1)
+        except ValueError:
+            page_number = 1
+        return self.paginator(queryset, per_page, orphans, allow_empty_first_page, page_number=page_number)
+
+    def get_queryset(self, request):
+        queryset = SkipScanQuerySet(self.model)
+        ordering = self.get_ordering(request)
+        return queryset.order_by(*ordering) if ordering else queryset
+
+class ProductAdmin(LargeTableAdmin):
+    change_list_template = "admin/app/product/change_list.html"  # adds the "Import catalogue" button
+    MAX_LISTED_ERRORS = 200
+    list_display = ["name", "sku", "available", "price", "is_low_stock"]
+    list_filter = ["is_low_stock"]
+    search_fields = ["name"]  # searched through the full-text index, see get_search_results()
+    ordering = ["-id"]
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(available=stock())
+
+    @admin.display(description="quantity", ordering="available")
+    def available(self, obj):  # a striped product's stock is the sum of its stripes, not the column of the last rebalance
+        return obj.available
+
+    def get_object(self, request, object_id, from_field=None):
+        product = super().get_object(request, object_id, from_field)
+        if product is not None:
+            product.quantity = product.available  # the change form edits the current stock
+        return product
+
+    def get_form(self, request, obj=None, change=False, **kwargs):
+        form = super().get_form(request, obj, change, **kwargs)
+        if "quantity" in form.base_fields:  # posts back the stock the form was loaded with, so save_model() can tell an edit from orders placed since
+            form.base_fields["quantity"].show_hidden_initial = True
+        return form
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            save_edited_product(obj, form)
+        else:
+            obj.save()
+
+    def get_search_results(self, request, queryset, search_term):  # also what the order form's product autocomplete runs
+        if not search_term.strip():  # Django asks on every changelist, searched or not
+            return queryset, False
+        return matching(queryset, search_term), False
+
+    def get_urls(self):
+        return [path("import/", self.admin_site.admin_view(self.import_view), name="app_product_import")] + super().get_urls()
+
+    def import_view(self, request):  # upload a CSV or JSON Lines catalogue, upserted on sku like manage.py import_catalogue
+        if not (self.has_add_permission(request) and self.has_change_permission(request)):
+            raise PermissionDenied
+        context = dict(self.admin_site.each_context(request), opts=self.model._meta, title="Import catalogue", formats=FORMATS)
+        upload = request.FILES.get("catalogue") if request.method == "POST" else None
+        if upload:
+            fmt = request.POST.get("format") or ("jsonl" if upload.name.endswith((".jsonl", ".ndjson", ".json")) else "csv")
+            errors = []
+            def on_error(line, sku, message):
+                if len(errors) < self.MAX_LISTED_ERRORS:
+                    errors.append((line, sku, message))
+            try:
+                # sanitised inline: forking a process pool from inside a web worker is not worth the risk
+                stats = import_catalogue(read_records(io.TextIOWrapper(upload.file, encoding="utf-8-sig", newline=""), fmt), on_error=on_error)
+            except (ValueError, UnicodeDecodeError, csv.Error) as error:
+                self.message_user(request, f"Could not read the catalogue: {error}", messages.ERROR)
+            else:
+                context.update(stats=stats, errors=errors)
+                self.message_user(request, f"Imported {stats['imported']} of {stats['rows']} rows.")
+        return TemplateResponse(request, "admin/app/product/import.html", context)
+
+def _status_action(status):  # an admin action moving the selected orders, or all orders of the filter, to ``status``
+    def action(modeladmin, request, queryset):
+        order_ids = list(queryset.order_by("id").values_list("id", flat=True)[:OrderAdmin.MAX_STATUS_CHANGES + 1])
+        if len(order_ids) > OrderAdmin.MAX_STATUS_CHANGES:
+            modeladmin.message_user(request, f"More than {OrderAdmin.MAX_STATUS_CHANGES} orders selected, narrow the selection.", messages.ERROR)
+            return
+        results = transition_orders(order_ids, status)
+        applied = sum(1 for result in results if result["status"] == "applied")
+        modeladmin.message_user(request, f"{applied} order(s) marked {status}.")
+        failed = [result for result in results if result["status"] == "rejected"]
+        if failed:
+            listed = "; ".join(f"#{result['order_id']}: {result['error']}" for result in failed[:OrderAdmin.MAX_LISTED_FAILURES])
+            modeladmin.message_user(request, f"{len(failed)} order(s) could not be updated: {listed}", messages.WARNING)
+    action.__name__ = f"mark_{status}"
+    return admin.action(description=f"Mark selected orders as {status}", permissions=["change"])(action)
+
+class OrderAdmin(LargeTableAdmin):
+    MAX_STATUS_CHANGES = 5000  # one transaction per action, see app.stock.transition_orders
+    MAX_LISTED_FAILURES = 20
+    actions = [_status_action(status) for status, _ in Order.STATUS_CHOICES]
+    list_display = ["id", "product", "ordered_by", "quantity", "status", "ordered_at"]
+    list_select_related = ["product", "ordered_by"]  # one joined query per page, not one per row
+    list_filter = ["status"]  # with the ordering below, walks order_status_placed_idx
+    date_hierarchy = "ordered_at"  # order_placed_idx
+    ordering = ["-ordered_at", "-id"]
+    search_fields = ["=id"]
+    autocomplete_fields = ["product", "ordered_by"]  # instead of <select>s listing every product and user
+
+class OrderArchiveAdmin(LargeTableAdmin):  # read only: archived orders are history
+    list_display = ["id", "product", "ordered_by", "quantity", "status", "ordered_at", "archived_at"]
+    list_select_related = ["product", "ordered_by"]
+    list_filter = ["status"]
+    date_hierarchy = "ordered_at"  # order_archive_placed_idx
+    ordering = ["-ordered_at", "-id"]
+    search_fields = ["=id"]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+class ReportAdmin(LargeTableAdmin):
+    list_display = ["report_type", "report_date", "generated_at"]
+    list_filter = ["report_type"]
+    date_hierarchy = "generated_at"  # report_generated_idx
+    ordering = ["-generated_at", "-id"]
+
+class StockMovementAdmin(LargeTableAdmin):  # read only: the journal is append-only
+    list_display = ["created_at", "product", "kind", "delta", "order_id"]
+    list_select_related = ["product"]
+    list_filter = ["kind"]
+    ordering = ["-id"]
+    raw_id_fields = ["product"]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
 
 admin.site.register(User, CustomUserAdmin)
-admin.site.register(Product)
-admin.site.register(Order)
-admin.site.register(Report)
\ No newline at end of file
+admin.site.register(Product, ProductAdmin)
+admin.site.register(Order, OrderAdmin)
+admin.site.register(OrderArchive, OrderArchiveAdmin)
+admin.site.register(Report, ReportAdmin)
+admin.site.register(StockMovement, StockMovementAdmin)
+admin.site.register(StockSnapshot)
\ No newline at end of file
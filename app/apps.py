@@ -5,8 +5,6 @@ class AppConfig(AppConfig):
     name = "app"
 
     def ready(self):
-        if not hasattr(self, "scheduler_started"):
-            print("🚀 Scheduler is starting...")
-            from .scheduler import start_scheduler
-            start_scheduler()
-            self.scheduler_started = True  # Prevent multiple runs
+        from . import signals  # noqa: F401 - connects the cache invalidation receivers
+        from . import metrics  # noqa: F401 - wraps every database connection opened from now on, see metrics.Measurement
+        # scheduled jobs run in their own process ("manage.py run_scheduler"), not in every web worker
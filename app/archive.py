@@ -0,0 +1,43 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from .models import Order, OrderArchive
+from .caching import models_changed
+from .db import write_transaction
+
+BATCH_SIZE = 1000  # orders moved per write transaction
+STATUSES = ["completed", "canceled"]  # only finished orders go cold, pending ones stay in the hot table
+FIELDS = ["id", "product_id", "quantity", "ordered_by_id", "ordered_at", "status", "unit_price", "updated_at"]
+
+def archive_age():
+    return timedelta(days=getattr(settings, "ORDER_ARCHIVE_AFTER_DAYS", 365))
+
+def archive_orders(older_than=None, batch_size=BATCH_SIZE, progress=None):
+    """Move completed and canceled orders placed more than ``older_than`` ago into ``OrderArchive``.
+
+    Every batch is copied and deleted in its own write transaction, so an interrupted run loses nothing
+    and the next one carries on where it stopped. The orders leave without delete signals: their sales
+    stay in the daily rollup. ``progress(archived)`` is called after each batch. Returns the orders moved.
+    """
+    cutoff = timezone.now() - (archive_age() if older_than is None else older_than)
+    archived = 0
+    while True:
+        with write_transaction():
+            rows = list(Order.objects.filter(status__in=STATUSES, ordered_at__lt=cutoff).values(*FIELDS)[:batch_size])
+            if not rows:
+                break
+            OrderArchive.objects.bulk_create([OrderArchive(**row) for row in rows])
+            _delete_orders([row["id"] for row in rows])
+        archived += len(rows)
+        if progress:
+            progress(archived)
+    if archived:
+        models_changed(Order)  # the dashboard's order count moved between tables
+    return archived
+
+def _delete_orders(ids):  # a plain DELETE: QuerySet.delete() would send post_delete and take the sales out of the rollup
+    connection = connections[Order.objects.db]
+    table = connection.ops.quote_name(Order._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table} WHERE id IN ({', '.join(['%s'] * len(ids))})", ids)
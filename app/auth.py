@@ -0,0 +1,91 @@
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.exceptions import ValidationError
+from django.db import DEFAULT_DB_ALIAS, transaction
+from .models import User
+from .caching import shared_versions
+
+FIELDS = [field.attname for field in User._meta.concrete_fields]  # the whole row, so the session hash can be checked
+
+class UserCache:
+    """Per-process LRU of user rows by id, each kept for at most ``ttl`` seconds.
+
+    A save in this process evicts the row at once. Every row is also kept with the user's version in the
+    shared ``versions`` cache, which a save bumps once it commits, so a deactivation or a new password
+    reaches the other processes from their next request rather than after ``ttl``.
+    """
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # user id -> (expiry on the monotonic clock, shared version, row values)
+        self.generation = 0  # bumped by every eviction, so a row read before one is not stored after it
+        self.lock = threading.Lock()
+
+    def version(self, user_id):  # read before the row, so a save committed meanwhile leaves the stored row outdated
+        return shared_versions().get_or_set(f"user:{user_id}:version", time.time_ns, None)
+
+    def bump(self, user_id):
+        shared_versions().set(f"user:{user_id}:version", time.time_ns(), None)
+
+    def get(self, user_id):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None:
+                self.entries.move_to_end(user_id)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic() or entry[1] != self.version(user_id):  # expired, or saved by another process
+            with self.lock:
+                if self.entries.get(user_id) is entry:
+                    del self.entries[user_id]
+            return None
+        return entry[2]
+
+    def put(self, user_id, values, generation, version):
+        with self.lock:
+            if generation != self.generation:  # the user changed while the row was being read
+                return
+            self.entries[user_id] = (time.monotonic() + self.ttl, version, values)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def evict(self, user_id):
+        with self.lock:
+            self.generation += 1
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+user_cache = UserCache(getattr(settings, "AUTH_USER_CACHE_SIZE", 1024), getattr(settings, "AUTH_USER_CACHE_TTL", 300))
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend that loads ``request.user`` from the user cache instead of querying on every request."""
+    def get_user(self, user_id):
+        try:
+            user_id = User._meta.pk.to_python(user_id)
+        except ValidationError:
+            return None
+        values = user_cache.get(user_id)
+        if values is None:
+            generation, version = user_cache.generation, user_cache.version(user_id)
+            values = User._default_manager.filter(pk=user_id).values_list(*FIELDS).first()
+            if values is None:
+                return None
+            user_cache.put(user_id, values, generation, version)
+        user = User.from_db(DEFAULT_DB_ALIAS, FIELDS, values)  # a fresh instance per request, never shared
+        return user if self.user_can_authenticate(user) else None
+
+def user_changed(instance, **kwargs):  # post_save/post_delete receiver
+    user_cache.evict(instance.pk)
+    user_id = instance.pk
+    transaction.on_commit(lambda: user_cache.bump(user_id))  # the other processes' copies
+
+def user_logged_in(user, **kwargs):  # runs after last_login is saved, so the first page after login needs no query either
+    user_cache.put(user.pk, tuple(getattr(user, name) for name in FIELDS), user_cache.generation, user_cache.version(user.pk))
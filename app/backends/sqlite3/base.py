@@ -0,0 +1,25 @@
+from django.db.backends.sqlite3 import base
+
+# applied to every new connection; a database's OPTIONS["pragmas"] overrides or adds to these (None skips one)
+PRAGMAS = {
+    "journal_mode": "WAL",  # readers no longer block the writer, nor the writer them
+    "synchronous": "NORMAL",  # safe under WAL, only the checkpoints wait for fsync
+    "busy_timeout": 20000,  # ms to wait for a lock before failing with "database is locked"
+    "mmap_size": 268435456,  # read pages straight from the OS page cache (256 MB)
+    "cache_size": -65536,  # per-connection page cache, negative means KiB (64 MB)
+    "temp_store": "MEMORY",
+}
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """The stock SQLite backend tuned for many concurrent readers and writers on one file."""
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        self.pragmas = {**PRAGMAS, **kwargs.pop("pragmas", {})}
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            if value is not None:
+                conn.execute(f"PRAGMA {name} = {value}")
+        return conn
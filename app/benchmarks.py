@@ -0,0 +1,212 @@
+import json
+import platform
+import random
+import statistics
+import threading
+import time
+from datetime import timedelta
+import django
+from django.contrib.auth.hashers import make_password
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from .models import User, Product, Order
+from .metrics import Measurement
+from .rollup import rebuild as rebuild_rollup
+from .stock import stripe_stock
+from .tasks import generate_daily_sales_report
+
+PASSWORD = "Benchmark#2025"  # every generated user's password
+HOT_SKU = "BENCH-00000"  # the product every hot_sku_order request orders
+
+def generate_data(products=200, orders=20000, users=20, days=90, seed=0, batch_size=2000):
+    """Fill the database with ``products``, ``users`` employees plus one admin, and ``orders`` spread over the last ``days`` days.
+
+    Rows are written with bulk_create, so stock is not moved; products get enough stock for any benchmark run.
+    The sales rollup is rebuilt afterwards. The same ``seed`` always produces the same data.
+    """
+    rng = random.Random(seed)
+    password = make_password(PASSWORD)  # hashed once, not once per user
+    User.objects.bulk_create([User(username="bench_admin", role="admin", password=password, is_staff=True, is_superuser=True)]
+        + [User(username=f"bench_employee_{i}", role="employee", password=password) for i in range(users)])
+    employee_ids = list(User.objects.filter(username__startswith="bench_employee_").values_list("id", flat=True))
+    Product.objects.bulk_create([Product(name=f"Product {i:05d}", sku=f"BENCH-{i:05d}", price=rng.randint(100, 100000) / 100,
+        quantity=10 ** 6, description=f"Benchmark product {i}") for i in range(products)], batch_size=batch_size)
+    product_ids = list(Product.objects.filter(sku__startswith="BENCH-").values_list("id", flat=True))
+    start = timezone.now() - timedelta(days=days)
+    statuses = ["completed"] * 7 + ["pending"] * 2 + ["canceled"]
+    for offset in range(0, orders, batch_size):
+        batch = Order.objects.bulk_create([Order(product_id=rng.choice(product_ids), ordered_by_id=rng.choice(employee_ids),
+            quantity=rng.randint(1, 10), status=rng.choice(statuses)) for _ in range(min(batch_size, orders - offset))])
+        for order in batch:  # ordered_at is auto_now_add, so the spread over the range is written afterwards
+            order.ordered_at = start + timedelta(seconds=rng.uniform(0, days * 86400))
+        Order.objects.bulk_update(batch, ["ordered_at"])
+    rebuild_rollup()
+
+class Context:
+    """What the scenarios of one thread work with: its client, user and random numbers."""
+    def __init__(self, role, seed):
+        self.rng = random.Random(seed)
+        users = list(User.objects.filter(username__startswith="bench_").order_by("id"))
+        self.user = self.rng.choice([user for user in users if user.role == role])
+        self.employee = next(user for user in users if user.role == "employee")  # whose orders an admin works on
+        self.client = Client()
+        self.client.force_login(self.user)
+        self.product_ids = list(Product.objects.values_list("id", flat=True))
+        self.hot_product_id = Product.objects.values_list("id", flat=True).filter(sku=HOT_SKU).first()
+
+    def pending_order(self, user):  # a fresh pending order to cancel or complete, made outside the timed part
+        order = Order(product_id=self.rng.choice(self.product_ids), quantity=1, ordered_by=user)
+        order.save()
+        return order.pk
+
+def _create(context):
+    return lambda: context.client.post(reverse("order_create"), {"product": context.rng.choice(context.product_ids), "quantity": 1})
+
+def _hot_sku(context):  # a flash sale: every client orders the same product
+    return lambda: context.client.post(reverse("order_create"), {"product": context.hot_product_id, "quantity": 1})
+
+def _cancel(context):
+    order_id = context.pending_order(context.user)
+    return lambda: context.client.post(reverse("cancel_order", args=[order_id]))
+
+def _update_status(context):
+    order_id = context.pending_order(context.employee)
+    return lambda: context.client.post(reverse("update_order_status", args=[order_id]), {"status": "completed"})
+
+def _order_list(context):
+    return lambda: context.client.get(reverse("order_list"))
+
+def _dashboard(context):
+    period = context.rng.choice(["day", "week", "month"])
+    return lambda: context.client.get(reverse("admin_dashboard"), {"period": period})
+
+def _admin_orders(context):  # the Django admin's order changelist, a page of it or a status filter
+    params = context.rng.choice([{}, {"status__exact": "pending"}, {"p": 5}])
+    return lambda: context.client.get(reverse("admin:app_order_changelist"), params)
+
+def _sales_report(context):
+    day = timezone.localdate() - timedelta(days=context.rng.randint(0, 30))
+    return lambda: generate_daily_sales_report(day)
+
+# name -> (role it runs as, setup returning the timed call, expected response: True a redirect, False a page, None not a view)
+SCENARIOS = {
+    "order_create": ("employee", _create, True),
+    "hot_sku_order": ("employee", _hot_sku, True),
+    "cancel_order": ("employee", _cancel, True),
+    "update_order_status": ("admin", _update_status, True),
+    "order_list": ("admin", _order_list, False),
+    "admin_dashboard": ("admin", _dashboard, False),
+    "admin_order_changelist": ("admin", _admin_orders, False),
+    "generate_daily_sales_report": ("admin", _sales_report, None),
+}
+
+def _percentile(values, fraction):  # nearest-rank percentile of sorted values
+    return values[min(len(values) - 1, max(0, round(fraction * len(values) + 0.5) - 1))]
+
+def run_scenario(name, requests=100, threads=4, seed=0):
+    """Run scenario ``name`` ``requests`` times, spread over ``threads`` concurrent threads.
+
+    Each thread logs in its own test client. Returns latency percentiles (ms), queries per request,
+    throughput and the number of failed requests.
+    """
+    role, setup, redirects = SCENARIOS[name]
+    timings, errors, lock = [], [], threading.Lock()
+
+    def worker(index, count):
+        context = Context(role, seed * 1000 + index)
+        try:
+            for _ in range(count):
+                call = setup(context)
+                with Measurement().active() as measurement:
+                    try:
+                        response = call()
+                    except Exception as error:
+                        response = error
+                elapsed = measurement.elapsed()
+                failed = isinstance(response, Exception) or (redirects is not None and response.status_code != (302 if redirects else 200))
+                with lock:
+                    timings.append((elapsed, measurement.queries))
+                    if failed:
+                        errors.append(repr(response))
+        finally:
+            connections.close_all()  # this thread's connections
+
+    shares = [requests // threads + (index < requests % threads) for index in range(threads)]
+    workers = [threading.Thread(target=worker, args=(index, share)) for index, share in enumerate(shares) if share]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    wall = time.perf_counter() - started
+    latencies = sorted(elapsed * 1000 for elapsed, _ in timings)
+    return {
+        "requests": len(timings),
+        "errors": len(errors),
+        "p50_ms": round(_percentile(latencies, 0.50), 2),
+        "p95_ms": round(_percentile(latencies, 0.95), 2),
+        "p99_ms": round(_percentile(latencies, 0.99), 2),
+        "mean_ms": round(statistics.fmean(latencies), 2),
+        "queries_per_request": round(sum(queries for _, queries in timings) / len(timings), 2),
+        "throughput_rps": round(len(timings) / wall, 1),
+        "sample_errors": errors[:3],
+    }
+
+def run_hot_sku(stripes, requests=100, threads=4, seed=0):
+    """Run hot_sku_order once per stripe count in ``stripes``, the hot product striped that many ways (0: not striped).
+
+    Results are keyed ``hot_sku_order@<stripes>``, so the throughput of each stripe count can be compared.
+    """
+    product_id = Product.objects.values_list("id", flat=True).get(sku=HOT_SKU)
+    results = {}
+    for count in stripes:
+        stripe_stock(product_id, count)
+        results[f"hot_sku_order@{count}"] = run_scenario("hot_sku_order", requests, threads, seed)
+    stripe_stock(product_id, 0)
+    return results
+
+def run_benchmarks(scenarios=None, requests=100, threads=4, seed=0, config=None, stripes=None):
+    """Run the given scenarios (all by default) one after another; returns the results with the run's settings.
+
+    With ``stripes``, hot_sku_order runs once per stripe count, see run_hot_sku().
+    """
+    results = {}
+    for name in scenarios or SCENARIOS:
+        if name == "hot_sku_order" and stripes:
+            results.update(run_hot_sku(stripes, requests, threads, seed))
+        else:
+            results[name] = run_scenario(name, requests, threads, seed)
+    return {
+        "config": dict(config or {}, requests=requests, threads=threads, seed=seed),
+        "environment": {"python": platform.python_version(), "django": django.get_version(), "machine": platform.machine()},
+        "created_at": timezone.now().isoformat(),
+        "results": results,
+    }
+
+def compare(results, baseline, tolerance=20.0, metric="p95_ms"):
+    """Return the regressions of ``results`` against ``baseline``, as messages.
+
+    A scenario regresses when its ``metric`` latency or its queries per request grew by more than
+    ``tolerance`` percent; scenarios missing from either run are ignored.
+    """
+    regressions = []
+    for name, current in results["results"].items():
+        previous = baseline["results"].get(name)
+        if previous is None:
+            continue
+        for key in (metric, "queries_per_request"):
+            before, after = previous[key], current[key]
+            if before and after > before * (1 + tolerance / 100):
+                regressions.append(f"{name}: {key} {before} -> {after} (+{(after / before - 1) * 100:.0f}%, tolerance {tolerance:g}%)")
+    return regressions
+
+def load(path):
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+def save(results, path):
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+        file.write("\n")
@@ -0,0 +1,98 @@
+import threading
+import time
+from django.core.cache import caches
+from django.conf import settings
+from django.db import transaction
+
+# regions whose cached entries a change to each model makes stale; order writes also move stock and the rollup
+MODEL_REGIONS = {
+    "Product": ("catalogue", "dashboard"),
+    "Order": ("catalogue", "dashboard", "reports"),
+    "Report": ("dashboard", "reports"),
+}
+
+def shared_versions():  # the cache holding versions every process on the host must agree on
+    return caches["versions" if "versions" in settings.CACHES else "default"]
+
+class Region:
+    """A named cache area with its own backend, TTL and version.
+
+    Region ``name`` uses ``CACHES[name]`` (``default`` if there is none), so its size bound, eviction
+    and TTL are set there. Every key carries the region's current version; ``bump()`` moves to a new
+    version, which invalidates all older entries at once and leaves them to age out. The version is kept
+    in ``CACHES["versions"]``, shared by the processes on the host, so entries cached in one process's
+    local memory are invalidated by a write in any other.
+
+    The bump waits for the writing transaction to commit. Bumped earlier, a request reading the old rows
+    meanwhile would store them under the new version, where nothing would invalidate them. An entry is
+    stored under the version read before it was computed, so a bump while it renders leaves it behind too.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.version_key = f"{name}:version"
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.name if self.name in settings.CACHES else "default"]
+
+    @property
+    def versions(self):
+        return shared_versions()
+
+    def version(self):
+        return self.versions.get_or_set(self.version_key, time.time_ns, None)
+
+    def get(self, key, default=None, version=None):
+        value = self.cache.get(f"{self.name}:{key}", version=version or self.version())
+        with self.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return default if value is None else value
+
+    def set(self, key, value, timeout=None, version=None):  # timeout=None keeps the backend's TIMEOUT
+        kwargs = {} if timeout is None else {"timeout": timeout}
+        self.cache.set(f"{self.name}:{key}", value, version=version or self.version(), **kwargs)
+
+    def get_or_set(self, key, compute, timeout=None):
+        version = self.version()
+        value = self.get(key, version=version)
+        if value is None:
+            value = compute()
+            self.set(key, value, timeout, version=version)
+        return value
+
+    def bump(self):  # once the current transaction commits, at once outside of one
+        transaction.on_commit(self._next_version)
+
+    def _next_version(self):  # a fresh value rather than incr(): two processes bumping at once must not both land on the same one
+        self.versions.set(self.version_key, time.time_ns(), None)
+
+    def clear(self):
+        self.cache.clear()
+        with self.lock:
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            hits, misses = self.hits, self.misses
+        return {"backend": self.cache.__class__.__name__, "hits": hits, "misses": misses,
+                "hit_ratio": round(hits / (hits + misses), 3) if hits + misses else None}
+
+regions = {name: Region(name) for name in ("catalogue", "dashboard", "reports")}
+
+def models_changed(*models):
+    """Bump every region that caches data derived from ``models``.
+
+    Signals do this for model saves and deletes; writes through ``update()`` or ``bulk_create()``
+    send no signal and call this themselves.
+    """
+    for name in sorted({name for model in models for name in MODEL_REGIONS[model.__name__]}):
+        regions[name].bump()
+
+def model_changed(sender, **kwargs):  # post_save/post_delete receiver
+    models_changed(sender)
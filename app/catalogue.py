@@ -0,0 +1,174 @@
+import csv
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from .models import Product, StockMovement, clean_description
+from .caching import models_changed
+from .db import write_transaction
+from .stock import alert_low_stock, set_stock, stock
+
+BATCH_SIZE = 1000  # rows upserted per INSERT ... ON CONFLICT statement
+FIELDS = ["name", "description", "quantity", "price", "reorder_threshold"]  # what an import may set, keyed by sku
+FORMATS = ["csv", "jsonl"]
+
+def read_records(stream, fmt):
+    """Yield ``(line number, record)`` from a CSV file with a header row or from JSON Lines.
+
+    Both are read a line at a time, so a catalogue of any size never has to fit in memory.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == "jsonl":
+        for number, line in enumerate(stream, 1):
+            if line.strip():
+                try:
+                    yield number, json.loads(line)
+                except ValueError:
+                    yield number, None  # reported as a bad row
+    else:
+        raise ValueError(f"unknown catalogue format {fmt!r}!")
+
+def _integer(value, field):
+    try:
+        number = int(str(value).strip())
+    except ValueError:
+        raise ValueError(f"{field} must be a whole number")
+    if number < 0:
+        raise ValueError(f"{field} cannot be negative")
+    return number
+
+def _price(value):
+    try:
+        price = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ValueError("price must be a number")
+    if not price.is_finite() or price < 0 or price.as_tuple().exponent < -2 or price >= 10 ** 8:
+        raise ValueError("price must be between 0 and 99999999.99 with at most 2 decimals")
+    return price
+
+def _given(record, field):  # empty and missing cells keep the product's current value
+    value = record.get(field)
+    return value is not None and str(value).strip() != ""
+
+def _parse(record, current):
+    """Return the field values for one row; empty cells keep the current product's values.
+
+    Raises ``ValueError`` with the reason when the row cannot be imported.
+    """
+    given = lambda field: _given(record, field)
+    values = {}
+    if given("name"):
+        values["name"] = str(record["name"]).strip()
+        if len(values["name"]) > 255:
+            raise ValueError("name is longer than 255 characters")
+    elif current is None:
+        raise ValueError("name is required for a new product")
+    if given("price"):
+        values["price"] = _price(record["price"])
+    elif current is None:
+        raise ValueError("price is required for a new product")
+    if given("description"):
+        values["description"] = str(record["description"])
+    if given("quantity"):
+        values["quantity"] = _integer(record["quantity"], "quantity")
+    if given("reorder_threshold"):
+        values["reorder_threshold"] = _integer(record["reorder_threshold"], "reorder_threshold")
+    defaults = current or {field: Product._meta.get_field(field).get_default() for field in FIELDS}
+    return {field: values.get(field, defaults[field]) for field in FIELDS}
+
+def _import_batch(batch, clean, on_error):
+    rows = {}  # sku -> (line, record), a sku repeated in the batch keeps its last row
+    for line, record in batch:
+        sku = str(record.get("sku") or "").strip() if isinstance(record, dict) else ""
+        if not isinstance(record, dict):
+            on_error(line, "", "not a JSON object")
+        elif not sku:
+            on_error(line, "", "sku is required")
+        elif len(sku) > 64:
+            on_error(line, sku, "sku is longer than 64 characters")
+        else:
+            if sku in rows:
+                on_error(rows[sku][0], sku, f"replaced by line {line} with the same sku")
+            rows[sku] = (line, record)
+    # only descriptions that differ from the stored (already clean) text go through bleach, before the write transaction:
+    # the pool may take a while, and nothing read now is written back
+    stored = dict(Product.objects.filter(sku__in=list(rows)).values_list("sku", "description"))
+    raw = {sku: str(record["description"]) for sku, (_, record) in rows.items() if _given(record, "description")}
+    dirty = [sku for sku, description in raw.items() if stored.get(sku) != description]
+    cleaned = dict(zip(dirty, clean([raw[sku] for sku in dirty])))
+    products, restocked = [], set()  # restocked: skus whose row gives a quantity, the only ones whose stock the import sets
+    with write_transaction():
+        # the current rows are read in the transaction that writes, so a stock change made while the batch was being
+        # cleaned is neither overwritten nor missed by the journal
+        existing = {row.pop("sku"): dict(row, quantity=row.pop("available")) for row in Product.objects.select_for_update().filter(sku__in=list(rows))
+            .annotate(available=stock()).values("sku", "id", "is_low_stock", "stock_stripes", "available", *FIELDS)}  # a striped product's quantity is its stripes' sum
+        for sku, (line, record) in rows.items():
+            try:
+                values = _parse(record, existing.get(sku))
+            except ValueError as error:
+                on_error(line, sku, str(error))
+                continue
+            values["description"] = cleaned.get(sku, values["description"])
+            products.append(Product(sku=sku, is_low_stock=values["quantity"] <= values["reorder_threshold"], **values))
+            if _given(record, "quantity"):
+                restocked.add(sku)
+        if not products:
+            return 0, 0
+        restocking = [product for product in products if product.sku in restocked]
+        keeping = [product for product in products if product.sku not in restocked]
+        for batch, fields in ((restocking, FIELDS), (keeping, [field for field in FIELDS if field != "quantity"])):
+            if batch:
+                Product.objects.bulk_create(batch, update_conflicts=True, unique_fields=["sku"], update_fields=[*fields, "is_low_stock"])
+        movements = []
+        for product in products:
+            current = existing.get(product.sku)
+            previous = current["quantity"] if current else 0
+            if product.quantity == previous or (current and product.sku not in restocked):
+                continue
+            if current and current["stock_stripes"]:  # a striped product's stock lives in its stripes, the upsert only set the quantity column
+                set_stock(current["id"], product.quantity)
+            movements.append(StockMovement(product_id=product.pk, kind="adjustment" if current else "restock", delta=product.quantity - previous))
+        StockMovement.objects.bulk_create(movements)  # journaled with the change
+        for product in products:
+            if product.is_low_stock and not existing.get(product.sku, {}).get("is_low_stock"):
+                alert_low_stock(product.pk, product.name, product.quantity)
+    models_changed(Product)  # bulk_create sends no post_save signal
+    return len(products), sum(product.sku not in cleaned for product in products)
+
+def import_catalogue(records, workers=0, batch_size=BATCH_SIZE, on_error=None, progress=None):
+    """Create or update products from ``(line, record)`` pairs, matching existing ones on ``sku``.
+
+    Descriptions are sanitised in a pool of ``workers`` processes (inline when 0) while rows are
+    upserted ``batch_size`` at a time. A bad row is passed to ``on_error(line, sku, message)`` and
+    skipped rather than stopping the import; ``progress(stats)`` is called after every batch.
+    Returns the stats: rows read, imported, errors, unchanged descriptions, seconds and rows_per_sec.
+    """
+    stats = {"rows": 0, "imported": 0, "errors": 0, "unchanged_descriptions": 0}
+    def report_error(line, sku, message):
+        stats["errors"] += 1
+        if on_error:
+            on_error(line, sku, message)
+    started = time.perf_counter()
+    pool = ProcessPoolExecutor(workers) if workers > 0 else None
+    clean = (lambda texts: pool.map(clean_description, texts, chunksize=64)) if pool else (lambda texts: map(clean_description, texts))
+    try:
+        records = iter(records)
+        while batch := list(islice(records, batch_size)):
+            imported, unchanged = _import_batch(batch, clean, report_error)
+            stats["rows"] += len(batch)
+            stats["imported"] += imported
+            stats["unchanged_descriptions"] += unchanged
+            stats["seconds"] = time.perf_counter() - started
+            stats["rows_per_sec"] = stats["rows"] / stats["seconds"]
+            if progress:
+                progress(stats)
+    finally:
+        if pool:
+            pool.shutdown()
+    stats["seconds"] = time.perf_counter() - started
+    stats["rows_per_sec"] = stats["rows"] / stats["seconds"] if stats["seconds"] else 0
+    return stats
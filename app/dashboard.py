@@ -0,0 +1,81 @@
+from datetime import datetime, time, timedelta
+from django.db.models import Count, Sum, Q
+from django.db.models.functions import TruncDay, TruncWeek, TruncMonth
+from django.utils.timezone import now, localdate, make_aware
+from .models import Order, OrderArchive, Product, Report, DailyProductSales
+from .db import replica_reads
+from .caching import regions
+
+def _midnight(day):  # aware start of a local calendar day
+    return make_aware(datetime.combine(day, time.min))
+
+def _month_starts(today, count):  # first day of the last ``count`` calendar months, oldest first
+    year, month = today.year, today.month
+    starts = []
+    for _ in range(count):
+        starts.append(today.replace(year=year, month=month, day=1))
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return starts[::-1]
+
+def _time_series(period, today):
+    if period == "week":  # last 4 calendar weeks, current one included
+        buckets = [today - timedelta(days=today.weekday(), weeks=i) for i in range(3, -1, -1)]
+        labels = [f"Week {i+1}" for i in range(4)]
+        trunc = TruncWeek
+    elif period == "month":  # last 12 calendar months
+        buckets = _month_starts(today, 12)
+        labels = [day.strftime("%b %Y") for day in buckets]
+        trunc = TruncMonth
+    else:  # last 7 days
+        buckets = [today - timedelta(days=i) for i in range(6, -1, -1)]
+        labels = [day.strftime("%b %d") for day in buckets]
+        trunc = TruncDay
+    rows = (DailyProductSales.objects.filter(date__gte=buckets[0])  # completed orders, from the daily rollup
+        .annotate(bucket=trunc("date")).values("bucket")
+        .annotate(orders=Sum("orders")).order_by())
+    counts = {row["bucket"].date() if isinstance(row["bucket"], datetime) else row["bucket"]: row["orders"] for row in rows}
+    return labels, [counts.get(day, 0) for day in buckets]
+
+def build_dashboard(period, order_filter):
+    """Compute every figure shown on the admin dashboard with a fixed number of queries."""
+    current = now()
+    today = localdate()
+    month_start = _midnight(today.replace(day=1))
+    last_30_days = current - timedelta(days=30)
+    if order_filter == "all":  # canceled orders are not rolled up, so this one still reads the orders
+        top_products = (Order.objects.filter(status__in=["completed", "canceled"], ordered_at__gte=month_start)
+            .values("product__name").annotate(total_quantity=Sum("quantity"))
+            .order_by("-total_quantity")[:5])
+    else:
+        top_products = (DailyProductSales.objects.filter(date__gte=today.replace(day=1))
+            .values("product__name").annotate(total_quantity=Sum("units"))
+            .order_by("-total_quantity")[:5])
+    time_labels, time_orders = _time_series(period, today)
+    products = Product.objects.aggregate(
+        total=Count("id"),
+        low_stock=Count("id", filter=Q(is_low_stock=True)))
+    orders = Order.objects.aggregate(
+        total=Count("id"),
+        pending=Count("id", filter=Q(status="pending")),
+        canceled_recent=Count("id", filter=Q(status="canceled", ordered_at__gte=last_30_days)),
+        recent=Count("id", filter=Q(ordered_at__gte=last_30_days)),)
+    revenue_today = DailyProductSales.objects.filter(date=today).aggregate(total=Sum("revenue"))["total"]
+    return {
+        "total_products": products["total"],
+        "total_orders": orders["total"] + OrderArchive.objects.count(),  # hot and archived orders
+        "total_reports": Report.objects.count(),
+        "product_names": [item["product__name"] for item in top_products],
+        "total_quantities": [item["total_quantity"] for item in top_products],
+        "time_labels": time_labels,
+        "time_orders": time_orders,
+        "total_revenue": revenue_today or 0,
+        "pending_orders": orders["pending"],
+        "canceled_order_rate": (orders["canceled_recent"] / orders["recent"] * 100) if orders["recent"] else 0,
+        "low_stock_products": products["low_stock"],}
+
+def get_dashboard(period, order_filter):
+    """Return the dashboard payload, served from the dashboard cache region until a product, order or report changes."""
+    def build():
+        with replica_reads():
+            return build_dashboard(period, order_filter)
+    return regions["dashboard"].get_or_set(f"{period}:{order_filter}", build)
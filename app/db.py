@@ -0,0 +1,88 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import connections, router, transaction
+
+_replica_reads = ContextVar("replica_reads", default=False)
+
+@contextmanager
+def write_transaction(using=None):
+    """``transaction.atomic()`` for a transaction that is going to write.
+
+    A plain SQLite BEGIN takes no lock until the first write, and a transaction that has to upgrade
+    its read lock fails with "database is locked" at once instead of waiting out the busy timeout.
+    The outermost block is therefore opened with BEGIN IMMEDIATE, so concurrent writers queue up.
+    """
+    connection = transaction.get_connection(using)
+    connection.ensure_connection()
+    if connection.vendor != "sqlite" or connection.in_atomic_block:
+        with transaction.atomic(using=using):
+            yield
+        return
+    mode, connection.transaction_mode = connection.transaction_mode, "IMMEDIATE"
+    try:
+        with transaction.atomic(using=using):
+            connection.transaction_mode = mode  # only the BEGIN of this block is affected
+            yield
+    finally:
+        connection.transaction_mode = mode
+
+@contextmanager
+def replica_reads():
+    """Send the ORM reads made inside this block to the WMS_READ_REPLICA database, if one is set."""
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+def estimated_count(model):
+    """The row count of ``model``'s table from the planner's statistics, or None when there are none.
+
+    Reading them costs the same on any table size, unlike a ``COUNT(*)``; they are as fresh as the
+    last ANALYZE, see analyze().
+    """
+    connection = connections[router.db_for_read(model) or "default"]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute("SELECT name FROM sqlite_master WHERE name = 'sqlite_stat1'")
+            if not cursor.fetchone():  # never analyzed
+                return None
+            cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s", [table])
+            counts = [int(stat.split()[0]) for stat, in cursor.fetchall()]  # every index's row starts with the table's row count
+            return max(counts) if counts else None
+        if connection.vendor == "postgresql":
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+            row = cursor.fetchone()
+            return row[0] if row and row[0] >= 0 else None  # -1 until the first ANALYZE
+    return None
+
+def analyze(using="default"):  # refresh the planner's statistics, which estimated_count() reads too
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute("PRAGMA analysis_limit = 1000")  # sample each index instead of reading it whole
+        cursor.execute("ANALYZE")
+
+class ReadReplicaRouter:
+    """Route dashboard and report reads to a read-only connection so long aggregates stay off the writer's.
+
+    Reads inside an open transaction stay on ``default`` so they see that transaction's own writes.
+    """
+    def db_for_read(self, model, **hints):
+        alias = getattr(settings, "WMS_READ_REPLICA", None)
+        if alias and _replica_reads.get() and not transaction.get_connection().in_atomic_block:
+            return alias
+        return None
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True  # the replica is the same database file
+
+    def allow_migrate(self, db, app_label, **hints):
+        if db == getattr(settings, "WMS_READ_REPLICA", None):
+            return False  # same tables as default, migrated through it
+        return None
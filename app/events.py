@@ -0,0 +1,80 @@
+import asyncio
+import threading
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+class Subscription:  # one connected client; events are delivered onto its own event loop
+    def __init__(self, broker, maxsize):
+        self.broker = broker
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize)
+
+    def deliver(self, event):  # safe to call from any thread
+        self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        if self.queue.full():  # a slow client loses its oldest events rather than holding memory
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+class Broker:
+    """Interface for the pub/sub channel behind the live event stream.
+
+    ``subscribe()`` is called from a coroutine and returns an object with an awaitable ``get()``
+    and a ``close()``; ``publish()`` may be called from any thread.
+    """
+    def publish(self, event):
+        raise NotImplementedError
+
+    def subscribe(self):
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError
+
+class LocalBroker(Broker):  # in-memory fan-out to the clients connected to this process
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self.subscriptions = set()
+        self.lock = threading.Lock()
+
+    def publish(self, event):
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            try:
+                subscription.deliver(event)
+            except RuntimeError:  # the subscriber's event loop is gone
+                self.unsubscribe(subscription)
+
+    def subscribe(self):
+        subscription = Subscription(self, self.queue_size)
+        with self.lock:
+            self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+_broker = None
+_broker_lock = threading.Lock()
+
+def get_broker():  # the process-wide broker configured by WMS_EVENT_BROKER
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(getattr(settings, "WMS_EVENT_BROKER", "app.events.LocalBroker"))()
+        return _broker
+
+def publish(event_type, **data):
+    """Publish an event once the current transaction commits, so clients never see rolled back changes."""
+    event = dict(data, type=event_type)
+    transaction.on_commit(lambda: get_broker().publish(event))
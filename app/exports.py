@@ -0,0 +1,106 @@
+import csv
+import json
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from django.utils.dateparse import parse_date
+from django.utils.timezone import make_aware
+from .models import Order, OrderArchive, Product, Report
+from .db import replica_reads
+from .stock import stock
+
+CHUNK_SIZE = 2000  # rows fetched per database round trip, and rows per chunk written out
+FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+# (column name, values_list lookup) for each exportable dataset
+COLUMNS = {
+    "orders": [("id", "id"), ("ordered_at", "ordered_at"), ("updated_at", "updated_at"), ("status", "status"),
+        ("product_id", "product_id"), ("product", "product__name"), ("unit_price", "unit_price"),  # what it completed at, empty until then
+        ("product_price", "product__price"), ("quantity", "quantity"), ("ordered_by", "ordered_by__username")],
+    "products": [("id", "id"), ("name", "name"), ("quantity", "available"), ("price", "price"),
+        ("reorder_threshold", "reorder_threshold"), ("is_low_stock", "is_low_stock"), ("created_at", "created_at")],
+    "reports": [("id", "id"), ("report_type", "report_type"), ("generated_at", "generated_at"), ("report_date", "report_date"),
+        ("details", "details"), ("data", "data")],
+}
+
+def _day(value, name):
+    day = parse_date(value) if isinstance(value, str) else value
+    if not isinstance(day, date):
+        raise ValueError(f"{name} must be a date (YYYY-MM-DD)!")
+    return make_aware(datetime.combine(day, time.min))
+
+def order_filters(date_from=None, date_to=None, status=None, product=None):
+    """The ``filter()`` keyword arguments selecting orders by day range, status and product; ``ValueError`` when one is malformed."""
+    filters = {}
+    if date_from:
+        filters["ordered_at__gte"] = _day(date_from, "date_from")
+    if date_to:  # whole days, as a range on the indexed column rather than a __date lookup
+        filters["ordered_at__lt"] = _day(date_to, "date_to") + timedelta(days=1)
+    if status:
+        if status not in dict(Order.STATUS_CHOICES):
+            raise ValueError("invalid status!")
+        filters["status"] = status
+    if product:
+        try:
+            filters["product_id"] = int(product)
+        except (TypeError, ValueError):
+            raise ValueError("invalid product selection!")
+    return filters
+
+def export_queryset(dataset, date_from=None, date_to=None, status=None, product=None):
+    """Return the ``values_list`` queryset for ``dataset``, oldest first; filters only apply to orders.
+
+    Orders come from the hot table and the archive together. Raises ``ValueError`` for an unknown dataset or a malformed filter.
+    """
+    if dataset == "orders":
+        filters = order_filters(date_from, date_to, status, product)
+        queryset = Order.objects.filter(**filters)
+        archived = OrderArchive.objects.filter(**filters)  # orders moved out by app.archive
+    elif dataset == "products":
+        queryset = Product.objects.annotate(available=stock())  # a striped product's stock is the sum of its stripes
+    elif dataset == "reports":
+        queryset = Report.objects.all()
+    else:
+        raise ValueError(f"unknown export {dataset!r}!")
+    with replica_reads():  # pin the database now, the rows are read later while the response streams
+        queryset = queryset.using(queryset.db)
+    lookups = [lookup for _, lookup in COLUMNS[dataset]]
+    queryset = queryset.values_list(*lookups)
+    if dataset == "orders":
+        queryset = queryset.union(archived.using(queryset.db).values_list(*lookups), all=True)
+    return queryset.order_by("id")
+
+def _plain(value):  # the text form of a value, the same in CSV and JSON
+    if isinstance(value, date):  # datetimes included
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+class _Echo:  # file-like object whose write() hands the line back to the caller
+    def write(self, value):
+        return value
+
+def stream_export(dataset, queryset, fmt="csv"):
+    """Yield ``queryset`` as CSV or NDJSON text, a chunk of rows at a time.
+
+    Rows come from a server-side cursor ``CHUNK_SIZE`` at a time and are never all held in memory,
+    so the first chunk is sent as soon as the first batch is read, however large the export.
+    """
+    names = [name for name, _ in COLUMNS[dataset]]
+    if fmt == "csv":
+        writer = csv.writer(_Echo())
+        # structured values (a sales report's data) go into a single CSV cell as JSON
+        encode = lambda row: writer.writerow([json.dumps(value) if isinstance(value, (dict, list)) else _plain(value) for value in row])
+        yield encode(names)
+    elif fmt == "ndjson":
+        encode = lambda row: json.dumps(dict(zip(names, map(_plain, row)))) + "\n"
+    else:
+        raise ValueError(f"unknown format {fmt!r}!")
+    chunk = []
+    for row in queryset.iterator(chunk_size=CHUNK_SIZE):
+        chunk.append(encode(row))
+        if len(chunk) == CHUNK_SIZE:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
@@ -1,12 +1,52 @@
 from django import forms
 from .models import Product, Order
 
+def save_edited_product(product, form):
+    """Save an edit of an existing ``product`` made through ``form``, writing its quantity only when it was edited.
+
+    Orders may have taken stock since the form was loaded; saving the name or price must not put it back.
+    The form tells an edit from them by the quantity it was shown, posted back as its hidden initial value.
+    """
+    if "quantity" in form.changed_data:
+        product.save()  # through app.stock.save_product like any stock edit
+        return
+    fields = [name for name in form.fields if name != "quantity"]
+    if "reorder_threshold" in form.changed_data:
+        fields.append("is_low_stock")
+    product.save(update_fields=fields)
+
 class ProductForm(forms.ModelForm):
+    reorder_threshold = forms.IntegerField(min_value=0, required=False)  # left empty, the model default applies
     class Meta:
         model = Product
-        fields = ["name", "description", "quantity", "price"]
+        fields = ["name", "sku", "description", "quantity", "price", "reorder_threshold"]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk:  # see save_edited_product()
+            self.fields["quantity"].show_hidden_initial = True
+
+    def initial_quantity(self):  # the hidden input posting back the quantity the form was shown with
+        return self["quantity"].as_hidden(only_initial=True)
+
+    def save(self, commit=True):
+        product = super().save(commit=False)
+        if commit:
+            if product._state.adding:
+                product.save()
+            else:
+                save_edited_product(product, self)
+        return product
+
+    def clean_sku(self):  # several products may have no SKU, but never two the same one
+        return self.cleaned_data.get("sku") or None
+
+    def clean_reorder_threshold(self):
+        threshold = self.cleaned_data.get("reorder_threshold")
+        return Product._meta.get_field("reorder_threshold").default if threshold is None else threshold
 
 class OrderForm(forms.ModelForm):
     class Meta:
         model = Order
-        fields = ["product", "quantity"]
\ No newline at end of file
+        fields = ["product", "quantity"]
+        widgets = {"product": forms.HiddenInput}  # chosen through the search typeahead and checked by primary key, the catalogue is never listed
\ No newline at end of file
@@ -0,0 +1,117 @@
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import date, timedelta
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Job
+from .metrics import track_job
+from .tasks import generate_daily_sales_report
+from .archive import archive_orders
+from .journal import snapshot_stock, start_of_day
+from .db import analyze
+
+HANDLERS = {  # job kind -> callable taking the job payload
+    "sales_report": lambda payload: generate_daily_sales_report(date.fromisoformat(payload["date"])),
+    "archive_orders": lambda payload: archive_orders(),
+    "snapshot_stock": lambda payload: snapshot_stock(start_of_day(date.fromisoformat(payload["date"])) if "date" in payload else None),
+    "analyze_database": lambda payload: analyze(),
+}
+BACKOFF_SECONDS = 30  # first retry delay, doubled after every failed attempt
+MAX_BACKOFF_SECONDS = 3600
+STALE_AFTER = timedelta(minutes=30)  # a job running longer than this is assumed to belong to a dead worker
+REQUEUE_STALE_EVERY = 60  # seconds between a running worker's sweeps for the jobs of dead ones
+
+def enqueue(kind, key=None, **payload):
+    """Queue a job and return it; a job with the same key is reused instead of duplicated.
+
+    A queued or running job with that key is returned as is, a finished or failed one is queued again.
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    try:
+        with transaction.atomic():
+            return Job.objects.create(kind=kind, key=key, payload=payload)
+    except IntegrityError:  # key already taken
+        Job.objects.filter(key=key, status__in=["done", "failed"]).update(
+            status="queued", payload=payload, attempts=0, run_after=timezone.now(), last_error="", finished_at=None)
+        return Job.objects.get(key=key)
+
+def enqueue_sales_report(day=None):  # one sales report job per day, however often it is requested
+    day = day or timezone.localdate()
+    return enqueue("sales_report", key=f"sales_report:{day.isoformat()}", date=day.isoformat())
+
+def enqueue_order_archival(day=None):  # one archival run per day
+    day = day or timezone.localdate()
+    return enqueue("archive_orders", key=f"archive_orders:{day.isoformat()}")
+
+def enqueue_stock_snapshot(day=None):  # one stock checkpoint per day, as of its start
+    day = day or timezone.localdate()
+    return enqueue("snapshot_stock", key=f"snapshot_stock:{day.isoformat()}", date=day.isoformat())
+
+def enqueue_analyze(day=None):  # one statistics refresh per day
+    day = day or timezone.localdate()
+    return enqueue("analyze_database", key=f"analyze_database:{day.isoformat()}")
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+def requeue_stale():  # hand jobs of crashed workers back to the queue
+    return Job.objects.filter(status="running", locked_at__lt=timezone.now() - STALE_AFTER).update(status="queued", locked_by="")
+
+def claim(worker):
+    """Take the next due job for ``worker``, or return None when nothing is due."""
+    due = Job.objects.filter(status="queued", run_after__lte=timezone.now()).order_by("run_after", "id").values_list("id", flat=True)[:10]
+    for job_id in due:
+        # compare-and-set on the status, so two workers can never both claim the same job
+        if Job.objects.filter(pk=job_id, status="queued").update(status="running", locked_by=worker, locked_at=timezone.now(), attempts=F("attempts") + 1):
+            return Job.objects.get(pk=job_id)
+    return None
+
+def run_job(job):
+    try:
+        with track_job(job.kind):
+            HANDLERS[job.kind](job.payload)
+    except Exception:
+        job.last_error = traceback.format_exc()
+        if job.attempts < job.max_attempts:  # retry later with exponential backoff
+            delay = min(BACKOFF_SECONDS * 2 ** (job.attempts - 1), MAX_BACKOFF_SECONDS)
+            job.status, job.run_after = "queued", timezone.now() + timedelta(seconds=delay)
+        else:
+            job.status, job.finished_at = "failed", timezone.now()
+    else:
+        job.status, job.last_error, job.finished_at = "done", "", timezone.now()
+    job.locked_by, job.locked_at = "", None
+    job.save(update_fields=["status", "run_after", "last_error", "finished_at", "locked_by", "locked_at"])
+    return job
+
+def run_pending(worker=None):
+    """Run due jobs in the calling thread until none is left. Returns the number of jobs run."""
+    worker = worker or worker_name()
+    count = 0
+    while (job := claim(worker)) is not None:
+        run_job(job)
+        count += 1
+    return count
+
+def work(stop, poll_interval=5):
+    """Worker loop for one thread or process: run due jobs, sleep while the queue is empty.
+
+    Every REQUEUE_STALE_EVERY seconds it also hands back the jobs of workers that died while the others
+    kept running, which a sweep at startup alone would leave "running" for good.
+    """
+    worker = worker_name()
+    next_sweep = 0
+    try:
+        while not stop.is_set():
+            close_old_connections()
+            if time.monotonic() >= next_sweep:
+                requeue_stale()
+                next_sweep = time.monotonic() + REQUEUE_STALE_EVERY
+            if not run_pending(worker):
+                stop.wait(poll_interval)
+    finally:
+        close_old_connections()
@@ -0,0 +1,77 @@
+import logging
+from datetime import datetime, time
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import Product, StockMovement, StockSnapshot
+from .stock import stock
+from .db import write_transaction
+
+logger = logging.getLogger(__name__)
+BATCH_SIZE = 1000  # snapshots written per INSERT
+
+def _moved(after):  # a product's movements after ``after`` (a datetime or an OuterRef), summed as a subquery on the product
+    movements = StockMovement.objects.filter(product=OuterRef("pk"), created_at__gt=after)
+    return Coalesce(Subquery(movements.values("product").annotate(total=Sum("delta")).values("total")), 0)
+
+def start_of_day(day=None):
+    return timezone.make_aware(datetime.combine(day or timezone.localdate(), time.min))
+
+def snapshot_stock(at=None):
+    """Checkpoint every product's stock as of ``at`` (the start of today by default); returns the snapshots written.
+
+    The balance is worked back from the current stock minus what moved after ``at``, so it only reads the
+    movements since then. Products whose stock drifted from their journal are logged first, see reconcile().
+
+    The catalogue is read without the write lock, so orders keep flowing while it is scanned. The stock and
+    the movements come from one SELECT, so they are read as of the same moment. A stock change commits
+    together with its movement, so an order placed during the scan changes both or neither, and the balance
+    as of a past ``at`` is the same either way. Only the upsert of the snapshots takes the lock.
+    """
+    at = at or start_of_day()
+    for product_id, (expected, actual) in reconcile().items():
+        logger.warning("Stock of product %s is %s, its journal says %s.", product_id, actual, expected)
+    rows = Product.objects.annotate(available=stock(), moved=_moved(at)).values_list("pk", "available", "moved")
+    snapshots = [StockSnapshot(product_id=pk, taken_at=at, quantity=available - moved) for pk, available, moved in rows]
+    with write_transaction():
+        StockSnapshot.objects.bulk_create(snapshots, batch_size=BATCH_SIZE,
+            update_conflicts=True, unique_fields=["product", "taken_at"], update_fields=["quantity"])  # a rerun replaces the day's checkpoint
+    return len(snapshots)
+
+def _last_snapshot(product_id, at):  # -> (taken_at, quantity) of the latest snapshot at or before ``at``, or None
+    return StockSnapshot.objects.filter(product_id=product_id, taken_at__lte=at).order_by("-taken_at").values_list("taken_at", "quantity").first()
+
+def stock_at(product_id, at):
+    """The product's stock at ``at``: its last snapshot before then plus the movements since.
+
+    Without a snapshot it is worked back from the current stock instead. Either way the movements read
+    are the tail after one checkpoint, not the product's whole history.
+    """
+    snapshot = _last_snapshot(product_id, at)
+    if snapshot:
+        taken_at, quantity = snapshot
+        moved = StockMovement.objects.filter(product_id=product_id, created_at__gt=taken_at, created_at__lte=at).aggregate(total=Sum("delta"))["total"]
+        return quantity + (moved or 0)
+    available, moved = Product.objects.annotate(available=stock(), moved=_moved(at)).values_list("available", "moved").get(pk=product_id)
+    return available - moved
+
+def stock_history(product_id, start, end):
+    """The product's stock movements in (``start``, ``end``], with the stock before and after them and totals per kind."""
+    opening = stock_at(product_id, start)
+    movements = list(StockMovement.objects.filter(product_id=product_id, created_at__gt=start, created_at__lte=end).order_by("created_at", "id"))
+    totals = {}
+    for movement in movements:
+        totals[movement.kind] = totals.get(movement.kind, 0) + movement.delta
+    return {"opening": opening, "closing": opening + sum(totals.values()), "movements": movements, "totals": totals}
+
+def reconcile():
+    """Return ``{product_id: (journal, actual)}`` for products whose stock differs from their last snapshot plus the movements since.
+
+    Products without a snapshot yet are left out. An empty result means every stock change went through the journal.
+    """
+    last = StockSnapshot.objects.filter(product=OuterRef("pk")).order_by("-taken_at")
+    rows = (Product.objects.annotate(taken_at=Subquery(last.values("taken_at")[:1]), snapshot=Subquery(last.values("quantity")[:1]))
+        .filter(snapshot__isnull=False)
+        .annotate(available=stock(), moved=_moved(OuterRef("taken_at")))
+        .values_list("pk", "snapshot", "moved", "available"))
+    return {pk: (snapshot + moved, available) for pk, snapshot, moved, available in rows if snapshot + moved != available}
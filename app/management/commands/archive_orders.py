@@ -0,0 +1,16 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from app.archive import BATCH_SIZE, archive_age, archive_orders
+
+class Command(BaseCommand):
+    help = "Move completed and canceled orders older than ORDER_ARCHIVE_AFTER_DAYS into the order archive, a batch at a time; safe to interrupt and rerun."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--older-than-days", type=int, help=f"archive orders placed more than this many days ago (default {archive_age().days})")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="orders moved per transaction")
+
+    def handle(self, *args, **options):
+        older_than = timedelta(days=options["older_than_days"]) if options["older_than_days"] is not None else None
+        progress = (lambda count: self.stdout.write(f"{count} orders archived...")) if options["verbosity"] > 1 else None
+        archived = archive_orders(older_than, options["batch_size"], progress)
+        self.stdout.write(self.style.SUCCESS(f"Archived {archived} order(s)."))
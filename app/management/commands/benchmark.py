@@ -0,0 +1,66 @@
+import logging
+import tempfile
+from pathlib import Path
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import override_settings, setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+from app.benchmarks import SCENARIOS, compare, generate_data, load, run_benchmarks, save
+
+class Command(BaseCommand):
+    help = ("Load-test the order, dashboard and report hot paths on a scratch database filled with generated data; "
+            "record p50/p95/p99 latency, queries per request and throughput, and compare them with a saved baseline.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=200, help="products to generate")
+        parser.add_argument("--orders", type=int, default=20000, help="orders to generate")
+        parser.add_argument("--users", type=int, default=20, help="employees to generate (plus one admin)")
+        parser.add_argument("--days", type=int, default=90, help="days the generated orders are spread over")
+        parser.add_argument("--requests", type=int, default=100, help="requests per scenario")
+        parser.add_argument("--threads", type=int, default=4, help="concurrent clients per scenario")
+        parser.add_argument("--seed", type=int, default=0, help="random seed, the same seed gives the same data and requests")
+        parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="run only this scenario (repeatable)")
+        parser.add_argument("--stripes", type=int, nargs="+", help="run hot_sku_order once per stripe count, e.g. --stripes 0 1 4 8")
+        parser.add_argument("--output", help="write the results as JSON to this file, e.g. to keep as the baseline")
+        parser.add_argument("--baseline", help="JSON results of an earlier run to compare with; exits with an error on a regression")
+        parser.add_argument("--tolerance", type=float, default=20, help="percent a path may get slower (or run more queries) than the baseline")
+        parser.add_argument("--metric", choices=["p50_ms", "p95_ms", "p99_ms", "mean_ms"], default="p95_ms", help="latency compared with the baseline")
+
+    def handle(self, *args, **options):
+        baseline = load(options["baseline"]) if options["baseline"] else None
+        config = {key: options[key] for key in ("products", "orders", "users", "days", "stripes")}
+        if baseline and baseline["config"] != dict(config, requests=options["requests"], threads=options["threads"], seed=options["seed"]):
+            self.stderr.write(self.style.WARNING(f"The baseline was recorded with other settings: {baseline['config']}"))
+        logging.getLogger("app.tasks").setLevel(logging.WARNING)  # one line per generated report would drown the results
+        with tempfile.TemporaryDirectory() as scratch:
+            connections["default"].settings_dict["TEST"]["NAME"] = str(Path(scratch) / "benchmark.sqlite3")  # a file, so threads share it
+            # fresh caches, and the file-based ones in the scratch directory rather than the running app's
+            cache_settings = {alias: dict(config, LOCATION=str(Path(scratch) / alias)) if "FileBasedCache" in config["BACKEND"] else config
+                              for alias, config in settings.CACHES.items()}
+            setup_test_environment()
+            databases = setup_databases(verbosity=0, interactive=False)
+            try:
+                with override_settings(CACHES=cache_settings):
+                    for alias in caches:  # nothing cached from another database
+                        caches[alias].clear()
+                    self.stdout.write(f"Generating {options['products']} products, {options['orders']} orders and {options['users']} users...")
+                    generate_data(options["products"], options["orders"], options["users"], options["days"], options["seed"])
+                    results = run_benchmarks(options["scenario"], options["requests"], options["threads"], options["seed"], config, options["stripes"])
+            finally:
+                teardown_databases(databases, verbosity=0)
+                teardown_test_environment()
+        self.stdout.write(f"{'scenario':<28} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8} {'req/s':>8} {'errors':>7}")
+        for name, result in results["results"].items():
+            self.stdout.write(f"{name:<28} {result['p50_ms']:>9} {result['p95_ms']:>9} {result['p99_ms']:>9} "
+                              f"{result['queries_per_request']:>8} {result['throughput_rps']:>8} {result['errors']:>7}")
+            for error in result["sample_errors"]:
+                self.stderr.write(f"  {error}")
+        if options["output"]:
+            save(results, options["output"])
+            self.stdout.write(f"Results written to {options['output']}.")
+        if baseline:
+            regressions = compare(results, baseline, options["tolerance"], options["metric"])
+            if regressions:
+                raise CommandError("Slower than the baseline:\n" + "\n".join(regressions))
+            self.stdout.write(self.style.SUCCESS(f"No path is more than {options['tolerance']:g}% slower than the baseline."))
@@ -0,0 +1,98 @@
+import random
+import tempfile
+import threading
+import time
+from pathlib import Path
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections, transaction
+from django.db.models import Count, F, Sum
+from app.db import write_transaction
+from app.models import User, Product, Order
+
+class Command(BaseCommand):
+    help = ("Compare concurrent order throughput, with dashboard reads running alongside, on a scratch database "
+            "using the stock SQLite backend and the tuned one (WAL, pragmas, BEGIN IMMEDIATE, read-only reader).")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--writers", type=int, default=8, help="threads placing orders")
+        parser.add_argument("--readers", type=int, default=2, help="threads running dashboard aggregates meanwhile")
+        parser.add_argument("--orders", type=int, default=200, help="orders placed by each writer")
+        parser.add_argument("--products", type=int, default=20, help="products the orders are spread over")
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as scratch:
+            for mode in ("stock", "tuned"):
+                result = self.run_mode(mode, Path(scratch) / f"{mode}.sqlite3", options)
+                self.stdout.write(
+                    f"{mode:>5}: {result['orders']} orders in {result['elapsed']:.2f}s ({result['orders'] / result['elapsed']:.0f} orders/sec), "
+                    f"{result['locked']} 'database is locked' failures, {result['reads']} dashboard reads ({result['reads'] / result['elapsed']:.0f}/sec)")
+
+    def run_mode(self, mode, path, options):
+        tuned = mode == "tuned"
+        engine = "app.backends.sqlite3" if tuned else "django.db.backends.sqlite3"
+        write_alias, read_alias = f"benchmark_{mode}", f"benchmark_{mode}_reads"
+        self.add_database(write_alias, ENGINE=engine, NAME=path)
+        self.add_database(read_alias, ENGINE=engine, NAME=path, OPTIONS={"pragmas": {"query_only": "ON"}} if tuned else {})
+        try:
+            with connections[write_alias].schema_editor() as editor:
+                for model in (User, Product, Order):
+                    editor.create_model(model)
+            user = User.objects.db_manager(write_alias).create(username="benchmark")
+            products = Product.objects.using(write_alias).bulk_create(
+                [Product(name=f"Product {i}", price=10, quantity=10 ** 9) for i in range(options["products"])])
+            product_ids = [product.pk for product in products]
+            begin = (lambda: write_transaction(using=write_alias)) if tuned else (lambda: transaction.atomic(using=write_alias))
+            counts = {"orders": 0, "locked": 0, "reads": 0}
+            lock = threading.Lock()
+            done = threading.Event()
+
+            def writer(seed):
+                rng = random.Random(seed)
+                orders = locked = 0
+                for _ in range(options["orders"]):
+                    product_id = rng.choice(product_ids)
+                    try:
+                        with begin():  # the same statements Order.save runs: guarded decrement, then the insert
+                            Product.objects.using(write_alias).filter(pk=product_id, quantity__gte=1).update(quantity=F("quantity") - 1)
+                            Order.objects.using(write_alias).bulk_create([Order(product_id=product_id, quantity=1, ordered_by=user)])
+                        orders += 1
+                    except OperationalError:
+                        locked += 1
+                connections[write_alias].close()
+                with lock:
+                    counts["orders"] += orders
+                    counts["locked"] += locked
+
+            def reader():
+                reads = 0
+                while not done.is_set():
+                    try:
+                        Order.objects.using(read_alias).aggregate(total=Count("id"), units=Sum("quantity"))
+                        list(Order.objects.using(read_alias).values("product").annotate(units=Sum("quantity")).order_by("-units")[:5])
+                        reads += 1
+                    except OperationalError:
+                        pass
+                connections[read_alias].close()
+                with lock:
+                    counts["reads"] += reads
+
+            writers = [threading.Thread(target=writer, args=(seed,)) for seed in range(options["writers"])]
+            readers = [threading.Thread(target=reader) for _ in range(options["readers"])]
+            started = time.perf_counter()
+            for thread in readers + writers:
+                thread.start()
+            for thread in writers:
+                thread.join()
+            counts["elapsed"] = time.perf_counter() - started
+            done.set()
+            for thread in readers:
+                thread.join()
+            return counts
+        finally:
+            for alias in (write_alias, read_alias):
+                connections[alias].close()
+                del connections[alias]
+                del connections.settings[alias]
+
+    def add_database(self, alias, **settings_dict):  # register a scratch database alias for this process only
+        connections.settings[alias] = connections.configure_settings({"default": {}, alias: settings_dict})[alias]
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from app.exports import COLUMNS, FORMATS, export_queryset, stream_export
+
+class Command(BaseCommand):
+    help = "Stream orders, products or reports as CSV or NDJSON to a file or to stdout."
+
+    def add_arguments(self, parser):
+        parser.add_argument("dataset", choices=sorted(COLUMNS), help="what to export")
+        parser.add_argument("--format", choices=sorted(FORMATS), default="csv", help="output format")
+        parser.add_argument("--output", help="file to write, stdout when omitted")
+        parser.add_argument("--date-from", help="orders placed on or after this day (YYYY-MM-DD)")
+        parser.add_argument("--date-to", help="orders placed on or before this day (YYYY-MM-DD)")
+        parser.add_argument("--status", help="orders with this status only")
+        parser.add_argument("--product", help="orders for this product id only")
+
+    def handle(self, *args, **options):
+        try:
+            queryset = export_queryset(options["dataset"], date_from=options["date_from"], date_to=options["date_to"],
+                status=options["status"], product=options["product"])
+        except ValueError as error:
+            raise CommandError(str(error))
+        output = open(options["output"], "w", newline="", encoding="utf-8") if options["output"] else None
+        write = output.write if output else lambda chunk: self.stdout.write(chunk, ending="")
+        try:
+            for chunk in stream_export(options["dataset"], queryset, options["format"]):
+                write(chunk)
+        finally:
+            if output:
+                output.close()
@@ -0,0 +1,38 @@
+import csv
+import os
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from app.catalogue import BATCH_SIZE, FORMATS, import_catalogue, read_records
+
+class Command(BaseCommand):
+    help = "Create or update products in bulk from a CSV or JSON Lines catalogue, matching on sku."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="catalogue file, or - for stdin")
+        parser.add_argument("--format", choices=FORMATS, help="csv or jsonl, guessed from the file extension when omitted")
+        parser.add_argument("--workers", type=int, default=(os.cpu_count() or 1) - 1,
+            help="processes sanitising descriptions, 0 to do it inline (default: one per CPU but the one running the import)")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="rows upserted per statement")
+        parser.add_argument("--errors", help="CSV file for the rows that could not be imported (default: <path>.errors.csv)")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or ("jsonl" if path.endswith((".jsonl", ".ndjson", ".json")) else "csv")
+        error_path = options["errors"] or ("catalogue.errors.csv" if path == "-" else f"{path}.errors.csv")
+        try:
+            source = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8-sig")
+        except OSError as error:
+            raise CommandError(f"Cannot read {path}: {error.strerror}")
+        progress = (lambda stats: self.stderr.write(f"{stats['rows']} rows, {stats['rows_per_sec']:.0f} rows/sec")) if options["verbosity"] > 1 else None
+        with source, open(error_path, "w", newline="", encoding="utf-8") as error_file:
+            errors = csv.writer(error_file)
+            errors.writerow(["line", "sku", "error"])
+            stats = import_catalogue(read_records(source, fmt), workers=options["workers"], batch_size=options["batch_size"],
+                on_error=lambda line, sku, message: errors.writerow([line, sku, message]), progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {stats['imported']} of {stats['rows']} rows in {stats['seconds']:.1f}s ({stats['rows_per_sec']:.0f} rows/sec), "
+            f"{stats['unchanged_descriptions']} unchanged descriptions not re-sanitised."))
+        if stats["errors"]:
+            self.stdout.write(self.style.WARNING(f"{stats['errors']} rows skipped, see {error_path}."))
+        else:
+            os.remove(error_path)
@@ -0,0 +1,22 @@
+import signal
+import sys
+from django.core.management.base import BaseCommand
+from app.scheduler import run_scheduler
+from app.metrics import serve_metrics
+
+class Command(BaseCommand):
+    help = "Run the scheduled jobs; start one per host, a database lease keeps a single leader running them."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--metrics-port", type=int, help="serve the scheduled jobs' metrics for Prometheus on this port")
+        parser.add_argument("--metrics-host", default="127.0.0.1", help="address the metrics endpoint listens on, this host only by default")
+
+    def handle(self, *args, **options):
+        self.stdout.write("🚀 Scheduler is starting...")
+        if options["metrics_port"]:
+            serve_metrics(options["metrics_port"], options["metrics_host"])
+        signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))  # shut down cleanly so the lease is released
+        try:
+            run_scheduler()
+        except (KeyboardInterrupt, SystemExit):
+            self.stdout.write("Scheduler stopped.")
@@ -0,0 +1,46 @@
+import multiprocessing
+import threading
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from app.jobs import requeue_stale, run_pending, work
+from app.metrics import serve_metrics
+
+class Command(BaseCommand):
+    help = "Run background jobs (such as sales reports) from the database queue with a pool of threads or processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=2, help="number of worker threads or processes")
+        parser.add_argument("--pool", choices=["thread", "process"], default="thread", help="run workers as threads or as processes")
+        parser.add_argument("--poll-interval", type=float, default=5, help="seconds to wait when the queue is empty")
+        parser.add_argument("--once", action="store_true", help="run the jobs that are due now and exit")
+        parser.add_argument("--metrics-port", type=int, help="serve the workers' job metrics for Prometheus on this port (thread pool only)")
+        parser.add_argument("--metrics-host", default="127.0.0.1", help="address the metrics endpoint listens on, this host only by default")
+
+    def handle(self, *args, **options):
+        requeue_stale()
+        if options["once"]:
+            count = run_pending()
+            self.stdout.write(self.style.SUCCESS(f"Ran {count} job(s)."))
+            return
+        if options["metrics_port"]:
+            if options["pool"] == "process":  # each child process would count its own jobs, out of reach of the endpoint
+                raise CommandError("--metrics-port needs the thread pool.")
+            serve_metrics(options["metrics_port"], options["metrics_host"])
+        if options["pool"] == "process":
+            stop = multiprocessing.Event()
+            connections.close_all()  # never share a database connection with forked children
+            workers = [multiprocessing.Process(target=work, args=(stop, options["poll_interval"])) for _ in range(options["concurrency"])]
+        else:
+            stop = threading.Event()
+            workers = [threading.Thread(target=work, args=(stop, options["poll_interval"])) for _ in range(options["concurrency"])]
+        self.stdout.write(f"Starting {options['concurrency']} {options['pool']} worker(s)...")
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping workers after their current job...")
+            stop.set()
+            for worker in workers:
+                worker.join()
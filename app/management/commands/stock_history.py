@@ -0,0 +1,38 @@
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from app.models import Product
+from app.journal import snapshot_stock, start_of_day, stock_history
+
+class Command(BaseCommand):
+    help = "Show a product's stock movements between two days with its stock before and after them, read from the stock journal."
+
+    def add_arguments(self, parser):
+        parser.add_argument("sku", nargs="?", help="SKU of the product")
+        parser.add_argument("--date-from", help="first day (YYYY-MM-DD), today when omitted")
+        parser.add_argument("--date-to", help="last day (YYYY-MM-DD), the first day when omitted")
+        parser.add_argument("--snapshot", action="store_true", help="checkpoint every product's stock as of the start of today instead")
+
+    def handle(self, *args, **options):
+        if options["snapshot"]:
+            self.stdout.write(self.style.SUCCESS(f"Snapshot of {snapshot_stock()} product(s) taken."))
+            return
+        if not options["sku"]:
+            raise CommandError("Give a product SKU, or --snapshot.")
+        try:
+            first = date.fromisoformat(options["date_from"]) if options["date_from"] else timezone.localdate()
+            last = date.fromisoformat(options["date_to"]) if options["date_to"] else first
+        except ValueError as error:
+            raise CommandError(f"Invalid day: {error}")
+        product = Product.objects.filter(sku=options["sku"]).values_list("pk", "name").first()
+        if product is None:
+            raise CommandError(f"Unknown SKU: {options['sku']}")
+        history = stock_history(product[0], start_of_day(first), start_of_day(last + timedelta(days=1)))
+        self.stdout.write(f"{product[1]} ({options['sku']}), {first} to {last}")
+        self.stdout.write(f"opening stock {history['opening']}")
+        for movement in history["movements"]:
+            order = f" order {movement.order_id}" if movement.order_id else ""
+            self.stdout.write(f"{timezone.localtime(movement.created_at):%Y-%m-%d %H:%M:%S}  {movement.kind:<12} {movement.delta:+d}{order}")
+        for kind, total in sorted(history["totals"].items()):
+            self.stdout.write(f"total {kind:<12} {total:+d}")
+        self.stdout.write(f"closing stock {history['closing']}")
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from app.models import Product
+from app.stock import stripe_stock
+
+class Command(BaseCommand):
+    help = ("Split hot products' stock over several counter rows so concurrent orders for them decrement different rows; "
+            "--stripes 0 folds the stock back into the product row.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("skus", nargs="+", help="SKUs of the products to stripe")
+        parser.add_argument("--stripes", type=int, default=8, help="counters to split each product's stock over, 0 to stop striping")
+
+    def handle(self, *args, **options):
+        if not 0 <= options["stripes"] <= 64:
+            raise CommandError("--stripes must be between 0 and 64.")
+        products = dict(Product.objects.filter(sku__in=options["skus"]).values_list("sku", "pk"))
+        missing = sorted(set(options["skus"]) - products.keys())
+        if missing:
+            raise CommandError(f"Unknown SKU(s): {', '.join(missing)}")
+        for sku, product_id in products.items():
+            stripe_stock(product_id, options["stripes"])
+        self.stdout.write(self.style.SUCCESS(f"{len(products)} product(s) now have {options['stripes']} stock stripe(s)."))
@@ -0,0 +1,305 @@
+import hmac
+import logging
+import threading
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.template.backends import django as django_backend
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)  # seconds
+MAX_RECORDED_QUERIES = 100  # statements kept per request for the slow-request log
+
+_current = ContextVar("metrics_current", default=())  # the Measurements in progress, e.g. a benchmark's around a request's
+_END = object()
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(DURATION_BUCKETS):
+            if value <= bound:
+                self.buckets[index] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+class Measurement:
+    """Time, queries and template rendering of one request or job."""
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.template_seconds = 0.0
+        self.statements = []  # (seconds, sql) of the first MAX_RECORDED_QUERIES queries
+
+    def add_query(self, elapsed, sql):
+        self.queries += 1
+        self.query_seconds += elapsed
+        if len(self.statements) < MAX_RECORDED_QUERIES:
+            self.statements.append((elapsed, sql))
+
+    @contextmanager
+    def active(self):
+        """Count the queries and templates run meanwhile, on any connection of this context.
+
+        The context carries into the threads of ``sync_to_async``, so a sync view under ASGI, which runs
+        its queries there on that thread's own connections, is measured too.
+        """
+        active = _current.get()
+        token = _current.set(active if self in active else (*active, self))
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+def _measured(execute, sql, params, many, context):  # every connection's execute_wrapper, adding to the measurements in progress
+    measurements = _current.get()
+    if not measurements:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        for measurement in measurements:
+            measurement.add_query(elapsed, sql)
+
+def _wrap_connection(sender, connection, **kwargs):
+    if _measured not in connection.execute_wrappers:  # connection_created fires again on a reconnect
+        connection.execute_wrappers.append(_measured)
+
+connection_created.connect(_wrap_connection, dispatch_uid="metrics_wrap_connection")
+
+class Registry:
+    """Per-process metrics, rendered in the Prometheus text format.
+
+    Each process (web worker, job worker, scheduler) keeps its own numbers and is scraped on its own.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.series = {}  # (family, labels) -> {"duration": Histogram, "queries": n, ...}
+
+    def _entry(self, family, labels):
+        key = (family, tuple(sorted(labels.items())))
+        if key not in self.series:
+            self.series[key] = {"duration": Histogram(), "queries": 0, "query_seconds": 0.0, "template_seconds": 0.0, "bytes": 0, "outcomes": {}}
+        return self.series[key]
+
+    def record(self, family, labels, measurement, outcome, size=0):
+        elapsed = measurement.elapsed()
+        with self.lock:
+            entry = self._entry(family, labels)
+            entry["duration"].observe(elapsed)
+            entry["queries"] += measurement.queries
+            entry["query_seconds"] += measurement.query_seconds
+            entry["template_seconds"] += measurement.template_seconds
+            entry["bytes"] += size
+            entry["outcomes"][outcome] = entry["outcomes"].get(outcome, 0) + 1
+        return elapsed
+
+    def clear(self):
+        with self.lock:
+            self.series.clear()
+
+    def render(self):
+        from .caching import regions
+        with self.lock:
+            series = sorted(self.series.items())
+            snapshot = [(family, labels, {**entry, "duration": _copy(entry["duration"]), "outcomes": dict(entry["outcomes"])}) for (family, labels), entry in series]
+        lines = []
+        for family, outcome_label, help_text in (("request", "status", "HTTP requests"), ("job", "outcome", "background and scheduled jobs")):
+            rows = [(dict(labels), entry) for name, labels, entry in snapshot if name == family]
+            if not rows:
+                continue
+            lines += [f"# HELP wms_{family}_duration_seconds Duration of {help_text}.", f"# TYPE wms_{family}_duration_seconds histogram"]
+            for labels, entry in rows:
+                histogram, cumulative = entry["duration"], 0
+                for bound, count in zip(DURATION_BUCKETS, histogram.buckets):
+                    cumulative += count
+                    lines.append(f"wms_{family}_duration_seconds_bucket{_labels(labels, le=bound)} {cumulative}")
+                lines.append(f"wms_{family}_duration_seconds_bucket{_labels(labels, le='+Inf')} {histogram.count}")
+                lines.append(f"wms_{family}_duration_seconds_sum{_labels(labels)} {_number(histogram.sum)}")
+                lines.append(f"wms_{family}_duration_seconds_count{_labels(labels)} {histogram.count}")
+            for metric, field, text in (("queries_total", "queries", "Database queries run"),
+                                        ("query_seconds_total", "query_seconds", "Time spent in database queries"),
+                                        ("template_seconds_total", "template_seconds", "Time spent rendering templates"),
+                                        ("response_bytes_total", "bytes", "Response body bytes")):
+                if family == "job" and field == "bytes":
+                    continue
+                lines += [f"# HELP wms_{family}_{metric} {text} by {help_text}.", f"# TYPE wms_{family}_{metric} counter"]
+                lines += [f"wms_{family}_{metric}{_labels(labels)} {_number(entry[field])}" for labels, entry in rows]
+            lines += [f"# HELP wms_{family}s_total Completed {help_text} by {outcome_label}.", f"# TYPE wms_{family}s_total counter"]
+            for labels, entry in rows:
+                lines += [f"wms_{family}s_total{_labels(labels, **{outcome_label: outcome})} {count}" for outcome, count in sorted(entry["outcomes"].items())]
+        lines += ["# HELP wms_cache_hits_total Cache region hits.", "# TYPE wms_cache_hits_total counter"]
+        stats = {name: region.stats() for name, region in regions.items()}
+        lines += [f"wms_cache_hits_total{_labels({'region': name})} {stat['hits']}" for name, stat in stats.items()]
+        lines += ["# HELP wms_cache_misses_total Cache region misses.", "# TYPE wms_cache_misses_total counter"]
+        lines += [f"wms_cache_misses_total{_labels({'region': name})} {stat['misses']}" for name, stat in stats.items()]
+        return "\n".join(lines) + "\n"
+
+def _copy(histogram):
+    copy = Histogram()
+    copy.buckets, copy.sum, copy.count = list(histogram.buckets), histogram.sum, histogram.count
+    return copy
+
+def _labels(labels, **extra):
+    escape = lambda value: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in {**labels, **extra}.items()) + "}"
+
+def _number(value):
+    return f"{value:.6f}".rstrip("0").rstrip(".") if isinstance(value, float) else str(value)
+
+registry = Registry()
+
+def log_if_slow(what, seconds, measurement):
+    """Log a request or job slower than SLOW_REQUEST_SECONDS together with its slowest statements."""
+    if seconds < getattr(settings, "SLOW_REQUEST_SECONDS", 1.0):
+        return
+    slowest = sorted(measurement.statements, key=lambda statement: statement[0], reverse=True)[:10]
+    logger.warning("Slow %s: %.0f ms, %d queries in %.0f ms, templates %.0f ms%s", what, seconds * 1000,
+        measurement.queries, measurement.query_seconds * 1000, measurement.template_seconds * 1000,
+        "".join(f"\n  {elapsed * 1000:8.1f} ms  {sql}" for elapsed, sql in slowest))
+
+class MetricsMiddleware:
+    """Record latency, query count and time, template time and response size per URL name.
+
+    Runs natively under WSGI and ASGI, so async views (the event stream) are not adapted through a thread.
+    A streamed response is recorded once its body has been sent, with the bytes it sent.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with Measurement().active() as measurement:
+            response = self.get_response(request)
+        return self._finish(request, response, measurement)
+
+    async def __acall__(self, request):
+        with Measurement().active() as measurement:
+            response = await self.get_response(request)
+        return self._finish(request, response, measurement)
+
+    def _finish(self, request, response, measurement):
+        if not response.streaming:
+            self._record(request, response, measurement, len(response.content))
+        elif response.is_async:
+            response.streaming_content = self._counted_async(request, response, measurement, response.streaming_content)
+        else:
+            response.streaming_content = self._counted(request, response, measurement, response.streaming_content)
+        return response
+
+    def _counted(self, request, response, measurement, chunks):  # the queries run to produce each chunk count towards the request
+        size, chunks = 0, iter(chunks)
+        try:
+            while True:
+                with measurement.active():
+                    chunk = next(chunks, _END)
+                if chunk is _END:
+                    break
+                size += len(chunk)
+                yield chunk
+        finally:  # also when the client goes away mid-stream
+            self._record(request, response, measurement, size)
+
+    async def _counted_async(self, request, response, measurement, chunks):
+        size, chunks = 0, aiter(chunks)
+        try:
+            while True:
+                with measurement.active():
+                    chunk = await anext(chunks, _END)
+                if chunk is _END:
+                    break
+                size += len(chunk)
+                yield chunk
+        finally:
+            self._record(request, response, measurement, size)
+
+    def _record(self, request, response, measurement, size):
+        view = request.resolver_match.view_name if request.resolver_match else "unresolved"
+        seconds = registry.record("request", {"view": view, "method": request.method}, measurement, str(response.status_code), size)
+        log_if_slow(f"request {request.method} {request.get_full_path()} ({view})", seconds, measurement)
+
+@contextmanager
+def track_job(name):
+    """Record a background or scheduled job like a request, under ``name``."""
+    outcome = "failed"
+    with Measurement().active() as measurement:
+        try:
+            yield measurement
+            outcome = "done"
+        finally:
+            seconds = registry.record("job", {"job": name}, measurement, outcome)
+            log_if_slow(f"job {name}", seconds, measurement)
+
+class TimedTemplate:  # a template whose render time is added to the current measurement
+    def __init__(self, template):
+        self.template = template
+
+    def render(self, context=None, request=None):
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            elapsed = time.perf_counter() - started
+            for measurement in _current.get():
+                measurement.template_seconds += elapsed
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """The Django template backend with render times recorded by the metrics middleware."""
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+def token_matches(authorization):
+    """True when ``authorization`` (an Authorization header) is "Bearer <METRICS_TOKEN>" and a token is set."""
+    token = getattr(settings, "METRICS_TOKEN", None)
+    return bool(token) and hmac.compare_digest((authorization or "").encode(), f"Bearer {token}".encode())
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if getattr(settings, "METRICS_TOKEN", None) and not token_matches(self.headers.get("Authorization")):
+            self.send_error(403)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # scrapes are not worth a log line each
+        pass
+
+def serve_metrics(port, host="127.0.0.1"):
+    """Expose this process's metrics on ``http://host:port/`` from a daemon thread (for workers and the scheduler).
+
+    Only this host can reach it unless another ``host`` is given; with METRICS_TOKEN set, scrapes must send the token.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+    return server
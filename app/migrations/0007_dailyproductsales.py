@@ -0,0 +1,45 @@
+# Generated by Django 5.1.6 on 2026-10-18 18:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, F, Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill_rollup(apps, schema_editor):
+    Order = apps.get_model('app', 'Order')
+    DailyProductSales = apps.get_model('app', 'DailyProductSales')
+    totals = (Order.objects.filter(status='completed')
+        .annotate(day=TruncDate('ordered_at')).values('day', 'product_id')
+        .annotate(orders=Count('id'), units=Sum('quantity'),
+                  revenue=Sum(F('quantity') * F('product__price'), output_field=DecimalField()))
+        .order_by())
+    DailyProductSales.objects.bulk_create(
+        [DailyProductSales(date=row['day'], product_id=row['product_id'], orders=row['orders'], units=row['units'], revenue=row['revenue']) for row in totals],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_remove_product_created_by_remove_product_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyProductSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.product')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('date', 'product'), name='unique_daily_product_sales')],
+            },
+        ),
+        migrations.RunPython(backfill_rollup, migrations.RunPython.noop),
+    ]
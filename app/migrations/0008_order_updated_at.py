@@ -0,0 +1,29 @@
+# Generated by Django 5.1.6 on 2026-10-18 18:15
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_updated_at(apps, schema_editor):
+    Order = apps.get_model('app', 'Order')
+    Order.objects.update(updated_at=F('ordered_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_dailyproductsales'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(backfill_updated_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['updated_at', 'id'], name='order_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.1.6 on 2026-10-18 18:39
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.utils.timezone import localtime
+
+
+def backfill_report_data(apps, schema_editor):
+    # the latest sales report of each day takes that day as report_date and its figures from the daily rollup
+    Report = apps.get_model('app', 'Report')
+    DailyProductSales = apps.get_model('app', 'DailyProductSales')
+    dated = set()
+    for report in Report.objects.filter(report_type='sales').order_by('-generated_at'):
+        day = localtime(report.generated_at).date()
+        if day in dated:
+            continue
+        dated.add(day)
+        rows = (DailyProductSales.objects.filter(date=day, units__gt=0)
+            .values('product_id', 'product__name', 'orders', 'units', 'revenue').order_by('-revenue', 'product__name'))
+        products = [{'product_id': row['product_id'], 'name': row['product__name'], 'orders': row['orders'],
+                     'units': row['units'], 'revenue': str(row['revenue'])} for row in rows]
+        report.report_date = day
+        report.data = {'products': products, 'units': sum(row['units'] for row in products),
+                       'revenue': str(sum((Decimal(row['revenue']) for row in products), Decimal('0.00')))}
+        report.save(update_fields=['report_date', 'data'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_product_sku'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='report',
+            name='data',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='report',
+            name='report_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_report_data, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='report',
+            constraint=models.UniqueConstraint(condition=models.Q(('report_date__isnull', False)), fields=('report_type', 'report_date'), name='unique_dated_report'),
+        ),
+    ]
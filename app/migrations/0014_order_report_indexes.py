@@ -0,0 +1,36 @@
+# Generated by Django 5.1.6 on 2026-10-18 18:56
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_report_data'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='ordered_by',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['ordered_at', 'id'], name='order_placed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['ordered_by', 'ordered_at', 'id'], name='order_user_placed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'ordered_at'], name='order_status_placed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='report',
+            index=models.Index(fields=['generated_at', 'id'], name='report_generated_idx'),
+        ),
+    ]
@@ -0,0 +1,13 @@
+from django.db import migrations
+from ._search_index import create_index, drop_index
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0015_order_archive'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+from ._search_index import create_triggers
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0016_product_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='stock_stripes',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(create_triggers, migrations.RunPython.noop),  # adding the column rebuilt app_product and dropped them
+        migrations.CreateModel(
+            name='StockStripe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stripe', models.PositiveSmallIntegerField()),
+                ('quantity', models.PositiveIntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stripes', to='app.product')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('product', 'stripe'), name='unique_stock_stripe')],
+            },
+        ),
+    ]
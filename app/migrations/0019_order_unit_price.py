@@ -0,0 +1,33 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:42
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_unit_price(apps, schema_editor):
+    # the price an order completed at was never kept; the product's current price is the best guess, and what the rollup used so far
+    Product = apps.get_model('app', 'Product')
+    price = Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('price')[:1])
+    for name in ('Order', 'OrderArchive'):
+        apps.get_model('app', name).objects.filter(status='completed', unit_price__isnull=True).update(unit_price=price)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0018_stock_journal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='unit_price',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='orderarchive',
+            name='unit_price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.RunPython(backfill_unit_price, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# The product search index, shared by the migrations that build it and by every later migration that
+# remakes app_product: SQLite rebuilds the table for most schema changes (AddField with a default,
+# AlterField, RemoveField...) and the old table's triggers go with it. Such a migration ends with
+#     migrations.RunPython(create_triggers, migrations.RunPython.noop)
+# (ProductSearchTests checks the triggers are there once every migration has run.) Not a migration
+# itself: the loader skips modules whose name starts with an underscore.
+#
+# An FTS5 index over the product table (external content, so the text is stored once), kept in sync by
+# triggers: saves, deletes, bulk upserts and raw updates are all covered. Stock updates touch none of the
+# indexed columns and do not fire them. FTS5 is SQLite's: on other databases nothing is created and
+# app.search falls back to icontains.
+INDEX = [
+    """CREATE VIRTUAL TABLE app_product_search USING fts5(
+        name, sku, description, content='app_product', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    "INSERT INTO app_product_search(app_product_search, rank) VALUES ('rank', 'bm25(10.0, 5.0, 1.0)')",  # name, then sku, then description
+]
+TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS app_product_search_insert AFTER INSERT ON app_product BEGIN
+        INSERT INTO app_product_search(rowid, name, sku, description) VALUES (new.id, new.name, new.sku, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS app_product_search_delete AFTER DELETE ON app_product BEGIN
+        INSERT INTO app_product_search(app_product_search, rowid, name, sku, description) VALUES ('delete', old.id, old.name, old.sku, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS app_product_search_update AFTER UPDATE OF name, sku, description ON app_product BEGIN
+        INSERT INTO app_product_search(app_product_search, rowid, name, sku, description) VALUES ('delete', old.id, old.name, old.sku, old.description);
+        INSERT INTO app_product_search(rowid, name, sku, description) VALUES (new.id, new.name, new.sku, new.description);
+    END""",
+]
+REBUILD = "INSERT INTO app_product_search(app_product_search) VALUES ('rebuild')"  # index the existing catalogue
+DROP = [
+    "DROP TRIGGER IF EXISTS app_product_search_insert",
+    "DROP TRIGGER IF EXISTS app_product_search_delete",
+    "DROP TRIGGER IF EXISTS app_product_search_update",
+    "DROP TABLE IF EXISTS app_product_search",
+]
+TRIGGER_NAMES = ["app_product_search_insert", "app_product_search_delete", "app_product_search_update"]
+
+def _execute(schema_editor, statements):
+    if schema_editor.connection.vendor == "sqlite":
+        for sql in statements:
+            schema_editor.execute(sql)
+
+def create_index(apps, schema_editor):
+    _execute(schema_editor, INDEX + TRIGGERS + [REBUILD])
+
+def drop_index(apps, schema_editor):
+    _execute(schema_editor, DROP)
+
+def create_triggers(apps, schema_editor):  # idempotent, so safe to run after any migration that may have remade app_product
+    _execute(schema_editor, TRIGGERS)
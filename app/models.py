@@ -1,7 +1,19 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser, Group, Permission
 from django.conf import settings
+from django.utils import timezone
+import threading
+from contextlib import nullcontext
 import bleach
+import bleach.sanitizer
+
+ALLOWED_TAGS = ["b", "i", "u", "p", "br"]
+_cleaners = threading.local()  # a bleach Cleaner is costly to build but not thread-safe, so one per thread
+
+def clean_description(text):  # the HTML a product description may keep
+    if not hasattr(_cleaners, "cleaner"):
+        _cleaners.cleaner = bleach.sanitizer.Cleaner(tags=ALLOWED_TAGS, strip=True)
+    return _cleaners.cleaner.clean(text)
 
 class User(AbstractUser):
     ROLE_CHOICES = [
@@ -13,13 +25,74 @@ class User(AbstractUser):
 
 class Product(models.Model):
     name = models.CharField(max_length=255)
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)  # stock-keeping unit, the key catalogue imports match on
     description = models.TextField(blank=True)
     quantity = models.PositiveIntegerField(default=0)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     created_at = models.DateTimeField(auto_now_add=True)
+    reorder_threshold = models.PositiveIntegerField(default=5)  # at or below this quantity the product counts as low on stock
+    is_low_stock = models.BooleanField(default=False, editable=False)  # kept in step by every stock write, see app.stock
+    # >0: the stock lives in this many StockStripe counters and quantity is their sum as of the last rebalance, see app.stock
+    stock_stripes = models.PositiveSmallIntegerField(default=0, editable=False)
+    class Meta:
+        indexes = [
+            models.Index(fields=["name"], condition=models.Q(is_low_stock=True), name="product_low_stock_idx"),
+            models.Index(fields=["created_at", "id"], name="product_created_idx"),]  # product list pages
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_low_stock = instance.__dict__.get("is_low_stock")
+        return instance
+
     def save(self, *args, **kwargs):
-        self.description = bleach.clean(self.description, tags=["b", "i", "u", "p", "br"], strip=True)
-        super().save(*args, **kwargs)
+        self.description = clean_description(self.description)
+        self.is_low_stock = self.quantity <= self.reorder_threshold
+        from .stock import save_product, alert_low_stock  # a stock change is journaled in the same transaction as the save
+        from .db import write_transaction
+        crossed = self.is_low_stock and not getattr(self, "_loaded_low_stock", False)  # the edit takes it below its threshold
+        with write_transaction() if crossed else nullcontext():  # the alert is written with the flag
+            save_product(self, lambda: super(Product, self).save(*args, **kwargs), kwargs.get("update_fields"))
+            if crossed:
+                alert_low_stock(self.pk, self.name, self.quantity)
+        self._loaded_low_stock = self.is_low_stock
+
+    def __str__(self):  # what admin autocompletes and raw id fields show
+        return f"{self.name} ({self.sku})" if self.sku else self.name
+
+class StockStripe(models.Model):  # one of the counters a striped product's stock is split over, see app.stock
+    product = models.ForeignKey("Product", on_delete=models.CASCADE, related_name="stripes")
+    stripe = models.PositiveSmallIntegerField()
+    quantity = models.PositiveIntegerField(default=0)
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["product", "stripe"], name="unique_stock_stripe")]
+    def __str__(self):
+        return f"{self.product_id} - stripe {self.stripe} - {self.quantity}"
+
+class StockMovement(models.Model):  # append-only journal of every stock change, written with the change itself, see app.stock
+    KIND_CHOICES = [
+        ("reservation", "Reservation"),  # an order placed or reinstated
+        ("cancellation", "Cancellation"),  # an order canceled, its stock released
+        ("restock", "Restock"),  # the opening stock of a new product
+        ("adjustment", "Adjustment"),]  # a manual edit or catalogue import of the quantity
+    product = models.ForeignKey("Product", on_delete=models.CASCADE, db_index=False)  # stock_movement_product_idx leads with it
+    kind = models.CharField(max_length=12, choices=KIND_CHOICES)
+    delta = models.IntegerField()  # signed change of the product's stock
+    # no constraint: the movement outlives its order when the order is archived
+    order = models.ForeignKey("Order", null=True, blank=True, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+")
+    created_at = models.DateTimeField(default=timezone.now)
+    class Meta:
+        indexes = [models.Index(fields=["product", "created_at", "id"], name="stock_movement_product_idx")]  # a product's tail after a snapshot
+    def __str__(self):
+        return f"{self.product_id} {self.kind} {self.delta:+d}"
+
+class StockSnapshot(models.Model):  # a product's stock as of taken_at, checkpointed daily by app.journal
+    product = models.ForeignKey("Product", on_delete=models.CASCADE, db_index=False)  # unique_stock_snapshot leads with it
+    taken_at = models.DateTimeField()
+    quantity = models.IntegerField()
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["product", "taken_at"], name="unique_stock_snapshot")]
+    def __str__(self):
+        return f"{self.product_id} @ {self.taken_at:%Y-%m-%d %H:%M} - {self.quantity}"
 
 class Order(models.Model):
     STATUS_CHOICES = [
@@ -28,33 +101,27 @@ class Order(models.Model):
         ("canceled", "Canceled"),]
     product = models.ForeignKey("Product", on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField()
-    ordered_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    ordered_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_index=False)  # order_user_placed_idx leads with it
     ordered_at = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="pending")
+    # the product's price when the order last completed, what the daily sales rollup counts it at, see app.rollup
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)  # bumped on every change, drives the live order list
+    class Meta:
+        indexes = [
+            models.Index(fields=["updated_at", "id"], name="order_updated_idx"),
+            models.Index(fields=["ordered_at", "id"], name="order_placed_idx"),  # order list pages, date-range exports
+            models.Index(fields=["ordered_by", "ordered_at", "id"], name="order_user_placed_idx"),  # an employee's order pages
+            models.Index(fields=["status", "ordered_at"], name="order_status_placed_idx"),]  # status counts and ranges, covers the dashboard figures
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_status = instance.__dict__.get("status")  # remembered so a status change needs no pre-read
+        return instance
+
     def save(self, *args, **kwargs):
-        if self.pk:
-            previous_order = Order.objects.get(pk=self.pk)
-        else:
-            previous_order = None
-        if previous_order is None:
-            product = self.product
-            if product.quantity >= self.quantity:
-                product.quantity -= self.quantity
-                product.save()
-            else:
-                raise ValueError("Not enough stock available!")
-        elif previous_order.status != "canceled" and self.status == "canceled":
-            product = self.product
-            product.quantity += self.quantity
-            product.save()
-        elif previous_order.status == "canceled" and self.status != "canceled":
-            product = self.product
-            if product.quantity >= self.quantity:
-                product.quantity -= self.quantity
-                product.save()
-            else:
-                raise ValueError("Not enough stock available!")
-        super().save(*args, **kwargs)
+        from .stock import save_order  # stock is reserved/released in the same transaction as the save
+        save_order(self, lambda: super(Order, self).save(*args, **kwargs))
 
     @property
     def total_price(self):
@@ -63,12 +130,75 @@ class Order(models.Model):
     def __str__(self):
         return f"Order {self.id} - {self.product.name} - {self.status.capitalize()}"
 
+class OrderArchive(models.Model):  # completed or canceled orders moved out of the hot table by app.archive, under their original id
+    STATUS_CHOICES = [choice for choice in Order.STATUS_CHOICES if choice[0] != "pending"]
+    id = models.BigIntegerField(primary_key=True)
+    product = models.ForeignKey("Product", on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    ordered_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    ordered_at = models.DateTimeField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    class Meta:
+        indexes = [models.Index(fields=["ordered_at", "id"], name="order_archive_placed_idx")]
+    def __str__(self):
+        return f"Archived order {self.id} - {self.status.capitalize()}"
+
 class Report(models.Model):
     REPORT_TYPES = [
         ('sales', 'Sales Report'),
         ('low_stock', 'Low Stock Report'),]
     report_type = models.CharField(max_length=20, choices=REPORT_TYPES)
     generated_at = models.DateTimeField(auto_now_add=True)
-    details = models.TextField(default="")
+    details = models.TextField(default="")  # preformatted text, used by low-stock alerts and sales reports from before report_date
+    report_date = models.DateField(null=True, blank=True)  # the day a sales report covers
+    data = models.JSONField(default=dict, blank=True)  # per-product units and revenue of a sales report, see app.reports
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["report_type", "report_date"], condition=models.Q(report_date__isnull=False), name="unique_dated_report")]
+        indexes = [models.Index(fields=["generated_at", "id"], name="report_generated_idx")]  # the newest-first report list
     def __str__(self):
         return f"{self.get_report_type_display()} - {self.generated_at.strftime('%Y-%m-%d %H:%M')}"
+
+class DailyProductSales(models.Model):  # completed-order totals per (day, product), maintained by app.rollup
+    date = models.DateField()
+    product = models.ForeignKey("Product", on_delete=models.CASCADE)
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["date", "product"], name="unique_daily_product_sales")]
+    def __str__(self):
+        return f"{self.date} - {self.product_id} - {self.units} units"
+
+class Job(models.Model):  # persistent background job, run by "manage.py run_worker", see app.jobs
+    STATUS_CHOICES = [
+        ("queued", "Queued"),
+        ("running", "Running"),
+        ("done", "Done"),
+        ("failed", "Failed"),]
+    kind = models.CharField(max_length=50)
+    key = models.CharField(max_length=100, unique=True, null=True, blank=True)  # idempotency key, e.g. "sales_report:2025-02-19"
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="queued")
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    class Meta:
+        indexes = [models.Index(fields=["run_after", "id"], condition=models.Q(status="queued"), name="job_queued_idx")]
+    def __str__(self):
+        return f"Job {self.id} - {self.kind} - {self.status.capitalize()}"
+
+class SchedulerLease(models.Model):  # cluster-wide lock row; whoever holds an unexpired lease is the scheduler leader
+    name = models.CharField(max_length=50, unique=True)
+    owner = models.CharField(max_length=100)
+    expires_at = models.DateTimeField()
+    heartbeat_at = models.DateTimeField(default=timezone.now)
+    def __str__(self):
+        return f"{self.name} - {self.owner} until {self.expires_at:%Y-%m-%d %H:%M:%S}"
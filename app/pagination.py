@@ -0,0 +1,63 @@
+import base64
+import json
+from datetime import datetime
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+PAGE_SIZE = 50
+
+def encode_cursor(value, pk):  # opaque token for the (timestamp, id) of the last row on a page
+    raw = json.dumps([value.isoformat(), pk]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(token):  # -> (datetime, id), or None for a missing or tampered token
+    if not token:
+        return None
+    try:
+        value, pk = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        return datetime.fromisoformat(value), int(pk)
+    except (ValueError, TypeError):
+        return None
+
+def keyset_page(queryset, field, cursor, per_page=PAGE_SIZE):
+    """Return ``(rows, next_cursor)`` for ``queryset`` newest first by ``(field, id)``.
+
+    Rows after the cursor are found with a range predicate on ``(field, id)`` instead of an
+    OFFSET, so every page costs the same however deep into the history it is.
+    """
+    queryset = queryset.order_by(f"-{field}", "-id")
+    position = decode_cursor(cursor)
+    if position:
+        value, pk = position
+        queryset = queryset.filter(Q(**{f"{field}__lt": value}) | Q(**{field: value, "id__lt": pk}))
+    rows = list(queryset[:per_page + 1])  # one extra row tells us whether there is a next page
+    if len(rows) <= per_page:
+        return rows, None
+    last = rows[per_page - 1]
+    return rows[:per_page], encode_cursor(getattr(last, field), last.pk)
+
+class KeysetPage:  # keyset_page() run on first use, so a page rendered from a cached fragment costs no query
+    def __init__(self, queryset, field, cursor, per_page=PAGE_SIZE):
+        self.queryset, self.field, self.cursor, self.per_page = queryset, field, cursor, per_page
+
+    @cached_property
+    def _page(self):
+        return keyset_page(self.queryset, self.field, self.cursor, self.per_page)
+
+    @property
+    def rows(self):
+        return self._page[0]
+
+    @property
+    def next_cursor(self):
+        return self._page[1]
+
+def head_cursor(queryset, field):  # cursor of the newest row by (field, id), "" for an empty table
+    head = queryset.order_by(f"-{field}", "-id").values_list(field, "id").first()
+    return encode_cursor(*head) if head else ""
+
+def rows_after(queryset, field, cursor, limit):
+    """Return up to ``limit`` rows after ``cursor`` oldest first by ``(field, id)``, plus the new cursor."""
+    value, pk = cursor
+    rows = list(queryset.filter(Q(**{f"{field}__gt": value}) | Q(**{field: value, "id__gt": pk})).order_by(field, "id")[:limit])
+    return rows, encode_cursor(getattr(rows[-1], field), rows[-1].pk) if rows else None
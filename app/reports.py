@@ -0,0 +1,65 @@
+from datetime import date, timedelta
+from decimal import Decimal
+from django.db.models import Sum
+from django.utils.dateparse import parse_date
+from django.utils.timezone import localdate
+from .models import DailyProductSales, Product
+
+PERIODS = {"week": 7, "month": 30, "quarter": 90, "year": 365}  # trailing windows, in days up to and including today
+
+def _money(value):  # Decimal -> "12.50"; SQLite hands SUM() back without its scale
+    return str(Decimal(value or 0).quantize(Decimal("0.01")))
+
+def _products(rows):  # grouped rollup rows -> JSON-safe product lines, best sellers first
+    return [{"product_id": row["product_id"], "name": row["product__name"], "orders": row["orders"],
+             "units": row["units"], "revenue": _money(row["revenue"])} for row in rows]
+
+def daily_snapshot(day):
+    """Return the structured content of the sales report for ``day``, read from the daily rollup."""
+    rows = (DailyProductSales.objects.filter(date=day, units__gt=0)
+        .values("product_id", "product__name", "orders", "units", "revenue")
+        .order_by("-revenue", "product__name"))
+    products = _products(rows)
+    return {"products": products, "units": sum(row["units"] for row in products),
+            "revenue": _money(sum(Decimal(row["revenue"]) for row in products))}
+
+def sales_range(start, end, product_id=None):
+    """Merge the daily figures from ``start`` to ``end`` (inclusive) into one report.
+
+    Two grouped queries over the (date, product) rollup and one for the product names, whatever the
+    length of the range.
+    The result has the same shape as a daily snapshot plus a per-day ``days`` series.
+    """
+    rows = DailyProductSales.objects.filter(date__range=(start, end), units__gt=0)
+    if product_id is not None:
+        rows = rows.filter(product_id=product_id)
+    # grouped on the rollup alone; joining every row to its product costs more than naming the totals afterwards
+    totals = list(rows.values("product_id").annotate(orders=Sum("orders"), units=Sum("units"), revenue=Sum("revenue")).order_by())
+    names = dict(Product.objects.filter(pk__in=[row["product_id"] for row in totals]).values_list("pk", "name"))
+    for row in totals:
+        row["product__name"] = names.get(row["product_id"], "")
+    products = _products(sorted(totals, key=lambda row: (-row["revenue"], row["product__name"])))
+    totals = {row["date"]: row for row in rows.values("date").annotate(units=Sum("units"), revenue=Sum("revenue")).order_by()}
+    days = []
+    for offset in range((end - start).days + 1):
+        day = start + timedelta(days=offset)
+        row = totals.get(day, {"units": 0, "revenue": 0})
+        days.append({"date": day.isoformat(), "units": row["units"], "revenue": _money(row["revenue"])})
+    return {"start": start.isoformat(), "end": end.isoformat(), "product_id": product_id, "products": products, "days": days,
+            "units": sum(row["units"] for row in products),
+            "revenue": _money(sum(Decimal(row["revenue"]) for row in products))}
+
+def report_range(period, start=None, end=None, today=None):
+    """Return the ``(start, end)`` dates of a named trailing period, or of a custom range of ISO dates.
+
+    Raises ``ValueError`` for an unknown period or a malformed or inverted range.
+    """
+    today = today or localdate()
+    if period in PERIODS:
+        return today - timedelta(days=PERIODS[period] - 1), today
+    if period != "custom":
+        raise ValueError("unknown period!")
+    start, end = (value if isinstance(value, date) else parse_date(value or "") for value in (start, end))
+    if start is None or end is None or start > end:
+        raise ValueError("enter a start and end date, start first!")
+    return start, end
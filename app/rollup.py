@@ -0,0 +1,76 @@
+from decimal import Decimal
+from django.db import transaction, IntegrityError
+from django.db.models import F, Sum, Count, DecimalField
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils.timezone import localdate
+from .models import Order, OrderArchive, Product, DailyProductSales
+
+def record_sale(order, sign=1):
+    """Add (sign=1) or remove (sign=-1) a completed order from its day's rollup row, at the unit price it completed at."""
+    record_sales([order], sign)
+
+def record_sales(orders, sign=1):  # record_sale() for many orders, one rollup write per (day, product)
+    groups = {}
+    for order, price in zip(orders, _unit_prices(orders)):
+        key = (localdate(order.ordered_at), order.product_id)
+        count, units, revenue = groups.get(key, (0, 0, Decimal(0)))
+        groups[key] = (count + sign, units + sign * order.quantity, revenue + sign * order.quantity * price)
+    for (day, product_id), (count, units, revenue) in groups.items():
+        _add_sales(day, product_id, count, units, revenue)
+
+def _unit_prices(orders):  # each order's unit_price; orders completed without one (bulk inserts) count at the product's current price
+    missing = {order.product_id for order in orders if order.unit_price is None}
+    current = dict(Product.objects.filter(pk__in=missing).values_list("pk", "price")) if missing else {}
+    return [current.get(order.product_id, 0) if order.unit_price is None else order.unit_price for order in orders]
+
+def _add_sales(day, product_id, orders, units, revenue):
+    changes = {"orders": F("orders") + orders, "units": F("units") + units, "revenue": F("revenue") + revenue}
+    row = DailyProductSales.objects.filter(date=day, product_id=product_id)
+    if row.update(**changes) or orders < 0:  # nothing to take away from a day that was never rolled up
+        return
+    try:
+        with transaction.atomic():
+            DailyProductSales.objects.create(date=day, product_id=product_id, orders=orders, units=units, revenue=revenue)
+    except IntegrityError:  # another transaction created the row first
+        row.update(**changes)
+
+def order_changed(order, previous_status):  # previous_status is None for a brand new order
+    if previous_status != "completed" and order.status == "completed":
+        record_sale(order, 1)
+    elif previous_status == "completed" and order.status != "completed":
+        record_sale(order, -1)
+
+def order_deleted(sender, instance, **kwargs):  # post_delete receiver
+    if instance.status == "completed":
+        record_sale(instance, -1)
+
+def _totals(model):  # completed-order totals per (day, product) of one tier
+    return (model.objects.filter(status="completed")
+        .annotate(day=TruncDate("ordered_at")).values("day", "product_id")
+        .annotate(orders=Count("id"), units=Sum("quantity"),
+                  revenue=Sum(F("quantity") * Coalesce(F("unit_price"), F("product__price")), output_field=DecimalField()))
+        .order_by())
+
+def _all_totals(batch_size):  # both tiers' totals, each (day, product) once
+    # the hot table only holds recent days, so its totals fit in memory and are merged into the archive's as they stream
+    recent = {(row["day"], row["product_id"]): row for row in _totals(Order)}
+    for row in _totals(OrderArchive).iterator(chunk_size=batch_size):
+        hot = recent.pop((row["day"], row["product_id"]), None)
+        if hot:
+            row = dict(row, orders=row["orders"] + hot["orders"], units=row["units"] + hot["units"], revenue=row["revenue"] + hot["revenue"])
+        yield row
+    yield from recent.values()
+
+def rebuild(batch_size=1000):
+    """Recompute the whole rollup from the order history, archived orders included. Returns the number of rows written."""
+    written = 0
+    with transaction.atomic():
+        DailyProductSales.objects.all().delete()
+        batch = []
+        for row in _all_totals(batch_size):
+            batch.append(DailyProductSales(date=row["day"], product_id=row["product_id"], orders=row["orders"], units=row["units"], revenue=row["revenue"]))
+            if len(batch) >= batch_size:
+                written += len(DailyProductSales.objects.bulk_create(batch))
+                batch = []
+        written += len(DailyProductSales.objects.bulk_create(batch))
+    return written
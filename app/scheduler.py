@@ -1,10 +1,104 @@
-from apscheduler.schedulers.background import BackgroundScheduler
-from .tasks import generate_daily_sales_report
-
-def start_scheduler():
-    scheduler = BackgroundScheduler()
-    if not scheduler.running:
-        # Remove old jobs before adding a new one
-        scheduler.remove_all_jobs()
-        scheduler.add_job(generate_daily_sales_report, "cron", hour=23, minute=59)
+import functools
+import logging
+import os
+import socket
+import uuid
+from datetime import time, timedelta
+from apscheduler.schedulers.blocking import BlockingScheduler
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import Report, SchedulerLease, StockSnapshot
+from .jobs import enqueue_sales_report, enqueue_order_archival, enqueue_stock_snapshot, enqueue_analyze
+from .metrics import track_job
+from .stock import rebalance_striped
+from .journal import start_of_day
+
+logger = logging.getLogger(__name__)
+LEASE_NAME = "scheduler"
+SALES_REPORT_AT = time(23, 59)  # local time of the daily jobs whose missed runs catch_up() makes good
+STOCK_SNAPSHOT_AT = time(0, 5)
+_leaders = set()  # owners in this process that held the lease at their last attempt, see leader_only()
+
+def lease_seconds():
+    return getattr(settings, "SCHEDULER_LEASE_SECONDS", 60)
+
+def acquire_lease(owner, name=LEASE_NAME):
+    """Take the lease, or renew it if ``owner`` already holds it. Returns True while ``owner`` is the leader."""
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=lease_seconds())
+    # renew our own lease or take over an expired one, in a single conditional UPDATE
+    if SchedulerLease.objects.filter(Q(owner=owner) | Q(expires_at__lt=now), name=name).update(owner=owner, expires_at=expires_at, heartbeat_at=now):
+        return True
+    try:
+        with transaction.atomic():
+            SchedulerLease.objects.create(name=name, owner=owner, expires_at=expires_at, heartbeat_at=now)
+        return True
+    except IntegrityError:  # someone else holds a live lease
+        return False
+
+def release_lease(owner, name=LEASE_NAME):
+    SchedulerLease.objects.filter(name=name, owner=owner).delete()
+
+def catch_up(now=None):
+    """Queue the daily jobs whose last run left nothing behind; a process runs this when it becomes the leader.
+
+    The scheduler's jobstore lives in memory, so runs that fell due while no process held the lease (a
+    dead leader's lease takes up to SCHEDULER_LEASE_SECONDS to expire) are not retried. Instead the
+    latest sales report and stock checkpoint that should exist by now are looked for, and queued when
+    missing; queueing is idempotent by key. Returns the jobs queued.
+    """
+    now = timezone.localtime(now)
+    report_day = now.date() if now.time() >= SALES_REPORT_AT else now.date() - timedelta(days=1)
+    snapshot_day = now.date() if now.time() >= STOCK_SNAPSHOT_AT else now.date() - timedelta(days=1)
+    queued = []
+    if not Report.objects.filter(report_type="sales", report_date=report_day).exists():
+        queued.append(enqueue_sales_report(report_day))
+    if not StockSnapshot.objects.filter(taken_at=start_of_day(snapshot_day)).exists():
+        queued.append(enqueue_stock_snapshot(snapshot_day))
+    return queued
+
+def leader_only(owner, func):  # run a scheduled job only while this process holds the lease
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        if not acquire_lease(owner):
+            _leaders.discard(owner)
+            logger.info("Skipping %s, another process is the scheduler leader.", func.__name__)
+            return None
+        if owner not in _leaders:  # just took over, maybe from a leader that died before its daily jobs ran
+            _leaders.add(owner)
+            for job in catch_up():
+                logger.info("Became the scheduler leader, queued missed job %s.", job.key)
+        with track_job(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+def heartbeat():  # nothing to do, acquiring the lease in leader_only() is the heartbeat
+    return None
+
+def build_scheduler(owner):
+    """The cluster's scheduled jobs; every process may build one, only the lease holder runs the jobs."""
+    options = {
+        "coalesce": True,  # several missed runs collapse into one
+        "misfire_grace_time": getattr(settings, "SCHEDULER_MISFIRE_GRACE_SECONDS", 3600),  # a late run still happens within this window
+        "max_instances": 1,}
+    scheduler = BlockingScheduler()
+    # heartbeat: keeps the leader's lease alive and lets a standby take over once it expires
+    scheduler.add_job(leader_only(owner, heartbeat), "interval", seconds=max(lease_seconds() // 3, 1), id="heartbeat", next_run_time=timezone.now(), **options)
+    scheduler.add_job(leader_only(owner, enqueue_sales_report), "cron", hour=SALES_REPORT_AT.hour, minute=SALES_REPORT_AT.minute, id="daily_sales_report", **options)  # the worker does the heavy lifting
+    scheduler.add_job(leader_only(owner, enqueue_stock_snapshot), "cron", hour=STOCK_SNAPSHOT_AT.hour, minute=STOCK_SNAPSHOT_AT.minute, id="stock_snapshot", **options)  # checkpoints stock as of midnight
+    scheduler.add_job(leader_only(owner, enqueue_order_archival), "cron", hour=3, minute=30, id="order_archival", **options)  # off-peak, keeps the orders table small
+    scheduler.add_job(leader_only(owner, enqueue_analyze), "cron", hour=4, minute=15, id="analyze_database", **options)  # after archival, feeds the admin's estimated counts
+    # evens out striped products' stock and refreshes their quantity column
+    scheduler.add_job(leader_only(owner, rebalance_striped), "interval", seconds=getattr(settings, "STOCK_REBALANCE_SECONDS", 60), id="stock_rebalance", **options)
+    return scheduler
+
+def run_scheduler():
+    owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    scheduler = build_scheduler(owner)
+    try:
         scheduler.start()
+    finally:
+        release_lease(owner)  # let a standby take over right away
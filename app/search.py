@@ -0,0 +1,85 @@
+import re
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.functional import cached_property
+from .models import Product
+from .db import replica_reads
+from .pagination import PAGE_SIZE
+from .stock import stock
+
+TYPEAHEAD_SIZE = 10  # suggestions per typeahead response
+MIN_QUERY_LENGTH = 2
+MAX_TERMS = 8
+SEARCH_SQL = """
+    SELECT app_product.id, app_product.name, app_product.sku, app_product.description, {stock} AS available,
+           app_product.price, app_product.is_low_stock, app_product.created_at
+    FROM app_product_search JOIN app_product ON app_product.id = app_product_search.rowid
+    WHERE app_product_search MATCH %s{in_stock}
+    ORDER BY app_product_search.rank, app_product.id
+    LIMIT %s OFFSET %s"""
+# app.stock.stock() in SQL: a striped product's stock is the sum of its stripes
+STOCK_SQL = """CASE WHEN app_product.stock_stripes = 0 THEN app_product.quantity
+    ELSE (SELECT COALESCE(SUM(quantity), 0) FROM app_stockstripe WHERE product_id = app_product.id) END"""
+
+def terms(text):
+    return re.findall(r"\w+", text)[:MAX_TERMS]
+
+def match_expression(text):  # every word typed, as a prefix, all of them required: "fork li" -> "fork"* "li"*
+    return " ".join(f'"{term}"*' for term in terms(text))
+
+def full_text():  # the FTS5 index only exists on SQLite (see migration 0016); other databases search with icontains
+    return connection.vendor == "sqlite"
+
+def _containing(queryset, text):  # every word typed, anywhere in the name, SKU or description
+    for term in terms(text):
+        queryset = queryset.filter(Q(name__icontains=term) | Q(sku__icontains=term) | Q(description__icontains=term))
+    return queryset
+
+def search_products(text, page=1, per_page=TYPEAHEAD_SIZE, in_stock=False):
+    """Return ``(products, next_page)`` matching ``text`` on name, SKU or description, best match first.
+
+    Runs against the ``app_product_search`` FTS5 index (see migration 0016), so its cost depends on the
+    matches rather than the size of the catalogue. Without the index (not SQLite) every product is scanned
+    with ``icontains`` and the oldest match comes first. ``next_page`` is None on the last page.
+    """
+    expression = match_expression(text)
+    if len(text.strip()) < MIN_QUERY_LENGTH or not expression:
+        return [], None
+    offset = (page - 1) * per_page
+    with replica_reads():
+        if full_text():
+            sql = SEARCH_SQL.format(stock=STOCK_SQL, in_stock=f" AND {STOCK_SQL} > 0" if in_stock else "")
+            products = list(Product.objects.raw(sql, [expression, per_page + 1, offset]))  # one extra row tells us whether there is a next page
+        else:
+            products = _containing(Product.objects.only("id", "name", "sku", "description", "price", "is_low_stock", "created_at"), text)
+            products = products.annotate(available=stock())
+            if in_stock:
+                products = products.filter(available__gt=0)
+            products = list(products.order_by("id")[offset:offset + per_page + 1])
+    return products[:per_page], page + 1 if len(products) > per_page else None
+
+def matching(queryset, text):
+    """``queryset`` narrowed to the products matching ``text``, through the same index, e.g. for admin searches."""
+    expression = match_expression(text)
+    if not expression:
+        return queryset.none()
+    if not full_text():
+        return _containing(queryset, text)
+    return queryset.filter(pk__in=RawSQL("SELECT rowid FROM app_product_search WHERE app_product_search MATCH %s", [expression]))
+
+class SearchPage:  # search_products() run on first use, so a page rendered from a cached fragment costs no query
+    def __init__(self, text, page, per_page=PAGE_SIZE):
+        self.text, self.page, self.per_page = text, page, per_page
+
+    @cached_property
+    def _page(self):
+        return search_products(self.text, self.page, self.per_page)
+
+    @property
+    def rows(self):
+        return self._page[0]
+
+    @property
+    def next_page(self):
+        return self._page[1]
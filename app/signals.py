@@ -0,0 +1,14 @@
+from django.contrib.auth.signals import user_logged_in as logged_in
+from django.db.models.signals import post_save, post_delete
+from .models import User, Order, Product, Report
+from .caching import model_changed
+from .rollup import order_deleted
+from .auth import user_changed, user_logged_in
+
+for model in (Product, Order, Report):
+    post_save.connect(model_changed, sender=model, dispatch_uid=f"caching_{model.__name__}_saved")
+    post_delete.connect(model_changed, sender=model, dispatch_uid=f"caching_{model.__name__}_deleted")
+post_delete.connect(order_deleted, sender=Order, dispatch_uid="rollup_order_deleted")
+post_save.connect(user_changed, sender=User, dispatch_uid="auth_user_saved")
+post_delete.connect(user_changed, sender=User, dispatch_uid="auth_user_deleted")
+logged_in.connect(user_logged_in, dispatch_uid="auth_user_logged_in")
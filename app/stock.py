@@ -0,0 +1,307 @@
+import random
+from django.db.models import F, Q, Case, When, Value, OuterRef, Subquery, Sum, DecimalField
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import GreaterThan, LessThanOrEqual
+from .models import Product, Order, Report, StockStripe, StockMovement
+from .caching import models_changed
+from django.utils import timezone
+from .rollup import order_changed, record_sales
+from .events import publish
+from .db import write_transaction
+
+class InsufficientStock(ValueError):  # subclass of ValueError so existing "except ValueError" callers keep working
+    pass
+
+def holds_stock(status):  # every status except canceled keeps its quantity reserved
+    return status != "canceled"
+
+def stock():
+    """A product's available quantity as an expression: the quantity column, or the sum of its stripes when striped."""
+    stripes = StockStripe.objects.filter(product=OuterRef("pk")).values("product").annotate(total=Sum("quantity")).values("total")
+    return Case(When(stock_stripes=0, then=F("quantity")), default=Coalesce(Subquery(stripes), 0))
+
+def reserve(product_id, quantity):
+    # conditional decrement: UPDATE ... SET quantity = quantity - n WHERE id = ? AND quantity >= n
+    updated = Product.objects.filter(pk=product_id, stock_stripes=0, quantity__gte=quantity).update(quantity=F("quantity") - quantity)
+    if not updated and not _reserve_striped(product_id, quantity):  # missing, short on stock, or striped and short
+        raise InsufficientStock("Not enough stock available!")
+
+def _reserve_striped(product_id, quantity):  # False when the product is not striped
+    stripes = Product.objects.filter(pk=product_id).values_list("stock_stripes", flat=True).first()
+    if not stripes:
+        return False
+    # the same guarded decrement on one stripe picked at random, so concurrent orders mostly lock different rows
+    if not StockStripe.objects.filter(product_id=product_id, stripe=random.randrange(stripes), quantity__gte=quantity).update(quantity=F("quantity") - quantity):
+        rebalance(product_id, take=quantity)  # that stripe ran short: take from the total and spread the rest out again
+    return True
+
+def flag_if_low(product_id):
+    """Mark the product low on stock if a reservation just took it to its threshold.
+
+    Only the write that flips the flag matches the UPDATE, so the alert is raised exactly once per
+    crossing; release() clears the flag again when stock climbs back above the threshold.
+    """
+    if Product.objects.filter(LessThanOrEqual(stock(), F("reorder_threshold")), pk=product_id, is_low_stock=False).update(is_low_stock=True):
+        name, quantity = Product.objects.annotate(available=stock()).values_list("name", "available").get(pk=product_id)
+        alert_low_stock(product_id, name, quantity)
+
+def alert_low_stock(product_id, name, quantity):
+    """Raise the alert for a product that just went low on stock; call it in the transaction that sets its flag.
+
+    The alert is kept as a low-stock report, committed or rolled back with the flag, so it is not lost
+    when no dashboard is listening or the event is published in another process. Open dashboards are
+    pushed the event once the transaction commits.
+    """
+    Report.objects.create(report_type="low_stock", details=f"{name}: Only {quantity} left!")
+    publish("low_stock", product=product_id, name=name, quantity=quantity)
+
+def release(product_id, quantity):
+    if Product.objects.filter(pk=product_id, stock_stripes=0).update(
+            quantity=F("quantity") + quantity,
+            # the right-hand side sees the old quantity, so this tests the quantity after the release
+            is_low_stock=Case(When(quantity__lte=F("reorder_threshold") - quantity, then=F("is_low_stock")), default=Value(False))):
+        return
+    stripes = Product.objects.filter(pk=product_id).values_list("stock_stripes", flat=True).first()
+    if stripes:
+        StockStripe.objects.filter(product_id=product_id, stripe=random.randrange(stripes)).update(quantity=F("quantity") + quantity)
+        Product.objects.filter(GreaterThan(stock(), F("reorder_threshold")), pk=product_id, is_low_stock=True).update(is_low_stock=False)
+
+def rebalance(product_id, take=0, total=None):
+    """Spread a striped product's stock evenly over its stripes again and refresh its quantity column.
+
+    ``take`` units are reserved from the total first (``InsufficientStock`` if it is short); ``total``
+    replaces the stock altogether. Returns the quantity left.
+    """
+    with write_transaction():
+        stripes = list(StockStripe.objects.select_for_update().filter(product_id=product_id).order_by("stripe"))
+        if not stripes:
+            return None
+        available = sum(stripe.quantity for stripe in stripes) if total is None else total
+        if available < take:
+            raise InsufficientStock("Not enough stock available!")
+        left = available - take
+        for index, stripe in enumerate(stripes):
+            stripe.quantity = left // len(stripes) + (index < left % len(stripes))
+        StockStripe.objects.bulk_update(stripes, ["quantity"])
+        if Product.objects.filter(pk=product_id).exclude(quantity=left).update(quantity=left):
+            models_changed(Product)  # update() sends no post_save signal
+    return left
+
+def set_stock(product_id, quantity):  # a new absolute stock level for a striped product, e.g. from an edit
+    return rebalance(product_id, total=quantity)
+
+def rebalance_striped():  # periodic: even out every striped product and bring its quantity column up to date
+    for product_id in Product.objects.filter(stock_stripes__gt=0).values_list("pk", flat=True):
+        rebalance(product_id)
+
+def stripe_stock(product_id, stripes):
+    """Split a product's stock over ``stripes`` counters, or fold it back into its quantity column with 0.
+
+    Orders for a striped product decrement one random stripe instead of the product row, so on a
+    database with row locks (PostgreSQL, MySQL) concurrent orders for one hot SKU stop queueing behind
+    each other. Reads see the sum: ``stock()`` exactly, the quantity column as of the last rebalance.
+    """
+    with write_transaction():
+        available = Product.objects.annotate(available=stock()).values_list("available", flat=True).get(pk=product_id)
+        StockStripe.objects.filter(product_id=product_id).delete()
+        StockStripe.objects.bulk_create([StockStripe(product_id=product_id, stripe=stripe, quantity=available // stripes + (stripe < available % stripes))
+            for stripe in range(stripes)])
+        Product.objects.filter(pk=product_id).update(stock_stripes=stripes, quantity=available)
+    models_changed(Product)
+
+def save_product(product, save, update_fields=None):
+    """Run ``save`` (the model's own save) and journal the change of the product's stock in one transaction.
+
+    The stock is re-read inside the transaction, so the movement records what the save really changed;
+    a striped product's new quantity is spread over its stripes.
+    """
+    if update_fields is not None and "quantity" not in update_fields:
+        save()
+        return
+    with write_transaction():
+        current = None
+        if not product._state.adding:
+            current = Product.objects.filter(pk=product.pk).annotate(available=stock()).values_list("available", "stock_stripes").first()
+        if current:
+            product.stock_stripes = current[1]  # striping is not the edit's to undo
+        save()
+        previous = current[0] if current else 0
+        if product.stock_stripes and product.quantity != previous:
+            set_stock(product.pk, product.quantity)
+        if product.quantity != previous:
+            StockMovement.objects.create(product_id=product.pk, kind="adjustment" if current else "restock", delta=product.quantity - previous)
+
+def place_order(order):
+    """Reserve stock for a new order; must run inside the transaction that inserts it."""
+    reserve(order.product_id, order.quantity)
+
+def transition_order(order):
+    """Move a saved order to ``order.status`` and re-reserve or release its stock.
+
+    The status change is a compare-and-set on the status the instance was loaded with,
+    so the previous row is only re-read when another request changed it in the meantime.
+    Returns the previous status.
+    """
+    previous = getattr(order, "_loaded_status", None)
+    while True:
+        if previous is None:  # unknown or stale starting point, read the current status
+            previous = Order.objects.filter(pk=order.pk).values_list("status", flat=True).get()
+        if previous == order.status:
+            return previous
+        if Order.objects.filter(pk=order.pk, status=previous).update(status=order.status):
+            break
+        previous = None  # lost a race with a concurrent update, retry from the fresh status
+    if holds_stock(previous) and not holds_stock(order.status):
+        release(order.product_id, order.quantity)
+    elif not holds_stock(previous) and holds_stock(order.status):
+        reserve(order.product_id, order.quantity)
+    return previous
+
+def save_order(order, save):
+    """Run ``save`` (the model's own save) together with the stock change in one transaction."""
+    with write_transaction():  # BEGIN IMMEDIATE, so concurrent orders wait for the lock instead of failing
+        if order._state.adding:
+            place_order(order)
+            previous = None
+        else:
+            previous = transition_order(order)
+        if order.status == "completed" and previous != "completed":  # the price it completes at is what the rollup counts it at
+            order.unit_price = Product.objects.values_list("price", flat=True).get(pk=order.product_id)
+        save()
+        order_changed(order, previous)  # keep the daily sales rollup in step
+        if previous is None:
+            publish("order_created", order=order.pk, product=order.product_id, quantity=order.quantity, status=order.status)
+        elif previous != order.status:
+            publish("order_status_changed", order=order.pk, previous=previous, status=order.status)
+        if previous is None or (holds_stock(order.status) and not holds_stock(previous)):  # stock was just reserved
+            StockMovement.objects.create(product_id=order.product_id, kind="reservation", delta=-order.quantity, order_id=order.pk)
+            flag_if_low(order.product_id)
+        elif holds_stock(previous) and not holds_stock(order.status):
+            StockMovement.objects.create(product_id=order.product_id, kind="cancellation", delta=order.quantity, order_id=order.pk)
+    order._loaded_status = order.status
+
+def transition_orders(order_ids, status):
+    """Move the orders ``order_ids`` to ``status`` together and return a result per order.
+
+    All in one transaction: each product's stock is reserved or released for all of its orders in one
+    UPDATE, and the statuses change in a single ``UPDATE ... WHERE id IN``. Orders already in ``status``
+    are skipped; the orders of a product without the stock to reinstate all of them are rejected.
+    """
+    order_ids = list(dict.fromkeys(order_ids))
+    results = {order_id: {"order_id": order_id, "status": "rejected", "error": "no such order!"} for order_id in order_ids}
+    with write_transaction():
+        orders = Order.objects.select_for_update().filter(pk__in=order_ids).only("id", "product_id", "quantity", "status", "unit_price", "ordered_at")
+        moving, by_product = [], {}
+        for order in orders:
+            if order.status == status:
+                results[order.pk].update(status="skipped", error=f"already {status}!")
+                continue
+            moving.append(order)
+            if holds_stock(order.status) != holds_stock(status):  # every order moves the same way, so a product only takes or only gives back
+                by_product.setdefault(order.product_id, []).append(order)
+        rejected = set()
+        for product_id, product_orders in sorted(by_product.items()):  # in product order, like _allocate()
+            units = sum(order.quantity for order in product_orders)
+            if not holds_stock(status):
+                release(product_id, units)
+                continue
+            try:
+                reserve(product_id, units)
+            except InsufficientStock:
+                rejected.update(order.pk for order in product_orders)
+                continue
+            flag_if_low(product_id)
+        for order_id in rejected:
+            results[order_id]["error"] = "not enough stock available!"
+        applied = [order for order in moving if order.pk not in rejected]
+        if applied:
+            changes = {"status": status, "updated_at": timezone.now()}  # update() skips auto_now, and the live order list follows updated_at
+            if status == "completed":  # each order keeps the price it completes at, see app.rollup
+                prices = dict(Product.objects.filter(pk__in={order.product_id for order in applied}).values_list("pk", "price"))
+                changes["unit_price"] = Case(*[When(product_id=product_id, then=Value(price)) for product_id, price in prices.items()],
+                                             output_field=DecimalField())
+                for order in applied:
+                    order.unit_price = prices[order.product_id]
+            Order.objects.filter(pk__in=[order.pk for order in applied]).update(**changes)
+            StockMovement.objects.bulk_create([StockMovement(product_id=order.product_id, order_id=order.pk,
+                kind="reservation" if holds_stock(status) else "cancellation", delta=-order.quantity if holds_stock(status) else order.quantity)
+                for order in applied if holds_stock(order.status) != holds_stock(status)])
+            if status == "completed":  # keep the daily sales rollup in step
+                record_sales(applied, 1)
+            else:
+                record_sales([order for order in applied if order.status == "completed"], -1)
+            models_changed(Order)  # update() sends no post_save signal
+            for order in applied:
+                results[order.pk] = {"order_id": order.pk, "status": "applied", "previous": order.status}
+                publish("order_status_changed", order=order.pk, previous=order.status, status=status)
+    return [results[order_id] for order_id in order_ids]
+
+def _parse_line(line):  # -> (product_id, quantity), or None for a malformed line
+    try:
+        product_id, quantity = int(line["product_id"]), int(line["quantity"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    return (product_id, quantity) if quantity > 0 else None
+
+def _allocate(user, lines):
+    results = [{"line": index, "status": "rejected"} for index in range(len(lines))]
+    product_ids = sorted({line[0] for line in lines if line})
+    with write_transaction():
+        # one ordered pass over the affected rows; the row lock is a no-op on sqlite, where the guarded update protects us
+        rows = list(Product.objects.select_for_update().filter(pk__in=product_ids).order_by("pk").annotate(available=stock())
+            .values_list("pk", "available", "reorder_threshold", "stock_stripes"))
+        available = {pk: quantity for pk, quantity, _, _ in rows}
+        thresholds = {pk: threshold for pk, _, threshold, _ in rows}
+        striped = {pk for pk, _, _, stripes in rows if stripes}
+        taken = {}
+        orders = []
+        for index, line in enumerate(lines):
+            if line is None:
+                results[index]["error"] = "invalid quantity!"
+                continue
+            product_id, quantity = line
+            results[index].update(product_id=product_id, quantity=quantity)
+            if product_id not in available:
+                results[index]["error"] = "invalid product selection!"
+            elif available[product_id] - taken.get(product_id, 0) < quantity:
+                results[index]["error"] = "not enough stock available!"
+            else:
+                taken[product_id] = taken.get(product_id, 0) + quantity
+                orders.append((index, Order(product_id=product_id, quantity=quantity, ordered_by=user)))
+        if taken:
+            # a single UPDATE for all products, each row guarded the same way reserve() is
+            plain = {product_id: quantity for product_id, quantity in taken.items() if product_id not in striped}
+            guard = Q()
+            for product_id, quantity in plain.items():
+                guard |= Q(pk=product_id, quantity__gte=quantity)
+            delta = Case(*[When(pk=product_id, then=Value(quantity)) for product_id, quantity in plain.items()])
+            if plain and Product.objects.filter(guard).update(quantity=F("quantity") - delta) != len(plain):
+                raise InsufficientStock("Stock changed during allocation!")  # rolls the whole wave back
+            for product_id in striped & taken.keys():  # striped products take their stock from a stripe each
+                reserve(product_id, taken[product_id])
+            Order.objects.bulk_create([order for _, order in orders])
+            StockMovement.objects.bulk_create([StockMovement(product_id=order.product_id, kind="reservation", delta=-order.quantity, order_id=order.pk)
+                for _, order in orders])
+            models_changed(Order)  # bulk_create and update() send no post_save signal
+            for index, order in orders:
+                results[index].update(status="accepted", order_id=order.pk)
+                publish("order_created", order=order.pk, product=order.product_id, quantity=order.quantity, status=order.status)
+            for product_id, quantity in taken.items():
+                if available[product_id] - quantity <= thresholds[product_id]:  # only products that may have crossed cost a query
+                    flag_if_low(product_id)
+    return results
+
+def place_orders(user, lines, attempts=3):
+    """Place a wave of order lines, accepting or rejecting each one.
+
+    ``lines`` is a list of ``{"product_id": ..., "quantity": ...}`` mappings. Stock for all accepted
+    lines is taken in one guarded UPDATE and the orders are inserted with ``bulk_create``, so a wave
+    costs a handful of queries however many lines it has.
+    """
+    parsed = [_parse_line(line) if isinstance(line, dict) else None for line in lines]
+    for attempt in range(attempts):
+        try:
+            return _allocate(user, parsed)
+        except InsufficientStock:  # a concurrent writer moved stock between the read and the update
+            if attempt == attempts - 1:
+                raise
@@ -1,24 +1,16 @@
-from django.utils.timezone import now
-from django.db.models import Sum, F, DecimalField
-from .models import Order, Report
+import logging
+from django.utils.timezone import localdate, now
+from .models import Report
+from .db import replica_reads, write_transaction
+from .reports import daily_snapshot
 
-def generate_daily_sales_report():
-    today = now().date()
-    Report.objects.filter(report_type="sales", generated_at__date=today).delete()
+logger = logging.getLogger(__name__)
 
-    sales_data = (Order.objects.filter(ordered_at__date=today, status="completed")
-        .values("product__name")
-        .annotate(
-            total_sold=Sum("quantity"),
-            total_price=Sum(F("quantity") * F("product__price"), output_field=DecimalField())
-        ))
-
-    total_revenue = sum(item["total_price"] for item in sales_data)
-    report_lines = ["📊 **Sales Report - {}**\n".format(today.strftime("%B %d, %Y"))]
-    
-    for item in sales_data:
-        report_lines.append(f"🔹 {item['product__name']}: {item['total_sold']} units |  ${item['total_price']:.2f}")
-
-    report_lines.append(f"\n📌 **Total Revenue:**  ${total_revenue:.2f}")
-    Report.objects.create(report_type="sales", details="\n".join(report_lines))
-    print("✅ Daily sales report generated successfully!")
+def generate_daily_sales_report(today=None):
+    today = today or localdate()
+    # store the day's per-product figures as data; they are rendered when viewed and merged for range reports
+    with replica_reads():
+        data = daily_snapshot(today)
+    with write_transaction():  # update_or_create reads before it writes, take the write lock up front
+        Report.objects.update_or_create(report_type="sales", report_date=today, defaults={"data": data, "details": "", "generated_at": now()})
+    logger.info("✅ Daily sales report for %s generated successfully!", today)
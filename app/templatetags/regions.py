@@ -0,0 +1,32 @@
+from django import template
+from django.core.cache.utils import make_template_fragment_key
+from ..caching import regions
+
+register = template.Library()
+
+class RegionCacheNode(template.Node):
+    def __init__(self, nodelist, region, name, vary_on):
+        self.nodelist = nodelist
+        self.region = region
+        self.name = name
+        self.vary_on = vary_on
+
+    def render(self, context):
+        region = regions[self.region.resolve(context)]
+        key = make_template_fragment_key(self.name.resolve(context), [var.resolve(context) for var in self.vary_on])
+        return region.get_or_set(key, lambda: self.nodelist.render(context))
+
+@register.tag("regioncache")
+def do_regioncache(parser, token):
+    """Cache the enclosed fragment in a cache region, keyed on a name and any number of variables.
+
+    ``{% regioncache "catalogue" "product_list" cursor user.role %} ... {% endregioncache %}``
+
+    The fragment lasts the region's TIMEOUT and goes stale as soon as the region's version is bumped.
+    """
+    nodelist = parser.parse(("endregioncache",))
+    parser.delete_first_token()
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError("'regioncache' takes a region, a fragment name and optional vary-on variables")
+    return RegionCacheNode(nodelist, parser.compile_filter(bits[1]), parser.compile_filter(bits[2]), [parser.compile_filter(bit) for bit in bits[3:]])
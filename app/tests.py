@@ -1,9 +1,57 @@
-from django.test import TestCase
+import io
+import json
+import logging
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.cache import caches
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.contrib.auth import get_user_model
-from .models import Product, Order
+from django.db import connection, transaction, OperationalError
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now, localdate, timedelta
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from .models import Product, StockStripe, StockMovement, Order, OrderArchive, Report, DailyProductSales, Job, SchedulerLease
+from .stock import InsufficientStock, place_orders, stock, stripe_stock, rebalance, transition_orders
+from . import journal
+from .tasks import generate_daily_sales_report
+from .rollup import rebuild as rebuild_rollup
+from . import events
+from .jobs import enqueue, enqueue_sales_report, claim, run_pending, work
+from .scheduler import acquire_lease, release_lease, leader_only, build_scheduler, heartbeat
+from . import scheduler
+from .db import write_transaction, replica_reads, ReadReplicaRouter
+from .auth import UserCache, user_cache
+from .caching import regions, models_changed
+from .metrics import registry, MetricsMiddleware
+from asgiref.sync import iscoroutinefunction
+from django.http import HttpResponse
 from django.urls import reverse
+from django.core.files.uploadedfile import SimpleUploadedFile
+from unittest import mock
+from . import catalogue
+from . import benchmarks
+from . import archive
+from .search import search_products, matching
+from .migrations import _search_index as search_index
+from .pagination import encode_cursor
 
 User = get_user_model()
+logger = logging.getLogger(__name__)  # set app.tests to DEBUG to see the contention throughput figures
+
+def setUpModule():  # the file-based caches (reports, region versions) go to a scratch directory, never the running app's
+    scratch = tempfile.mkdtemp()
+    test_caches = {alias: dict(config, LOCATION=f"{scratch}/{alias}") if "FileBasedCache" in config["BACKEND"] else dict(config)
+                   for alias, config in settings.CACHES.items()}
+    override = override_settings(CACHES=test_caches)
+    override.enable()
+    unittest.addModuleCleanup(shutil.rmtree, scratch, ignore_errors=True)
+    unittest.addModuleCleanup(override.disable)
 
 class WarehouseTests(TestCase):
 
@@ -31,3 +79,1335 @@ class WarehouseTests(TestCase):
         order = Order.objects.create(product=self.product, quantity=2, ordered_by=self.employee_user, status="completed")
         self.product.refresh_from_db()
         self.assertEqual(self.product.quantity, 8)  # Stock should be reduced from 10 to 8
+
+class StockLedgerTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="employee01", password="HNfzAf3BzmXWIK0", role="employee")
+        self.product = Product.objects.create(name="Pallet Jack", quantity=5, price=300)
+
+    def test_insufficient_stock_leaves_product_untouched(self):
+        """An order larger than the stock is rejected without changing the product."""
+        with self.assertRaises(InsufficientStock):
+            Order.objects.create(product=self.product, quantity=6, ordered_by=self.user)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 5)
+        self.assertFalse(Order.objects.exists())
+
+    def test_cancel_and_reinstate_move_stock(self):
+        """Canceling releases stock, reinstating reserves it again, without re-reading the order."""
+        order = Order.objects.create(product=self.product, quantity=2, ordered_by=self.user)
+        order = Order.objects.get(pk=order.pk)
+        order.status = "canceled"
+        with self.assertNumQueries(6):  # savepoint, status compare-and-set, stock release, row save, movement, release
+            order.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 5)
+        order.status = "pending"
+        order.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 3)
+
+    def test_stale_instance_does_not_release_twice(self):
+        """Two copies of the same order canceled one after the other only release the stock once."""
+        order = Order.objects.create(product=self.product, quantity=2, ordered_by=self.user)
+        first, second = Order.objects.get(pk=order.pk), Order.objects.get(pk=order.pk)
+        first.status = second.status = "canceled"
+        first.save()
+        second.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 5)
+
+class StockStripeTests(TestCase):
+
+    def setUp(self):
+        regions["catalogue"].clear()  # test writes never commit, so they bump no version
+        self.user = User.objects.create_user(username="employee01", password="HNfzAf3BzmXWIK0", role="employee")
+        self.product = Product.objects.create(name="Pallet Jack", sku="PJ-1", quantity=10, price=300, reorder_threshold=2)
+        stripe_stock(self.product.pk, 4)
+
+    def available(self):
+        return Product.objects.annotate(available=stock()).values_list("available", flat=True).get(pk=self.product.pk)
+
+    def stripes(self):
+        return list(StockStripe.objects.filter(product=self.product).order_by("stripe").values_list("quantity", flat=True))
+
+    def test_stock_is_split_and_orders_take_from_the_stripes(self):
+        """Striping spreads the stock evenly; orders and cancellations move the stripes and reads see their sum."""
+        self.assertEqual(self.stripes(), [3, 3, 2, 2])
+        order = Order.objects.create(product=self.product, quantity=2, ordered_by=self.user)
+        self.assertEqual((self.available(), sum(self.stripes())), (8, 8))
+        order.status = "canceled"
+        order.save()
+        self.assertEqual(self.available(), 10)
+
+    def test_short_stripe_borrows_from_the_others(self):
+        """An order larger than any one stripe still succeeds while the total covers it, and fails beyond it."""
+        Order.objects.create(product=self.product, quantity=7, ordered_by=self.user)
+        self.assertEqual(self.stripes(), [1, 1, 1, 0])  # rebalanced after taking the 7
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 3)
+        with self.assertRaises(InsufficientStock):
+            Order.objects.create(product=self.product, quantity=4, ordered_by=self.user)
+        self.assertEqual(self.available(), 3)
+
+    def test_low_stock_flag_uses_the_sum(self):
+        """The low-stock flag is raised when the stripes together reach the threshold and cleared on release."""
+        order = Order.objects.create(product=self.product, quantity=8, ordered_by=self.user)
+        self.assertTrue(Product.objects.get(pk=self.product.pk).is_low_stock)
+        order.status = "canceled"
+        order.save()
+        self.assertFalse(Product.objects.get(pk=self.product.pk).is_low_stock)
+
+    def test_edit_and_bulk_wave_and_unstripe(self):
+        """Editing the quantity resets the stripes, bulk waves reserve from them, 0 stripes folds the stock back."""
+        product = Product.objects.get(pk=self.product.pk)
+        product.quantity = 20
+        product.save()
+        self.assertEqual(self.stripes(), [5, 5, 5, 5])
+        results = place_orders(self.user, [{"product_id": self.product.pk, "quantity": 6}, {"product_id": self.product.pk, "quantity": 15}])
+        self.assertEqual([result["status"] for result in results], ["accepted", "rejected"])
+        self.assertEqual(rebalance(self.product.pk), 14)
+        stripe_stock(self.product.pk, 0)
+        self.assertFalse(StockStripe.objects.exists())
+        self.assertEqual(Product.objects.values_list("quantity", "stock_stripes").get(pk=self.product.pk), (14, 0))
+
+    def test_reads_and_search_show_the_sum(self):
+        """The product list and search show a striped product's current stock, not the column of the last rebalance."""
+        StockStripe.objects.filter(product=self.product, stripe=0).update(quantity=0)  # as if orders had taken it
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse("product_search"), {"q": "pallet"}).json()["results"][0]["quantity"], 7)
+        self.assertContains(self.client.get(reverse("product_list")), "<td>7</td>")
+
+    def test_admin_edits_leave_the_stock_alone(self):
+        """The admin and exports show the stripes' sum; saving in the admin keeps what orders took, an edited quantity resets the stripes."""
+        admin_user = User.objects.create_superuser(username="admin022", password="AdminAdmin#022", role="admin")
+        self.client.force_login(admin_user)
+        Order.objects.create(product=self.product, quantity=3, ordered_by=self.user)  # the quantity column still says 10
+        url = reverse("admin:app_product_change", args=[self.product.pk])
+        self.assertContains(self.client.get(reverse("admin:app_product_changelist")), '<td class="field-available">7</td>')
+        exported = b"".join(self.client.get(reverse("export_data", args=["products"]), {"format": "ndjson"}).streaming_content)
+        self.assertEqual(json.loads(exported)["quantity"], 7)
+        response = self.client.get(url)
+        self.assertContains(response, 'name="initial-quantity" value="7"')  # what the browser posts back as the quantity it showed
+        form = response.context["adminform"].form
+        data = {**form.initial, "initial-quantity": 7, "description": "", "sku": "PJ-1", "price": "350.00"}
+        Order.objects.create(product=self.product, quantity=1, ordered_by=self.user)  # placed while the form is open
+        self.assertEqual(self.client.post(url, data).status_code, 302)
+        self.assertEqual((self.available(), Product.objects.get(pk=self.product.pk).price), (6, 350))
+        self.assertEqual(self.client.post(url, {**data, "quantity": 12}).status_code, 302)
+        self.assertEqual((self.available(), self.stripes()), (12, [3, 3, 3, 3]))
+
+    def test_product_form_keeps_stock_taken_while_it_was_open(self):
+        """A rename through the edit page leaves the stock orders took meanwhile, striped or not; an edited quantity is set."""
+        admin_user = User.objects.create_user(username="admin022", password="AdminAdmin#022", role="admin")
+        self.client.force_login(admin_user)
+        plain = Product.objects.create(name="Hand Truck", quantity=10, price=80)
+        for product, stripes in ((self.product, [1, 1, 1, 1]), (plain, None)):
+            url = reverse("product_update", args=[product.pk])
+            self.assertContains(self.client.get(url), 'name="initial-quantity" value="10"')
+            Order.objects.create(product=product, quantity=3, ordered_by=self.user)
+            data = {"name": f"{product.name} II", "sku": product.sku or "", "description": "", "quantity": 10, "initial-quantity": 10, "price": 90, "reorder_threshold": 2}
+            self.assertRedirects(self.client.post(url, data), reverse("product_list"), fetch_redirect_response=False)
+            edited = Product.objects.annotate(available=stock()).get(pk=product.pk)
+            self.assertEqual((edited.name, edited.available), (f"{product.name} II", 7))
+            self.client.post(url, {**data, "quantity": 4, "initial-quantity": 7})
+            self.assertEqual(Product.objects.annotate(available=stock()).get(pk=product.pk).available, 4)
+            if stripes:
+                self.assertEqual(self.stripes(), stripes)
+
+    def test_stripe_stock_command(self):
+        call_command("stripe_stock", "PJ-1", "--stripes", "2", stdout=io.StringIO())
+        self.assertEqual(self.stripes(), [5, 5])
+        with self.assertRaises(CommandError):
+            call_command("stripe_stock", "NOPE", stdout=io.StringIO())
+
+class StockJournalTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="employee01", password="HNfzAf3BzmXWIK0", role="employee")
+        self.product = Product.objects.create(name="Pallet Jack", sku="PJ-1", quantity=10, price=300)
+
+    def movements(self):
+        return list(StockMovement.objects.filter(product=self.product).order_by("id").values_list("kind", "delta"))
+
+    def test_every_stock_change_is_journaled(self):
+        """Orders, cancellations, bulk waves, edits and imports each leave a movement that sums to the stock."""
+        order = Order.objects.create(product=self.product, quantity=3, ordered_by=self.user)
+        order.status = "canceled"
+        order.save()
+        place_orders(self.user, [{"product_id": self.product.pk, "quantity": 2}])
+        product = Product.objects.get(pk=self.product.pk)
+        product.quantity = 15
+        product.save()
+        product.name = "Pallet Jack XL"
+        product.save()  # no stock change, no movement
+        catalogue.import_catalogue([(2, {"sku": "PJ-1", "name": "Pallet Jack", "quantity": "12", "price": "300"})])
+        self.assertEqual(self.movements(), [("restock", 10), ("reservation", -3), ("cancellation", 3), ("reservation", -2),
+                                            ("adjustment", 7), ("adjustment", -3)])
+        self.assertEqual(sum(delta for _, delta in self.movements()), Product.objects.get(pk=self.product.pk).quantity)
+
+    def test_point_in_time_from_snapshot_and_tail(self):
+        """The stock at a past moment comes from the last snapshot plus the movements after it."""
+        yesterday = now() - timedelta(days=1)
+        StockMovement.objects.filter(product=self.product).update(created_at=yesterday - timedelta(hours=1))
+        Order.objects.create(product=self.product, quantity=4, ordered_by=self.user)
+        self.assertEqual(journal.stock_at(self.product.pk, yesterday), 10)  # worked back from the current stock, no snapshot yet
+        self.assertEqual(journal.snapshot_stock(at=yesterday), 1)
+        Order.objects.create(product=self.product, quantity=1, ordered_by=self.user)
+        with self.assertNumQueries(2):  # the snapshot, the movements since
+            self.assertEqual(journal.stock_at(self.product.pk, now()), 5)
+        self.assertEqual(journal.stock_at(self.product.pk, yesterday), 10)
+        history = journal.stock_history(self.product.pk, yesterday, now())
+        self.assertEqual((history["opening"], history["closing"], history["totals"]), (10, 5, {"reservation": -5}))
+
+    def test_snapshot_takes_the_write_lock_only_to_write(self):
+        """The catalogue scan and the reconciliation run before the write transaction, which only upserts the snapshots."""
+        locked, write_transaction = [], journal.write_transaction
+        @contextmanager
+        def tracked():
+            with write_transaction(), CaptureQueriesContext(connection) as queries:
+                yield
+            locked.extend(query["sql"] for query in queries.captured_queries)
+        Product.objects.create(name="Hand Truck", quantity=4, price=80)
+        with mock.patch("app.journal.write_transaction", tracked):
+            self.assertEqual(journal.snapshot_stock(at=now()), 2)
+        self.assertEqual([sql.split()[0] for sql in locked], ["INSERT"])
+
+    def test_reconcile_finds_unjournaled_changes(self):
+        """A stock change that bypassed the journal shows up as drift against the last snapshot."""
+        journal.snapshot_stock(at=now())
+        self.assertEqual(journal.reconcile(), {})
+        out = io.StringIO()
+        call_command("stock_history", "PJ-1", stdout=out)
+        self.assertIn("opening stock 0\n", out.getvalue())
+        self.assertIn("closing stock 10\n", out.getvalue())
+        Product.objects.filter(pk=self.product.pk).update(quantity=8)
+        self.assertEqual(journal.reconcile(), {self.product.pk: (10, 8)})
+
+class BulkOrderTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="employee01", password="HNfzAf3BzmXWIK0", role="employee")
+        self.products = [Product.objects.create(name=f"SKU {i}", quantity=10, price=5) for i in range(3)]
+
+    def test_lines_are_accepted_or_rejected_individually(self):
+        """Each line gets its own verdict and stock only moves for accepted lines."""
+        first, second, _ = self.products
+        results = place_orders(self.user, [
+            {"product_id": first.id, "quantity": 6},
+            {"product_id": first.id, "quantity": 6},  # only 4 left after the first line
+            {"product_id": second.id, "quantity": 10},
+            {"product_id": 999999, "quantity": 1},
+            {"product_id": second.id, "quantity": 0},])
+        self.assertEqual([line["status"] for line in results], ["accepted", "rejected", "accepted", "rejected", "rejected"])
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.quantity, second.quantity), (4, 0))
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_wave_costs_constant_queries(self):
+        """A 150-line wave over three products takes a handful of queries."""
+        Product.objects.update(quantity=150)  # stays well above the reorder threshold
+        lines = [{"product_id": product.id, "quantity": 1} for product in self.products] * 50
+        with self.assertNumQueries(7):  # savepoint, product read, guarded update, orders in two inserts (999 parameters each), movements, release
+            results = place_orders(self.user, lines)
+        self.assertEqual(sum(line["status"] == "accepted" for line in results), 150)
+
+    def test_bulk_endpoint(self):
+        """The bulk endpoint takes JSON lines and answers with per-line results."""
+        self.client.login(username="employee01", password="HNfzAf3BzmXWIK0")
+        payload = {"lines": [{"product_id": self.products[0].id, "quantity": 2}, {"product_id": self.products[1].id, "quantity": 50}]}
+        response = self.client.post(reverse("order_bulk_create"), json.dumps(payload), content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()["accepted"], response.json()["rejected"]), (1, 1))
+        response = self.client.post(reverse("order_bulk_create"), "not json", content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+class BulkStatusTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="employee01", password="HNfzAf3BzmXWIK0", role="employee")
+        self.admin_user = User.objects.create_user(username="admin013", password="AdminAdmin#013", role="admin", is_staff=True, is_superuser=True)
+        self.products = [Product.objects.create(name=f"SKU {i}", quantity=20, price=5) for i in range(2)]
+        self.orders = [Order.objects.create(product=self.products[i % 2], quantity=2, ordered_by=self.user) for i in range(6)]
+        self.client.force_login(self.admin_user)
+
+    def quantities(self):
+        return list(Product.objects.order_by("pk").values_list("quantity", flat=True))
+
+    def test_queries_do_not_grow_with_the_selection(self):
+        """Completing orders costs the same queries for two orders as for ten, and rolls the sales up."""
+        transition_orders([order.pk for order in self.orders[:2]], "completed")  # creates the day's rollup rows
+        more = [Order.objects.create(product=self.products[i % 2], quantity=1, ordered_by=self.user).pk for i in range(6)]
+        with CaptureQueriesContext(connection) as few:
+            transition_orders([order.pk for order in self.orders[2:4]], "completed")
+        with CaptureQueriesContext(connection) as many:
+            transition_orders([order.pk for order in self.orders[4:]] + more, "completed")
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(sum(DailyProductSales.objects.values_list("orders", flat=True)), 12)
+        self.assertFalse(Order.objects.exclude(status="completed").exists())
+
+    def test_cancel_and_reinstate_reconcile_stock(self):
+        """Canceling releases each product's stock in one go; orders that no longer fit are reported and left alone."""
+        ids = [order.pk for order in self.orders]
+        self.assertEqual(self.quantities(), [14, 14])
+        results = transition_orders(ids + [999999], "canceled")
+        self.assertEqual([result["status"] for result in results], ["applied"] * 6 + ["rejected"])
+        self.assertEqual(self.quantities(), [20, 20])
+        self.assertEqual(StockMovement.objects.filter(kind="cancellation").count(), 6)
+        Product.objects.filter(pk=self.products[0].pk).update(quantity=5)  # not enough to reinstate its three orders
+        results = transition_orders(ids, "pending")
+        self.assertEqual({result["status"] for result in results if Order.objects.get(pk=result["order_id"]).product_id == self.products[0].pk}, {"rejected"})
+        self.assertEqual(self.quantities(), [5, 14])
+        self.assertEqual(transition_orders(ids[1:2], "pending")[0]["status"], "skipped")
+
+    def test_bulk_status_view(self):
+        """The order list moves the ticked orders, or every order matching a filter, and names the ones that failed."""
+        response = self.client.post(reverse("order_bulk_status"), {"status": "canceled", "scope": "selected", "orders": [self.orders[0].pk, self.orders[1].pk]})
+        self.assertRedirects(response, reverse("order_list"))
+        self.assertEqual(Order.objects.filter(status="canceled").count(), 2)
+        Product.objects.filter(pk=self.products[0].pk).update(quantity=0)
+        response = self.client.post(reverse("order_bulk_status"), {"status": "pending", "scope": "filter", "filter_status": "canceled"}, follow=True)
+        self.assertContains(response, f"#{self.orders[0].pk}: not enough stock available!")
+        self.assertEqual(list(Order.objects.filter(status="canceled").values_list("pk", flat=True)), [self.orders[0].pk])
+        response = self.client.post(reverse("order_bulk_status"), {"status": "completed", "scope": "filter", "date_to": str(now().date())})
+        self.assertEqual(Order.objects.filter(status="completed").count(), 5)
+
+    def test_admin_action(self):
+        """The admin changelist has an action per status that goes through the same bulk transition."""
+        response = self.client.post(reverse("admin:app_order_changelist"),
+            {"action": "mark_completed", "_selected_action": [order.pk for order in self.orders[:3]]})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Order.objects.filter(status="completed").count(), 3)
+
+class DashboardTests(TestCase):
+
+    def setUp(self):
+        regions["dashboard"].clear()
+        self.admin_user = User.objects.create_user(username="admin013", password="AdminAdmin#013", role="admin")
+        self.employee_user = User.objects.create_user(username="employee01", password="HNfzAf3BzmXWIK0", role="employee")
+        self.product = Product.objects.create(name="Forklift", quantity=1000, price=10)
+        self.client.login(username="admin013", password="AdminAdmin#013")
+
+    def _place(self, count, status="completed", days_ago=0):
+        orders = [Order.objects.create(product=self.product, quantity=1, ordered_by=self.employee_user, status=status) for _ in range(count)]
+        Order.objects.filter(pk__in=[order.pk for order in orders]).update(ordered_at=now() - timedelta(days=days_ago))
+
+    def test_query_count_does_not_grow_with_orders(self):
+        """Every period renders with the same fixed number of queries, whatever the order history."""
+        for days_ago in range(0, 400, 20):
+            self._place(3, days_ago=days_ago)
+        self._place(2, status="canceled")
+        rebuild_rollup()  # the orders were backdated behind the rollup's back
+        for period in ("day", "week", "month"):
+            regions["dashboard"].clear()
+            with self.assertNumQueries(7):  # products, orders, archived orders, reports, top 5, time series, today's revenue
+                response = self.client.get(reverse("admin_dashboard"), {"period": period})
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["total_orders"], 62)
+        self.assertEqual(response.context["pending_orders"], 0)
+        self.assertEqual(json.loads(response.context["time_orders"])[-1], 3)
+        self.assertEqual(response.context["total_revenue"], 30)
+
+    def test_payload_is_cached_until_orders_change(self):
+        """A second load is served from the cache and a new order invalidates it."""
+        self.client.get(reverse("admin_dashboard"))
+        with self.assertNumQueries(0):  # session and user are cached too
+            self.client.get(reverse("admin_dashboard"))
+        with self.captureOnCommitCallbacks(execute=True):  # regions move to a new version once the write commits
+            self._place(1, status="pending")
+        response = self.client.get(reverse("admin_dashboard"))
+        self.assertEqual(response.context["pending_orders"], 1)
+
+class QueryPlanTests(TestCase):
+    def setUp(self):
+        regions["dashboard"].clear()
+        self.admin_user = User.objects.create_user(username="admin013", password="AdminAdmin#013", role="admin")
+        self.employee_user = User.objects.create_user(username="employee01", password="HNfzAf3BzmXWIK0", role="employee")
+        product = Product.objects.create(name="Forklift", quantity=1000, price=10)
+        for status in ("pending", "completed", "canceled"):
+            Order.objects.create(product=product, quantity=1, ordered_by=self.employee_user, status=status)
+        Report.objects.create(report_type="low_stock", details="Forklift: Only 3 left!")
+
+    def assertIndexedReads(self, run, tables=("order", "report")):  # every query run touches these tables through an index, never a full table scan
+        with CaptureQueriesContext(connection) as queries:
+            run()
+        plans = []
+        with connection.cursor() as cursor:
+            for query in queries.captured_queries:
+                if query["sql"].startswith("SELECT") and any(f'"app_{table}"' in query["sql"] for table in tables):
+                    cursor.execute("EXPLAIN QUERY PLAN " + query["sql"])
+                    plans += [row[-1] for row in cursor.fetchall()]
+        self.assertTrue(plans)
+        for step in plans:
+            self.assertNotRegex(step, rf"^SCAN app_({'|'.join(tables)})$")
+        return plans
+
+    def test_order_pages_use_their_indexes(self):
+        """Order list and employee order pages walk an index in page order."""
+        self.client.login(username="admin013", password="AdminAdmin#013")
+        self.assertIn("SCAN app_order USING INDEX order_placed_idx", self.assertIndexedReads(lambda: self.client.get(reverse("order_list"))))
+        self.client.login(username="employee01", password="HNfzAf3BzmXWIK0")
+        self.assertIn("SEARCH app_order USING INDEX order_user_placed_idx (ordered_by_id=?)",
+            self.assertIndexedReads(lambda: self.client.get(reverse("employee_orders"))))
+
+    def test_product_pages_use_their_index(self):
+        """Product list pages walk the (created_at, id) index in page order, the first page and the ones after a cursor."""
+        regions["catalogue"].clear()
+        self.client.login(username="employee01", password="HNfzAf3BzmXWIK0")
+        cursor = encode_cursor(now(), 1)
+        for params in ({}, {"cursor": cursor}):
+            plans = self.assertIndexedReads(lambda: self.client.get(reverse("product_list"), params), tables=("product",))
+            self.assertRegex(plans[0], r"^(SCAN|SEARCH) app_product USING INDEX product_created_idx")
+            self.assertNotIn("USE TEMP B-TREE FOR ORDER BY", plans)  # rows come off the index already in page order
+
+    def test_dashboard_reports_and_exports_use_indexes(self):
+        """Dashboard figures, the report list and the daily report avoid full scans."""
+        self.client.login(username="admin013", password="AdminAdmin#013")
+        plans = self.assertIndexedReads(lambda: self.client.get(reverse("admin_dashboard"), {"order_filter": "all"}))
+        self.assertIn("SCAN app_order USING COVERING INDEX order_status_placed_idx", plans)
+        self.assertIn("SEARCH app_order USING INDEX order_status_placed_idx (status=? AND ordered_at>?)", plans)
+        self.assertIn("SCAN app_report USING INDEX report_generated_idx", self.assertIndexedReads(lambda: self.client.get(reverse("report_list"))))
+        self.assertIndexedReads(lambda: generate_daily_sales_report())
+
+    def test_admin_changelists_use_indexes(self):
+        """The order and report changelists, filtered or drilled down by date, read through indexes with a bounded query count."""
+        self.admin_user.is_staff = self.admin_user.is_superuser = True
+        self.admin_user.save()
+        self.client.force_login(self.admin_user)
+        url = reverse("admin:app_order_changelist")
+        today = now()
+        for params in ({}, {"status__exact": "pending"}, {"ordered_at__year": today.year, "ordered_at__month": today.month}):
+            def load():
+                with CaptureQueriesContext(connection) as queries:
+                    self.assertContains(self.client.get(url, params), "Forklift")
+                self.assertLessEqual(len(queries), 8)  # statistics, page count, page, date range and one seek per link
+            self.assertIndexedReads(load)
+        self.assertIndexedReads(lambda: self.client.get(reverse("admin:app_report_changelist")))
+        self.assertNotContains(self.client.get(reverse("admin:app_order_add")), "Forklift")  # autocomplete widgets, not every product and user
+
+class AdminScalingTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="employee01", password="HNfzAf3BzmXWIK0", role="employee")
+        self.product = Product.objects.create(name="Forklift", sku="FL-1", quantity=1000, price=10)
+        self.orders = [Order.objects.create(product=self.product, quantity=1, ordered_by=self.user) for _ in range(3)]
+        for order, days in zip(self.orders, (0, 40, 400)):
+            Order.objects.filter(pk=order.pk).update(ordered_at=now() - timedelta(days=days))
+
+    def test_date_hierarchy_matches_django(self):
+        """The index-seeking date hierarchy lists the same years, months and days as Django's own."""
+        from .admin import SkipScanQuerySet
+        for kind in ("year", "month", "day"):
+            self.assertEqual(list(SkipScanQuerySet(Order).datetimes("ordered_at", kind)), list(Order.objects.datetimes("ordered_at", kind)))
+
+    def test_estimated_counts_and_product_search(self):
+        """Unfiltered lists take their size from ANALYZE statistics, filtered ones count up to a limit."""
+        from .admin import EstimatedCountPaginator
+        from .db import analyze, estimated_count
+        analyze()
+        self.assertEqual(estimated_count(Order), 3)
+        with mock.patch("app.admin.estimated_count", return_value=50000):
+            self.assertEqual(EstimatedCountPaginator(Order.objects.order_by("id"), 100).count, 50000)
+            self.assertEqual(EstimatedCountPaginator(Order.objects.filter(status="pending").order_by("id"), 100).count, 3)
+        admin_user = User.objects.create_user(username="admin013", password="AdminAdmin#013", role="admin", is_staff=True, is_superuser=True)
+        self.client.force_login(admin_user)
+        url = reverse("admin:app_order_changelist")
+        with mock.patch.object(EstimatedCountPaginator, "COUNT_LIMIT", 1), mock.patch.object(EstimatedCountPaginator, "PAGES_AHEAD", 0), \
+                mock.patch("app.admin.OrderAdmin.list_per_page", 1):
+            pending = Order.objects.filter(status="pending").order_by("id")
+            self.assertEqual([(paginator.count, paginator.capped) for paginator in (EstimatedCountPaginator(pending, 1, page_number=page) for page in (1, 2, 3))],
+                             [(1, True), (2, True), (3, False)])  # the window follows the page asked for
+            self.assertContains(self.client.get(url, {"status__exact": "pending"}), "1+ orders")
+            self.assertContains(self.client.get(url, {"status__exact": "pending", "p": 3}), "3 orders")  # past the first window
+        response = self.client.get(reverse("admin:autocomplete"), {"app_label": "app", "model_name": "order", "field_name": "product", "term": "fork"})
+        self.assertEqual([result["text"] for result in response.json()["results"]], ["Forklift (FL-1)"])
+
+class OrderArchiveTests(TestCase):
+    def setUp(self):
+        self.admin_user = User.objects.create_user(username="admin013", password="AdminAdmin#013", role="admin")
+        self.employee_user = User.objects.create_user(username="employee01", password="HNfzAf3BzmXWIK0", role="employee")
+        self.product = Product.objects.create(name="Forklift", quantity=1000, price=10)
+        self.orders = {}
+        for name, status, days_ago in [("old_completed", "completed", 400), ("old_canceled", "canceled", 500), ("old_pending", "pending", 400),
+                                       ("old_completed_2", "completed", 400), ("recent", "completed", 2)]:
+            order = Order.objects.create(product=self.product, quantity=2, ordered_by=self.employee_user, status=status)
+            Order.objects.filter(pk=order.pk).update(ordered_at=now() - timedelta(days=days_ago))
+            self.orders[name] = order.pk
+        rebuild_rollup()
+
+    def sales(self):
+        return list(DailyProductSales.objects.order_by("date").values_list("date", "units", "revenue"))
+
+    def test_finished_old_orders_move_and_history_is_kept(self):
+        """Old completed and canceled orders are archived; the rollup, a rebuild, exports and the dashboard still count them."""
+        sales = self.sales()
+        self.assertEqual(archive.archive_orders(batch_size=2), 3)
+        self.assertEqual(set(Order.objects.values_list("id", flat=True)), {self.orders["old_pending"], self.orders["recent"]})
+        self.assertEqual(set(OrderArchive.objects.values_list("id", flat=True)), {self.orders["old_completed"], self.orders["old_canceled"], self.orders["old_completed_2"]})
+        self.assertEqual(self.sales(), sales)
+        rebuild_rollup()
+        self.assertEqual(self.sales(), sales)
+        self.client.login(username="admin013", password="AdminAdmin#013")
+        lines = b"".join(self.client.get(reverse("export_data", args=["orders"])).streaming_content).decode().splitlines()
+        self.assertEqual([int(line.split(",")[0]) for line in lines[1:]], sorted(self.orders.values()))
+        self.assertEqual(self.client.get(reverse("admin_dashboard")).context["total_orders"], 5)
+        self.assertEqual(archive.archive_orders(), 0)
+
+    def test_interrupted_run_resumes(self):
+        """A failed batch is rolled back whole, and the next run archives what is left."""
+        delete = archive._delete_orders
+        calls = []
+        def fail_second_batch(ids):
+            calls.append(ids)
+            if len(calls) == 2:
+                raise OperationalError("disk I/O error")
+            delete(ids)
+        with mock.patch.object(archive, "_delete_orders", fail_second_batch), self.assertRaises(OperationalError):
+            archive.archive_orders(batch_size=1)
+        self.assertEqual(OrderArchive.objects.count(), 1)
+        self.assertEqual(Order.objects.count(), 4)
+        call_command("archive_orders", stdout=io.StringIO())
+        self.assertEqual((Order.objects.count(), OrderArchive.objects.count()), (2, 3))
+
+class SalesRollupTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="employee01", password="HNfzAf3BzmXWIK0", role="employee")
+        self.product = Product.objects.create(name="Shelf", quantity=100, price="12.50")
+
+    def _rollup(self):
+        return DailyProductSales.objects.values_list("orders", "units", "revenue").get(product=self.product)
+
+    def test_rollup_follows_completed_transitions(self):
+        """Orders entering or leaving completed add to or subtract from the day's row."""
+        first = Order.objects.create(product=self.product, quantity=2, ordered_by=self.user)
+        second = Order.objects.create(product=self.product, quantity=3, ordered_by=self.user, status="completed")
+        self.assertEqual(self._rollup(), (1, 3, 37.5))
+        first.status = "completed"
+        first.save()
+        self.assertEqual(self._rollup(), (2, 5, 62.5))
+        second.status = "canceled"
+        second.save()
+        self.assertEqual(self._rollup(), (1, 2, 25))
+        first.delete()
+        self.assertEqual(self._rollup(), (0, 0, 0))
+
+    def test_rebuild_matches_incremental_rollup(self):
+        """Rebuilding from history gives the same rows as the incremental updates."""
+        for quantity in (1, 2, 3):
+            Order.objects.create(product=self.product, quantity=quantity, ordered_by=self.user, status="completed")
+        incremental = self._rollup()
+        call_command("rebuild_sales_rollup", stdout=open("/dev/null", "w"))
+        self.assertEqual(self._rollup(), incremental)
+
+    def test_revenue_keeps_the_price_an_order_completed_at(self):
+        """A later price change moves neither the incremental rollup nor a rebuild of it."""
+        order = Order.objects.create(product=self.product, quantity=2, ordered_by=self.user, status="completed")
+        bulk = Order.objects.create(product=self.product, quantity=1, ordered_by=self.user)
+        transition_orders([bulk.pk], "completed")
+        self.assertEqual(Order.objects.get(pk=bulk.pk).unit_price, 12.5)
+        self.product.price = 20
+        self.product.save()
+        call_command("rebuild_sales_rollup", stdout=open("/dev/null", "w"))
+        self.assertEqual(self._rollup(), (2, 3, 37.5))
+        order.status = "canceled"
+        order.save()
+        transition_orders([bulk.pk], "canceled")
+        self.assertEqual(self._rollup(), (0, 0, 0))
+
+    def test_daily_report_reads_the_rollup(self):
+        """The daily sales report is built from the rollup rows."""
+        Order.objects.create(product=self.product, quantity=4, ordered_by=self.user, status="completed")
+        DailyProductSales.objects.update(units=7)  # only the rollup knows about this
+        generate_daily_sales_report()
+        self.assertEqual(Report.objects.get(report_type="sales").data["products"][0]["units"], 7)
+
+class SalesRangeReportTests(TestCase):
+
+    def setUp(self):
+        regions["reports"].clear()  # test writes never commit, so they bump no version
+        self.admin_user = User.objects.create_user(username="admin013", password="AdminAdmin#013", role="admin")
+        self.shelf = Product.objects.create(name="Shelf", quantity=100, price=12.5)
+        self.crate = Product.objects.create(name="Crate", quantity=100, price=3)
+        self.today = now().date()
+        DailyProductSales.objects.bulk_create(
+            [DailyProductSales(date=self.today - timedelta(days=day), product=product, orders=1, units=2, revenue=2 * product.price)
+             for day in range(400) for product in (self.shelf, self.crate)])
+
+    def test_year_report_merges_daily_rows(self):
+        """A 365-day report is a fixed number of queries over the rollup, whatever the range length."""
+        from .reports import sales_range
+        with self.assertNumQueries(3):
+            sales = sales_range(self.today - timedelta(days=364), self.today)
+        self.assertEqual([row["name"] for row in sales["products"]], ["Shelf", "Crate"])
+        self.assertEqual((sales["units"], sales["revenue"]), (1460, "11315.00"))
+        self.assertEqual(len(sales["days"]), 365)
+        crate = sales_range(self.today - timedelta(days=6), self.today, product_id=self.crate.pk)
+        self.assertEqual((crate["units"], crate["revenue"]), (14, "42.00"))
+
+    def test_daily_reports_store_data_and_render_on_view(self):
+        """The daily report is stored as data, replaced when regenerated, and rendered by the report list."""
+        generate_daily_sales_report(self.today)
+        generate_daily_sales_report(self.today)
+        report = Report.objects.get(report_type="sales")
+        self.assertEqual((report.report_date, report.details, report.data["revenue"]), (self.today, "", "31.00"))
+        self.client.login(username="admin013", password="AdminAdmin#013")
+        self.assertContains(self.client.get(reverse("report_list")), "<td class=\"text-end\">31.00</td>", html=False)
+
+    def test_range_view_formats(self):
+        """The range view answers in HTML, text or JSON and rejects an inverted custom range."""
+        self.client.login(username="admin013", password="AdminAdmin#013")
+        url = reverse("sales_report_range")
+        self.assertEqual(self.client.get(url, {"period": "week", "format": "json"}).json()["units"], 28)
+        text = self.client.get(url, {"period": "custom", "start": self.today.isoformat(), "end": self.today.isoformat(), "format": "text"})
+        self.assertIn("🔹 Shelf: 2 units |  $25.00", text.content.decode())
+        response = self.client.get(url, {"period": "custom", "start": self.today.isoformat(), "end": "2000-01-01"})
+        self.assertEqual(response.context["period"], "month")
+        self.assertContains(response, "Crate")
+
+class ListingPaginationTests(TestCase):
+
+    def setUp(self):
+        self.admin_user = User.objects.create_user(username="admin013", password="AdminAdmin#013", role="admin")
+        self.employee_user = User.objects.create_user(username="employee01", password="HNfzAf3BzmXWIK0", role="employee")
+        products = [Product.objects.create(name=f"Crate {i}", quantity=100, price=3) for i in range(4)]
+        for i in range(60):
+            Order.objects.create(product=products[i % 4], quantity=1, ordered_by=self.employee_user)
+        Order.objects.update(ordered_at=now())  # identical timestamps, so the id must break the tie
+
+    def test_order_list_pages_with_fixed_queries(self):
+        """Each order page costs the same queries and the cursor walks through every order once."""
+        self.client.login(username="admin013", password="AdminAdmin#013")
+        seen = []
+        cursor = None
+        while True:
+            with self.assertNumQueries(2):  # one page of orders with product and user joined, polling head
+                response = self.client.get(reverse("order_list"), {"cursor": cursor} if cursor else {})
+            seen += [order.id for order in response.context["orders"]]
+            cursor = response.context["next_cursor"]
+            if not cursor:
+                break
+        self.assertEqual(seen, sorted(Order.objects.values_list("id", flat=True), reverse=True))
+        self.assertContains(response, "$3.00")
+
+    def test_employee_orders_and_products_are_bounded(self):
+        """Employee orders and products render one page at a time and ignore a bogus cursor."""
+        self.client.login(username="employee01", password="HNfzAf3BzmXWIK0")
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("employee_orders"), {"cursor": "garbage"})
+        self.assertEqual(len(response.context["orders"]), 50)
+        response = self.client.get(reverse("product_list"))
+        self.assertEqual(len(response.context["page"].rows), 4)
+        self.assertIsNone(response.context["page"].next_cursor)
+
+class OrderChangesTests(TestCase):
+
+    def setUp(self):
+        self.admin_user = User.objects.create_user(username="admin013", password="AdminAdmin#013", role="admin")
+        self.employee_user = User.objects.create_user(username="employee01", password="HNfzAf3BzmXWIK0", role="employee")
+        self.product = Product.objects.create(name="Ladder", quantity=100, price=40)
+        self.order = Order.objects.create(product=self.product, quantity=1, ordered_by=self.employee_user)
+        self.client.login(username="admin013", password="AdminAdmin#013")
+
+    def test_polling_returns_only_changes(self):
+        """The changes endpoint answers 304 until an order is created or changes status."""
+        cursor = self.client.get(reverse("order_list")).context["changes_cursor"]
+        response = self.client.get(reverse("order_changes"), {"cursor": cursor})
+        self.assertEqual(response.status_code, 304)
+        self.order.status = "completed"
+        self.order.save()
+        new_order = Order.objects.create(product=self.product, quantity=2, ordered_by=self.employee_user)
+        response = self.client.get(reverse("order_changes"), HTTP_IF_NONE_MATCH=f'"{cursor}"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([order["id"] for order in response.json()["orders"]], [self.order.id, new_order.id])
+        self.assertIn(f'data-order-id="{new_order.id}"', response.json()["orders"][1]["html"])
+        response = self.client.get(reverse("order_changes"), {"cursor": response.json()["cursor"]})
+        self.assertEqual(response.status_code, 304)
+
+class RecordingBroker(events.Broker):
+    published = []
+
+    def publish(self, event):
+        self.published.append(event)
+
+@override_settings(WMS_EVENT_BROKER="app.tests.RecordingBroker")
+class OrderEventTests(TestCase):
+
+    def setUp(self):
+        events._broker = None  # pick up the broker from the overridden setting
+        RecordingBroker.published = []
+        self.admin_user = User.objects.create_user(username="admin013", password="AdminAdmin#013", role="admin")
+        self.employee_user = User.objects.create_user(username="employee01", password="HNfzAf3BzmXWIK0", role="employee")
+        self.product = Product.objects.create(name="Tape Gun", quantity=8, price=7)
+
+    def tearDown(self):
+        events._broker = None
+
+    def test_order_changes_publish_after_commit(self):
+        """Creating an order and changing its status publish events once the transaction commits."""
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.create(product=self.product, quantity=4, ordered_by=self.employee_user)
+            self.assertEqual(RecordingBroker.published, [])  # nothing leaks out before the commit
+        with self.captureOnCommitCallbacks(execute=True):
+            order.status = "completed"
+            order.save()
+        self.assertEqual([event["type"] for event in RecordingBroker.published], ["order_created", "low_stock", "order_status_changed"])
+        self.assertEqual(RecordingBroker.published[1]["quantity"], 4)
+
+    def test_event_stream_is_admin_only(self):
+        """Employees cannot open the event stream."""
+        self.client.login(username="employee01", password="HNfzAf3BzmXWIK0")
+        self.assertEqual(self.client.get(reverse("order_events")).status_code, 403)
+
+@override_settings(WMS_EVENT_BROKER="app.tests.RecordingBroker")
+class LowStockTests(TestCase):
+
+    def setUp(self):
+        events._broker = None
+        RecordingBroker.published = []
+        self.addCleanup(setattr, events, "_broker", None)
+        self.admin_user = User.objects.create_user(username="admin013", password="AdminAdmin#013", role="admin")
+        self.user = User.objects.create_user(username="employee01", password="HNfzAf3BzmXWIK0", role="employee")
+        self.product = Product.objects.create(name="Stretch Wrap", quantity=10, price=4, reorder_threshold=6)
+
+    def _alerts(self):
+        return [event for event in RecordingBroker.published if event["type"] == "low_stock"]
+
+    def test_crossing_alerts_exactly_once(self):
+        """Orders crossing the threshold raise one alert, canceling back above it re-arms the alert."""
+        with self.captureOnCommitCallbacks(execute=True):
+            first = Order.objects.create(product=self.product, quantity=3, ordered_by=self.user)  # 7 left, above
+            Order.objects.create(product=self.product, quantity=2, ordered_by=self.user)  # 5 left, crosses
+            Order.objects.create(product=self.product, quantity=1, ordered_by=self.user)  # 4 left, already low
+        self.assertEqual([alert["quantity"] for alert in self._alerts()], [5])
+        with self.captureOnCommitCallbacks(execute=True):
+            first.status = "canceled"
+            first.save()  # back to 7
+            place_orders(self.user, [{"product_id": self.product.id, "quantity": 2}])  # 5 again, crosses again
+        self.assertEqual([alert["quantity"] for alert in self._alerts()], [5, 5])
+        self.assertEqual(Report.objects.filter(report_type="low_stock").count(), 2)  # kept whoever was listening
+
+    def test_alert_is_kept_with_the_flag(self):
+        """The alert report is written in the transaction that flips the flag, and rolled back with it."""
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            Order.objects.create(product=self.product, quantity=5, ordered_by=self.user)
+            self.assertEqual(Report.objects.get(report_type="low_stock").details, "Stretch Wrap: Only 5 left!")
+            raise RuntimeError
+        self.assertFalse(Report.objects.filter(report_type="low_stock").exists())
+        self.product.quantity = 2
+        self.product.save()  # an edit crossing the threshold alerts too
+        self.assertEqual(Report.objects.get(report_type="low_stock").details, "Stretch Wrap: Only 2 left!")
+
+    def test_low_stock_report_reads_the_flag(self):
+        """The low-stock report lists flagged products through the partial index."""
+        Product.objects.create(name="Zip Ties", quantity=100, price=1)
+        self.product.quantity = 6
+        self.product.save()
+        flagged = Product.objects.filter(is_low_stock=True).order_by("name").values_list("name", "quantity")
+        self.assertIn("product_low_stock_idx", flagged.explain())
+        Report.objects.all().delete()  # the alert the edit raised
+        self.client.login(username="admin013", password="AdminAdmin#013")
+        self.client.get(reverse("generate_low_stock_alert"))
+        self.assertEqual(Report.objects.get(report_type="low_stock").details, "Stretch Wrap: Only 6 left!")
+
+class LocalBrokerTests(TestCase):
+
+    async def test_stream_delivers_events_published_from_other_threads(self):
+        """The stream opens with a retry hint and forwards events published from a worker thread."""
+        events._broker = events.LocalBroker()
+        self.addCleanup(setattr, events, "_broker", None)
+        admin_user = await User.objects.acreate(username="admin013", role="admin")
+        await self.async_client.aforce_login(admin_user)
+        response = await self.async_client.get(reverse("order_events"))
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b"retry: 5000\n\n")
+        publisher = threading.Thread(target=events.get_broker().publish, args=({"type": "order_created", "order": 7},))
+        publisher.start()
+        publisher.join()
+        self.assertEqual(await anext(stream), b'event: order_created\ndata: {"type": "order_created", "order": 7}\n\n')
+        await stream.aclose()
+
+class JobQueueTests(TestCase):
+
+    def setUp(self):
+        self.admin_user = User.objects.create_user(username="admin013", password="AdminAdmin#013", role="admin")
+
+    def test_sales_report_request_only_enqueues(self):
+        """The generate button queues one job per day and the worker builds the report."""
+        self.client.login(username="admin013", password="AdminAdmin#013")
+        self.client.get(reverse("generate_sales_report"))
+        self.client.get(reverse("generate_sales_report"))
+        self.assertEqual(Job.objects.filter(kind="sales_report", status="queued").count(), 1)
+        self.assertFalse(Report.objects.exists())
+        call_command("run_worker", "--once", stdout=open("/dev/null", "w"))
+        self.assertEqual(Job.objects.get().status, "done")
+        self.assertEqual(Report.objects.filter(report_type="sales").count(), 1)
+        enqueue_sales_report()  # a finished job is queued again under the same key
+        self.assertEqual(Job.objects.get().status, "queued")
+
+    def test_failures_back_off_then_give_up(self):
+        """A failing job is retried later with growing delays until it runs out of attempts."""
+        job = enqueue("sales_report", key="broken", date="not a date")
+        delays = []
+        for _ in range(job.max_attempts):
+            Job.objects.filter(pk=job.pk).update(run_after=now())
+            before = now()
+            self.assertEqual(run_pending(), 1)
+            job.refresh_from_db()
+            delays.append(round((job.run_after - before).total_seconds() / 30))
+        self.assertEqual(delays[:4], [1, 2, 4, 8])
+        self.assertEqual(job.status, "failed")
+        self.assertIn("ValueError", job.last_error)
+
+    def test_running_workers_requeue_the_jobs_of_dead_ones(self):
+        """A job left running by a crashed worker is picked up by a worker that was already running."""
+        job = enqueue_sales_report()
+        Job.objects.filter(pk=job.pk).update(status="running", locked_by="dead-worker", locked_at=now() - timedelta(hours=1))
+        stop = threading.Event()
+        with mock.patch("app.jobs.close_old_connections"), mock.patch.object(stop, "wait", side_effect=lambda timeout: stop.set()):
+            work(stop)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, "done")
+
+    def test_claim_is_exclusive(self):
+        """A job claimed by one worker cannot be claimed by another."""
+        enqueue_sales_report()
+        self.assertIsNotNone(claim("worker-a"))
+        self.assertIsNone(claim("worker-b"))
+
+class SchedulerLeaseTests(TestCase):
+
+    def setUp(self):
+        scheduler._leaders.clear()  # no process of an earlier test is still the leader
+        self.addCleanup(scheduler._leaders.clear)
+
+    def test_only_one_leader_until_the_lease_expires(self):
+        """A second process stays standby while the lease is live and takes over once it expires."""
+        self.assertTrue(acquire_lease("web-1"))
+        self.assertFalse(acquire_lease("web-2"))
+        self.assertTrue(acquire_lease("web-1"))  # heartbeat renews
+        SchedulerLease.objects.update(expires_at=now() - timedelta(seconds=1))
+        self.assertTrue(acquire_lease("web-2"))
+        self.assertFalse(acquire_lease("web-1"))
+
+    def test_jobs_run_on_the_leader_only(self):
+        """Scheduled jobs are skipped by every process but the lease holder."""
+        runs = []
+        self.assertEqual(leader_only("web-1", lambda: runs.append("web-1") or "ran")(), "ran")
+        self.assertIsNone(leader_only("web-2", lambda: runs.append("web-2"))())
+        self.assertEqual(runs, ["web-1"])
+        release_lease("web-1")
+        leader_only("web-2", lambda: runs.append("web-2"))()
+        self.assertEqual(runs, ["web-1", "web-2"])
+
+    def test_new_leader_queues_the_daily_jobs_a_dead_leader_missed(self):
+        """Taking over the lease queues a missing sales report and stock checkpoint, once, and nothing already done."""
+        Product.objects.create(name="Pallet", quantity=5, price=1)
+        SchedulerLease.objects.create(name="scheduler", owner="web-1", expires_at=now() - timedelta(seconds=1))  # died before 23:59
+        yesterday = localdate() - timedelta(days=1)
+        with mock.patch("app.scheduler.catch_up", wraps=scheduler.catch_up) as catch_up:
+            leader_only("web-2", heartbeat)()
+            leader_only("web-2", heartbeat)()  # already the leader
+        self.assertEqual(catch_up.call_count, 1)
+        keys = set(Job.objects.values_list("key", flat=True))
+        self.assertIn(f"sales_report:{yesterday.isoformat()}", keys)
+        run_pending()
+        self.assertTrue(Report.objects.filter(report_type="sales", report_date=yesterday).exists())
+        self.assertFalse(Job.objects.exclude(status="done").exists())
+        self.assertEqual(scheduler.catch_up(), [])  # nothing left to make good
+        at_night = now().replace(hour=23, minute=59, second=30)  # after today's report was due
+        self.assertEqual([job.key for job in scheduler.catch_up(at_night)], [f"sales_report:{localdate().isoformat()}"])
+
+    def test_scheduler_coalesces_missed_runs(self):
+        """The daily report job coalesces missed runs and tolerates late starts."""
+        job = build_scheduler("web-1").get_job("daily_sales_report")
+        self.assertTrue(job.coalesce)
+        self.assertEqual(job.misfire_grace_time, 3600)
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.admin_user = User.objects.create_user(username="admin013", password="AdminAdmin#013", role="admin")
+        self.product = Product.objects.create(name="Widget, large", quantity=100, price="2.50")
+        self.orders = [Order.objects.create(product=self.product, quantity=i + 1, ordered_by=self.admin_user) for i in range(3)]
+        self.orders[0].status = "completed"
+        self.orders[0].save()
+        Order.objects.filter(pk=self.orders[2].pk).update(ordered_at=now() - timedelta(days=10))
+
+    def test_orders_stream_as_csv(self):
+        """Orders export streams a CSV header and one row per order, honouring the filters."""
+        self.client.login(username="admin013", password="AdminAdmin#013")
+        Product.objects.filter(pk=self.product.pk).update(price="3.00")  # after the first order completed
+        response = self.client.get(reverse("export_data", args=["orders"]))
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "id,ordered_at,updated_at,status,product_id,product,unit_price,product_price,quantity,ordered_by")
+        self.assertEqual(len(lines), 4)
+        self.assertIn('"Widget, large",2.50,3.00,1,admin013', lines[1])
+        self.assertIn('"Widget, large",,3.00,2,admin013', lines[2])  # still pending, no price yet
+        day = (now() - timedelta(days=1)).date().isoformat()
+        response = self.client.get(reverse("export_data", args=["orders"]), {"date_from": day, "status": "pending"})
+        self.assertEqual(len(b"".join(response.streaming_content).decode().splitlines()), 2)
+        self.assertEqual(self.client.get(reverse("export_data", args=["orders"]), {"date_to": "yesterday"}).status_code, 400)
+
+    def test_products_stream_as_ndjson(self):
+        """NDJSON exports hold one JSON object per line."""
+        self.client.login(username="admin013", password="AdminAdmin#013")
+        response = self.client.get(reverse("export_data", args=["products"]), {"format": "ndjson"})
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(rows, [{"id": self.product.pk, "name": "Widget, large", "quantity": 94, "price": "2.50",
+            "reorder_threshold": 5, "is_low_stock": False, "created_at": self.product.created_at.isoformat()}])
+
+    def test_export_command(self):
+        """The export_data command writes the same stream."""
+        out = io.StringIO()
+        call_command("export_data", "orders", "--status", "completed", "--format", "ndjson", stdout=out)
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([row["id"] for row in rows], [self.orders[0].pk])
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        self.admin_user = User.objects.create_user(username="admin013", password="AdminAdmin#013", role="admin")
+        self.employee_user = User.objects.create_user(username="employee01", password="HNfzAf3BzmXWIK0", role="employee")
+        self.forklift = Product.objects.create(name="Electric Forklift", sku="FL-200", description="Lifts pallets", quantity=3, price=12000)
+        self.jack = Product.objects.create(name="Pallet Jack", description="Manual", quantity=0, price=300)
+
+    def names(self, text, **kwargs):
+        return [product.name for product in search_products(text, **kwargs)[0]]
+
+    def test_index_follows_saves_bulk_writes_and_deletes(self):
+        """Matches on name prefixes, SKU and description, and stays in step with every kind of product write."""
+        self.assertEqual(self.names("forkl"), ["Electric Forklift"])
+        self.assertEqual(self.names("fl 200"), ["Electric Forklift"])
+        self.assertEqual(self.names("pallet"), ["Pallet Jack", "Electric Forklift"])  # a name match outranks a description match
+        self.assertEqual(self.names("pallet", in_stock=True), ["Electric Forklift"])
+        self.jack.name = "Hand Truck"
+        self.jack.save()
+        self.assertEqual(self.names("jack"), [])
+        Product.objects.bulk_create([Product(name="Pallet Wrap", price=5, quantity=9)])
+        Product.objects.filter(name="Pallet Wrap").update(description="Stretch film")
+        self.assertEqual(self.names("stretch"), ["Pallet Wrap"])
+        Product.objects.filter(pk=self.forklift.pk).update(quantity=1)  # stock writes leave the index alone
+        self.forklift.delete()
+        self.assertEqual(self.names("forklift"), [])
+        self.assertEqual(self.names("f"), [])  # too short to search
+
+    @unittest.skipUnless(connection.vendor == "sqlite", "the search index is SQLite's FTS5")
+    def test_index_triggers_survive_the_migrations(self):
+        """A migration that remakes app_product drops its triggers; each has to restore them with create_triggers()."""
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'app_product'")
+            self.assertEqual({name for name, in cursor.fetchall()}, set(search_index.TRIGGER_NAMES))
+
+    def test_other_databases_search_without_the_index(self):
+        """Where there is no FTS5 (not SQLite), every word typed still has to appear in the name, SKU or description."""
+        with mock.patch("app.search.full_text", return_value=False):
+            self.assertEqual(self.names("pallet"), ["Electric Forklift", "Pallet Jack"])  # oldest first, there is no rank
+            self.assertEqual(self.names("pallet", in_stock=True), ["Electric Forklift"])
+            self.assertEqual(self.names("lifts fl"), ["Electric Forklift"])
+            self.assertEqual(search_products("pallet", per_page=1)[1], 2)
+            self.assertEqual(list(matching(Product.objects.all(), "jack")), [self.jack])
+
+    def test_typeahead_endpoint_pages_results(self):
+        """The JSON endpoint returns a page of matches and the next page number."""
+        Product.objects.bulk_create([Product(name=f"Shelf unit {i:02d}", price=50, quantity=i) for i in range(15)])
+        self.client.login(username="employee01", password="HNfzAf3BzmXWIK0")
+        first = self.client.get(reverse("product_search"), {"q": "shelf"}).json()
+        self.assertEqual((len(first["results"]), first["next_page"]), (10, 2))
+        second = self.client.get(reverse("product_search"), {"q": "shelf", "page": 2}).json()
+        self.assertEqual((len(second["results"]), second["next_page"]), (5, None))
+        self.assertEqual(len(self.client.get(reverse("product_search"), {"q": "shelf", "in_stock": "1"}).json()["results"]), 10)
+        self.assertEqual(first["results"][0].keys(), {"id", "name", "sku", "price", "quantity"})
+
+    def test_order_form_lists_no_products_and_checks_the_id(self):
+        """The order form no longer embeds the catalogue, and an order is validated by product id alone."""
+        self.client.login(username="employee01", password="HNfzAf3BzmXWIK0")
+        self.assertNotContains(self.client.get(reverse("order_create")), "Electric Forklift")
+        response = self.client.post(reverse("order_create"), {"product": self.forklift.pk, "quantity": 1})
+        self.assertRedirects(response, reverse("employee_orders"), fetch_redirect_response=False)
+        response = self.client.post(reverse("order_create"), {"product": self.forklift.pk, "quantity": 5})
+        self.assertContains(response, 'value="Electric Forklift"')  # shown again after the stock error
+        self.assertEqual(self.client.post(reverse("order_create"), {"product": 999999, "quantity": 1}).status_code, 200)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_product_list_searches_on_the_server(self):
+        """A query on the product list shows only the matching products."""
+        self.client.login(username="admin013", password="AdminAdmin#013")
+        response = self.client.get(reverse("product_list"), {"q": "forklift"})
+        self.assertContains(response, "Electric Forklift")
+        self.assertNotContains(response, "Pallet Jack")
+        self.assertContains(self.client.get(reverse("product_list")), "Pallet Jack")
+
+class CatalogueImportTests(TestCase):
+    CSV = ("sku,name,description,quantity,price,reorder_threshold\n"
+           "A-1,Widget,<b>Blue</b> <script>x</script>,10,2.50,\n"
+           "A-2,Gadget,Plain,3,9.99,\n"
+           ",No SKU,,1,1.00,\n"
+           "A-3,Broken,,-4,1.00,\n")
+
+    def run_import(self, text, fmt="csv"):
+        errors = []
+        stats = catalogue.import_catalogue(catalogue.read_records(io.StringIO(text), fmt), batch_size=2,
+            on_error=lambda *error: errors.append(error))
+        return stats, errors
+
+    def test_import_upserts_on_sku_and_reports_bad_rows(self):
+        """Good rows are created or updated by sku, bad ones are reported with their line and skipped."""
+        existing = Product.objects.create(name="Old widget", sku="A-1", quantity=50, price=1, reorder_threshold=2)
+        stats, errors = self.run_import(self.CSV)
+        self.assertEqual((stats["rows"], stats["imported"], stats["errors"]), (4, 2, 2))
+        self.assertEqual(errors, [(4, "", "sku is required"), (5, "A-3", "quantity cannot be negative")])
+        existing.refresh_from_db()
+        self.assertEqual((existing.name, existing.description, existing.quantity, existing.reorder_threshold), ("Widget", "<b>Blue</b> x", 10, 2))
+        gadget = Product.objects.get(sku="A-2")
+        self.assertTrue(gadget.is_low_stock)  # 3 units, at or below the default threshold of 5
+        stats, errors = self.run_import('{"sku": "A-2", "price": "12.00"}\nnot json\n', fmt="jsonl")
+        self.assertEqual(errors, [(2, "", "not a JSON object")])
+        gadget.refresh_from_db()
+        self.assertEqual((gadget.name, gadget.quantity, str(gadget.price)), ("Gadget", 3, "12.00"))  # empty fields are kept
+
+    def test_unchanged_descriptions_skip_bleach(self):
+        """Re-importing a row whose description is already stored does not sanitise it again."""
+        self.run_import(self.CSV)
+        with mock.patch("app.catalogue.clean_description", wraps=catalogue.clean_description) as clean:
+            stats, _ = self.run_import(self.CSV.replace("Plain", "Changed"))
+        self.assertEqual(clean.call_count, 2)  # the widget's stored text differs from its raw HTML, the gadget's changed
+        self.assertEqual(stats["unchanged_descriptions"], 0)
+        with mock.patch("app.catalogue.clean_description", wraps=catalogue.clean_description) as clean:
+            stats, _ = self.run_import("sku,description\nA-2,Changed\n")
+        self.assertEqual((clean.call_count, stats["unchanged_descriptions"]), (0, 1))
+
+    def test_orders_placed_while_a_batch_is_cleaned_are_kept(self):
+        """Stock is read in the write transaction, and only rows that give a quantity set it."""
+        user = User.objects.create_user(username="employee01", password="HNfzAf3BzmXWIK0", role="employee")
+        widget = Product.objects.create(name="Widget", sku="A-1", quantity=10, price=1)
+        gadget = Product.objects.create(name="Gadget", sku="A-2", quantity=10, price=1)
+        def clean_during_orders(text):  # an order for each product lands while bleach runs
+            for product in (widget, gadget):
+                Order.objects.create(product=product, quantity=3, ordered_by=user)
+            return text
+        with mock.patch("app.catalogue.clean_description", side_effect=clean_during_orders):
+            self.run_import("sku,description,quantity\nA-1,New text,\n")
+            self.run_import("sku,description,quantity\nA-2,New text,20\n")
+        widget.refresh_from_db()
+        self.assertEqual((widget.description, widget.quantity), ("New text", 4))  # two waves of orders, no quantity in the row
+        self.assertFalse(StockMovement.objects.filter(product=widget, kind="adjustment").exists())
+        gadget.refresh_from_db()
+        self.assertEqual(gadget.quantity, 20)
+        self.assertEqual(StockMovement.objects.get(product=gadget, kind="adjustment").delta, 16)  # from the 4 left after both waves
+        self.assertEqual(journal.reconcile(), {})
+
+    def test_admin_upload(self):
+        """Staff can upload a catalogue from the product admin and see the skipped rows."""
+        User.objects.create_superuser(username="root", password="AdminAdmin#013")
+        self.client.login(username="root", password="AdminAdmin#013")
+        upload = SimpleUploadedFile("catalogue.csv", self.CSV.encode())
+        response = self.client.post(reverse("admin:app_product_import"), {"catalogue": upload})
+        self.assertContains(response, "Imported 2 of 4 rows")
+        self.assertContains(response, "quantity cannot be negative")
+        self.assertEqual(Product.objects.filter(sku__in=["A-1", "A-2"]).count(), 2)
+
+class UserCacheTests(TestCase):
+    def setUp(self):
+        self.employee_user = User.objects.create_user(username="employee01", password="HNfzAf3BzmXWIK0", role="employee")
+        self.client.login(username="employee01", password="HNfzAf3BzmXWIK0")
+
+    def test_role_changes_apply_on_the_next_request(self):
+        """Saving a user evicts the cached row, so a new role or a deactivation takes effect at once."""
+        self.assertEqual(self.client.get(reverse("report_list")).status_code, 403)
+        User.objects.filter(pk=self.employee_user.pk).update(role="admin")  # no signal: still served from the cache
+        self.assertEqual(self.client.get(reverse("report_list")).status_code, 403)
+        self.employee_user.role = "admin"
+        self.employee_user.save()
+        self.assertEqual(self.client.get(reverse("report_list")).status_code, 200)
+        self.employee_user.is_active = False
+        self.employee_user.save()
+        self.assertEqual(self.client.get(reverse("report_list")).status_code, 302)  # logged out, sent to the login page
+
+    def test_changes_in_other_processes_apply_on_the_next_request(self):
+        """A save bumps the user's shared version once it commits, which every process checks before using its copy."""
+        self.assertEqual(self.client.get(reverse("employee_orders")).status_code, 200)
+        User.objects.filter(pk=self.employee_user.pk).update(is_active=False)  # saved in another process: no signal here
+        self.assertEqual(self.client.get(reverse("employee_orders")).status_code, 200)  # this process's copy
+        user_cache.bump(self.employee_user.pk)  # what that process's commit does
+        self.assertEqual(self.client.get(reverse("employee_orders")).status_code, 302)
+        version = user_cache.version(self.employee_user.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.employee_user.save()
+        self.assertNotEqual(user_cache.version(self.employee_user.pk), version)
+
+    def test_cache_is_bounded_and_expires(self):
+        """The LRU drops its least recently used row when full and ignores rows past their TTL."""
+        cache = UserCache(size=2, ttl=60)
+        for user_id in (1, 2):
+            cache.put(user_id, (user_id,), cache.generation, cache.version(user_id))
+        cache.get(1)
+        cache.put(3, (3,), cache.generation, cache.version(3))
+        self.assertEqual([cache.get(user_id) for user_id in (1, 2, 3)], [(1,), None, (3,)])
+        generation = cache.generation
+        cache.evict(1)
+        cache.put(1, ("stale",), generation, cache.version(1))  # read before the eviction, so not stored
+        self.assertIsNone(cache.get(1))
+        with mock.patch("app.auth.time.monotonic", return_value=time.monotonic() + 61):
+            self.assertIsNone(cache.get(3))
+        self.assertIn(self.employee_user.pk, user_cache.entries)  # primed by the login
+
+class CacheRegionTests(TestCase):
+    def setUp(self):
+        for region in regions.values():
+            region.clear()
+        self.admin_user = User.objects.create_user(username="admin013", password="AdminAdmin#013", role="admin")
+        self.product = Product.objects.create(name="Pallet", quantity=40, price=15)
+        self.client.login(username="admin013", password="AdminAdmin#013")
+
+    def test_product_list_fragment_until_a_product_changes(self):
+        """The product table is served from the catalogue region until a product or order changes it."""
+        self.client.get(reverse("product_list"))
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get(reverse("product_list")), "Pallet")
+        with self.captureOnCommitCallbacks(execute=True):  # regions move to a new version once the write commits
+            self.product.name = "Euro pallet"
+            self.product.save()
+        self.assertContains(self.client.get(reverse("product_list")), "Euro pallet")
+        with self.captureOnCommitCallbacks(execute=True):
+            Order.objects.create(product=self.product, quantity=5, ordered_by=self.admin_user)
+        self.assertContains(self.client.get(reverse("product_list")), "<td>35</td>", html=False)
+        self.assertEqual(regions["catalogue"].stats()["hits"], 1)
+        self.assertEqual(regions["catalogue"].stats()["misses"], 3)
+
+    def test_versions_move_once_the_write_commits(self):
+        """A bump waits for the commit, and an entry rendered across a bump is stored under the version it started with."""
+        catalogue = regions["catalogue"]
+        version = catalogue.version()
+        with self.captureOnCommitCallbacks() as callbacks:
+            models_changed(Product)
+        self.assertEqual((catalogue.version(), len(callbacks)), (version, 2))  # catalogue and dashboard
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(catalogue.version(), version)
+        def render():  # a write commits while the old rows are being rendered
+            catalogue._next_version()
+            return "old rows"
+        self.assertEqual(catalogue.get_or_set("table", render), "old rows")
+        self.assertIsNone(catalogue.get("table"))
+
+    def test_versions_are_shared_between_processes(self):
+        """Entries in one process's memory are invalidated by a bump from another, through the shared versions file."""
+        catalogue = regions["catalogue"]
+        catalogue.set("table", "rows")
+        self.assertEqual((catalogue.get("table"), catalogue.versions.__class__.__name__), ("rows", "FileBasedCache"))
+        caches["versions"].set(catalogue.version_key, catalogue.version() + 1, None)  # as another worker's bump writes it
+        self.assertIsNone(catalogue.get("table"))
+
+    def test_report_list_fragment_and_stats(self):
+        """A new report invalidates the cached report table; counters are published as JSON."""
+        self.client.get(reverse("report_list"))
+        with self.assertNumQueries(0):
+            self.client.get(reverse("report_list"))
+        with self.captureOnCommitCallbacks(execute=True):
+            Report.objects.create(report_type="low_stock", details="Pallet: Only 1 left!")
+        self.assertContains(self.client.get(reverse("report_list")), "Only 1 left!")
+        stats = self.client.get(reverse("cache_stats")).json()
+        self.assertEqual((stats["reports"]["hits"], stats["reports"]["misses"]), (1, 2))
+        self.assertEqual(stats["reports"]["backend"], "FileBasedCache")
+        self.assertTrue(regions["reports"].cache._dir.startswith(tempfile.gettempdir()))  # not the running app's cache directory
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        registry.clear()
+        regions["catalogue"].clear()  # a page served from the cache runs no queries to measure
+        self.admin_user = User.objects.create_user(username="admin013", password="AdminAdmin#013", role="admin")
+        Product.objects.create(name="Pallet", quantity=40, price=15)
+
+    def series(self, family, **labels):
+        return registry.series[(family, tuple(sorted(labels.items())))]
+
+    def test_requests_are_measured_per_view(self):
+        """Latency, queries, template time and response size are recorded under the URL name."""
+        self.client.login(username="admin013", password="AdminAdmin#013")
+        response = self.client.get(reverse("product_list"))
+        entry = self.series("request", view="product_list", method="GET")
+        self.assertEqual(entry["duration"].count, 1)
+        self.assertGreater(entry["queries"], 0)
+        self.assertGreater(entry["template_seconds"], 0)
+        self.assertEqual(entry["bytes"], len(response.content))
+        self.assertEqual(entry["outcomes"], {"200": 1})
+        self.client.get("/no-such-page/")
+        self.assertEqual(self.series("request", view="unresolved", method="GET")["outcomes"], {"404": 1})
+
+    @override_settings(METRICS_TOKEN="s3cret")
+    def test_prometheus_endpoint(self):
+        """/metrics/ serves the text format to scrapers with the token, allowed addresses and admins only."""
+        self.client.get(reverse("login"))
+        text = self.client.get(reverse("metrics"), headers={"Authorization": "Bearer s3cret"}).content.decode()
+        self.assertIn("# TYPE wms_request_duration_seconds histogram", text)
+        self.assertIn('wms_request_duration_seconds_bucket{method="GET",view="login",le="+Inf"} 1', text)
+        self.assertIn('wms_requests_total{method="GET",view="login",status="200"} 1', text)
+        self.assertIn('wms_cache_hits_total{region="catalogue"}', text)
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)  # localhost is no pass, a reverse proxy would be localhost
+        self.assertEqual(self.client.get(reverse("metrics"), headers={"Authorization": "Bearer guess"}).status_code, 403)
+        with self.settings(METRICS_ALLOWED_IPS=["10.0.0.1"]):
+            self.assertEqual(self.client.get(reverse("metrics"), REMOTE_ADDR="10.0.0.1").status_code, 200)
+        self.client.login(username="admin013", password="AdminAdmin#013")
+        self.assertEqual(self.client.get(reverse("metrics"), REMOTE_ADDR="10.0.0.2").status_code, 200)
+
+    def test_streamed_responses_are_measured_once_sent(self):
+        """A streamed export is recorded after its last chunk, with the bytes it sent."""
+        self.client.force_login(self.admin_user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("export_data", args=["products"]))
+            body = b"".join(response.streaming_content)
+        entry = self.series("request", view="export_data", method="GET")
+        self.assertEqual((entry["duration"].count, entry["bytes"]), (1, len(body)))
+        self.assertEqual(entry["queries"], len(queries))  # the rows read while streaming included
+        self.assertGreater(len(body), 0)
+
+    async def test_async_requests_skip_the_sync_adapter(self):
+        """Under ASGI the middleware runs as a coroutine and still records the request."""
+        async def view(request):
+            return HttpResponse("ok")
+        self.assertTrue(iscoroutinefunction(MetricsMiddleware(view)))
+        await self.async_client.get(reverse("login"))
+        self.assertEqual(self.series("request", view="login", method="GET")["outcomes"], {"200": 1})
+        await self.async_client.aforce_login(self.admin_user)
+        await self.async_client.get(reverse("product_list"))  # a sync view, its queries run in a sync_to_async thread
+        self.assertGreater(self.series("request", view="product_list", method="GET")["queries"], 0)
+
+    @override_settings(SLOW_REQUEST_SECONDS=0)
+    def test_slow_requests_are_logged_with_their_sql(self):
+        """A request over the threshold is logged with its slowest statements."""
+        self.client.login(username="admin013", password="AdminAdmin#013")
+        with self.assertLogs("app.metrics", "WARNING") as logs:
+            self.client.get(reverse("product_list"))
+        self.assertIn("(product_list)", logs.output[0])
+        self.assertIn("SELECT", logs.output[0])
+
+    def test_jobs_are_measured_by_kind_and_outcome(self):
+        """Worker jobs are recorded like requests, failures included."""
+        enqueue_sales_report()
+        enqueue("sales_report", key="broken", date="not a date")
+        run_pending()
+        entry = self.series("job", job="sales_report")
+        self.assertEqual(entry["outcomes"], {"done": 1, "failed": 1})
+        self.assertGreater(entry["queries"], 0)
+
+class DatabaseTuningTests(TransactionTestCase):
+    def test_connection_pragmas(self):
+        """Every connection comes up with the tuned pragmas and busy timeout."""
+        with connection.cursor() as cursor:
+            self.assertEqual(cursor.execute("PRAGMA synchronous").fetchone()[0], 1)  # NORMAL
+            self.assertEqual(cursor.execute("PRAGMA busy_timeout").fetchone()[0], 20000)
+
+    def test_write_transaction_begins_immediate(self):
+        """Stock-changing transactions take the write lock at BEGIN, nested blocks just use a savepoint."""
+        with CaptureQueriesContext(connection) as queries:
+            with write_transaction():
+                with write_transaction():
+                    pass
+        self.assertEqual(queries[0]["sql"], "BEGIN IMMEDIATE")
+        self.assertNotIn("BEGIN IMMEDIATE", [query["sql"] for query in queries[1:]])
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                Product.objects.count()
+        self.assertEqual(queries[0]["sql"], "BEGIN")
+
+    def test_replica_reads_are_routed(self):
+        """Reads inside replica_reads() go to the replica, except inside a transaction that may have written."""
+        router = ReadReplicaRouter()
+        self.assertIsNone(router.db_for_read(Report))
+        with replica_reads():
+            self.assertEqual(router.db_for_read(Report), "replica")
+            with transaction.atomic():
+                self.assertIsNone(router.db_for_read(Report))
+        with override_settings(WMS_READ_REPLICA=None), replica_reads():
+            self.assertIsNone(router.db_for_read(Report))
+        self.assertFalse(router.allow_migrate("replica", "app"))
+
+class BenchmarkSuiteTests(TransactionTestCase):
+    databases = {"default", "replica"}  # the dashboard and reports read from the replica alias, a mirror of default in tests
+
+    def test_generated_data_and_scenarios(self):
+        """Every hot path runs without errors on generated data and reports latency, queries and throughput."""
+        benchmarks.generate_data(products=5, orders=60, users=2, days=10)
+        self.assertEqual(Order.objects.count(), 60)
+        self.assertTrue(Order.objects.filter(ordered_at__lt=now() - timedelta(days=1)).exists())  # spread over the range
+        results = benchmarks.run_benchmarks(requests=3, threads=1)  # one thread, the in-memory test database allows no concurrent writers
+        for name, result in results["results"].items():
+            self.assertEqual((name, result["requests"], result["errors"]), (name, 3, 0))
+            self.assertLessEqual(result["p50_ms"], result["p99_ms"])
+            self.assertGreater(result["queries_per_request"], 0)
+
+    def test_regression_against_baseline(self):
+        """A path slower or chattier than the baseline by more than the tolerance is reported."""
+        baseline = {"results": {"order_list": {"p95_ms": 100, "queries_per_request": 2}, "cancel_order": {"p95_ms": 50, "queries_per_request": 5}}}
+        current = {"results": {"order_list": {"p95_ms": 115, "queries_per_request": 3}, "cancel_order": {"p95_ms": 70, "queries_per_request": 5},
+                               "order_create": {"p95_ms": 10, "queries_per_request": 7}}}
+        self.assertEqual(benchmarks.compare(current, baseline, tolerance=20), [
+            "order_list: queries_per_request 2 -> 3 (+50%, tolerance 20%)",
+            "cancel_order: p95_ms 50 -> 70 (+40%, tolerance 20%)"])
+
+class StockContentionTests(TransactionTestCase):
+    THREADS = 8
+    ATTEMPTS = 25  # orders attempted per thread
+    STOCK = 100  # fewer units than attempted orders, so some threads must be turned away
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="employee01", password="HNfzAf3BzmXWIK0", role="employee")
+
+    def _legacy_place_order(self, product_id):  # the read-modify-write Order.save used to do
+        product = Product.objects.get(pk=product_id)
+        if product.quantity < 1:
+            raise ValueError("Not enough stock available!")
+        product.quantity -= 1
+        product.save()
+        Order.objects.bulk_create([Order(product=product, quantity=1, ordered_by=self.user)])
+
+    def _ledger_place_order(self, product_id):
+        Order.objects.create(product_id=product_id, quantity=1, ordered_by=self.user)
+
+    def _hammer(self, place_order, stripes=0):
+        product = Product.objects.create(name="Hot SKU", quantity=self.STOCK, price=10)
+        if stripes:
+            stripe_stock(product.pk, stripes)
+        barrier = threading.Barrier(self.THREADS)
+
+        def worker():
+            barrier.wait()
+            for _ in range(self.ATTEMPTS):
+                while True:
+                    try:
+                        place_order(product.id)
+                    except OperationalError:  # sqlite reports a locked table, try again
+                        continue
+                    except ValueError:  # out of stock
+                        pass
+                    break
+            connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.THREADS)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        rebalance(product.pk)  # brings a striped product's quantity column up to date
+        product.refresh_from_db()
+        return product, Order.objects.filter(product=product).count(), self.THREADS * self.ATTEMPTS / elapsed
+
+    def test_concurrent_orders_never_oversell(self):
+        """Concurrent orders on one product sell exactly the available stock and never more."""
+        _, legacy_orders, legacy_rate = self._hammer(self._legacy_place_order)
+        product, orders, rate = self._hammer(self._ledger_place_order)
+        self.assertEqual(orders, self.STOCK)
+        self.assertEqual(product.quantity, 0)
+        logger.debug("stock contention: legacy %.0f orders/sec (%s orders for %s units), ledger %.0f orders/sec (%s orders)",
+                     legacy_rate, legacy_orders, self.STOCK, rate, orders)
+
+    def test_striped_orders_never_oversell(self):
+        """Concurrent orders on a striped product sell exactly its stock across all stripes."""
+        product, orders, rate = self._hammer(self._ledger_place_order, stripes=4)
+        self.assertEqual(orders, self.STOCK)
+        self.assertEqual(product.quantity, 0)
+        self.assertFalse(StockStripe.objects.filter(product=product, quantity__gt=0).exists())
+        logger.debug("stock contention: 4 stripes %.0f orders/sec (%s orders)", rate, orders)
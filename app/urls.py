@@ -1,6 +1,6 @@
 from django.urls import path
 from .views import (
-    user_login, user_logout, admin_dashboard, product_list, product_create, product_update, product_delete, order_list, order_create, employee_orders, update_order_status, cancel_order, report_list, generate_sales_report, generate_low_stock_alert, custom_login_redirect
+    user_login, user_logout, admin_dashboard, product_list, product_search, product_create, product_update, product_delete, order_list, order_changes, order_events, order_create, order_bulk_create, employee_orders, update_order_status, order_bulk_status, cancel_order, report_list, sales_report_range, generate_sales_report, generate_low_stock_alert, export_data, cache_stats, metrics, custom_login_redirect
 )
 
 urlpatterns = [
@@ -10,15 +10,24 @@ urlpatterns = [
     path('logout/', user_logout, name='logout'), # it just redirects you to login page
     path('admin_dashboard/', admin_dashboard, name='admin_dashboard'), # Admin dashboard
     path('products/', product_list, name='product_list'), # List of products
+    path('products/search/', product_search, name='product_search'), # Full-text product search as JSON, paginated, for typeaheads
     path('products/create/', product_create, name='product_create'), # Add product's form
     path('products/<int:product_id>/edit/', product_update, name='product_update'), # Edit product
     path('products/<int:product_id>/delete/', product_delete, name='product_delete'), # Delete product
     path('orders/', order_list, name='order_list'), # List of orders
+    path('orders/changes/', order_changes, name='order_changes'), # Orders created or changed since a cursor, for live polling (Only Admins)
+    path('orders/events/', order_events, name='order_events'), # Server-sent events for order and stock changes (Only Admins, served over ASGI)
     path('orders/create/', order_create, name='order_create'), # Create order's form
+    path('orders/bulk/', order_bulk_create, name='order_bulk_create'), # Bulk order intake, JSON in and out (Only Employees)
     path('orders/my_orders/', employee_orders, name='employee_orders'), # Employye's order list
     path("orders/<int:order_id>/update-status/", update_order_status, name="update_order_status"), # Update order status (Only Admins)
+    path("orders/bulk-status/", order_bulk_status, name="order_bulk_status"), # Move selected or filtered orders to one status (Only Admins)
     path("orders/<int:order_id>/cancel/", cancel_order, name="cancel_order"), # Cancel order (Only Employees)
     path('reports/', report_list, name='report_list'), # Reports list
+    path('reports/sales/', sales_report_range, name='sales_report_range'), # Sales for a week, month, year or custom range, as HTML, text or JSON
     path('reports/generate_sales/', generate_sales_report, name='generate_sales_report'), # Generates sales reports (1 time a day)
     path('reports/generate_low_stock/', generate_low_stock_alert, name='generate_low_stock_alert'), # Generates low stock alerts
+    path('metrics/', metrics, name='metrics'), # Prometheus text metrics: latency, queries, template time, response size per view (Allowed IPs or Admins)
+    path('monitoring/cache/', cache_stats, name='cache_stats'), # Cache region hit/miss counters as JSON (Only Admins)
+    path('exports/<str:dataset>/', export_data, name='export_data'), # Streams orders, products or reports as CSV or NDJSON (Only Admins)
 ]
\ No newline at end of file
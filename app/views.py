@@ -1,15 +1,43 @@
+import asyncio
 import json
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from .decorators import role_required
-from django.db.models import Sum, F
+from django.db.models import F
 from .models import Report, Order, Product
 from .forms import ProductForm, OrderForm
-from django.http import HttpResponseForbidden
-from django.utils.timezone import now, timedelta, localdate
-from .tasks import generate_daily_sales_report
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
+from django.views.decorators.http import require_POST
+from .jobs import enqueue_sales_report
+from .stock import place_orders, stock, transition_orders, InsufficientStock
+from .dashboard import get_dashboard
+from .caching import regions
+from .db import replica_reads
+from .events import get_broker
+from .pagination import KeysetPage, keyset_page, head_cursor, rows_after, decode_cursor
+from .exports import FORMATS, export_queryset, order_filters, stream_export
+from .reports import PERIODS, report_range, sales_range
+from .metrics import registry, token_matches
+from .search import SearchPage, search_products
+from django.conf import settings
+
+MAX_BULK_ORDER_LINES = 1000  # upper bound on lines accepted in one bulk order request
+MAX_STATUS_CHANGES = 5000  # upper bound on orders moved by one bulk status change, all in one transaction
+MAX_LISTED_FAILURES = 20  # failed orders named in the message after a bulk status change
+MAX_ORDER_CHANGES = 200  # changed orders returned per poll of the live order list
+EVENT_HEARTBEAT_SECONDS = 15  # idle time after which the event stream sends a keep-alive comment
+
+def order_rows(orders, with_user=False):  # the columns the order tables render, joined in the same query
+    fields = ["id", "quantity", "ordered_at", "updated_at", "status", "product__name", "product__price"]
+    related = ["product"]
+    if with_user:
+        fields.append("ordered_by__username")
+        related.append("ordered_by")
+    return (orders.select_related(*related).only(*fields)
+        .annotate(line_total=F("quantity") * F("product__price")))  # total price computed by the database
 
 def user_login(request):  # login view
     if request.method == "POST":
@@ -47,13 +75,35 @@ def product_create(request):
 
 @login_required  # view all products (accessible to everyone)
 def product_list(request):
-    products = Product.objects.all()
-    return render(request, "products/product_list.html", {"products": products})
+    cursor = request.GET.get("cursor")
+    query = request.GET.get("q", "").strip()
+    if query:  # a page of full-text matches, best first
+        page_number = _page_number(request)
+        page = SearchPage(query, page_number)
+    else:
+        page_number = None
+        products = Product.objects.only("id", "name", "description", "price", "is_low_stock", "created_at").annotate(available=stock())  # just what the table shows
+        page = KeysetPage(products, "created_at", cursor)  # only queried when the cached table fragment has expired
+    return render(request, "products/product_list.html", {"page": page, "cursor": cursor, "query": query, "page_number": page_number})
+
+def _page_number(request):
+    try:
+        return max(int(request.GET.get("page", 1)), 1)
+    except ValueError:
+        return 1
+
+@login_required  # products matching what was typed so far, best match first, as JSON for typeaheads
+def product_search(request):
+    products, next_page = search_products(request.GET.get("q", ""), _page_number(request), in_stock=request.GET.get("in_stock") == "1")
+    results = [{"id": product.id, "name": product.name, "sku": product.sku, "price": str(product.price), "quantity": product.available} for product in products]
+    return JsonResponse({"results": results, "next_page": next_page})
 
 @login_required  # update product (only admins)
 @role_required(allowed_roles=["admin"])
 def product_update(request, product_id):
     product = get_object_or_404(Product, id=product_id)  # get the product or return a 404 error if not found
+    if product.stock_stripes:  # edit a striped product's current stock, not its quantity column as of the last rebalance
+        product.quantity = Product.objects.annotate(available=stock()).values_list("available", flat=True).get(pk=product.pk)
     if request.method == "POST":
         form = ProductForm(request.POST, instance=product) 
         if form.is_valid():  # check if the form data is valid
@@ -75,8 +125,7 @@ def product_delete(request, product_id):
 @login_required  # create orders (employee only)
 @role_required(allowed_roles=["employee"])
 def order_create(request):
-    products = Product.objects.filter(quantity__gt=0)  # get all products that are in stock
-    form = OrderForm()  # initialize an empty order form
+    form = OrderForm()  # initialize an empty order form; products are picked through the search typeahead
     if request.method == "POST":
         form = OrderForm(request.POST)  # populate the form with submitted data
         if form.is_valid():
@@ -85,22 +134,38 @@ def order_create(request):
             if order.quantity <= 0:  # prevent ordering zero or negative quantities
                 messages.error(request, "invalid quantity!")
                 return redirect("order_create")
-            if not Product.objects.filter(id=order.product.id).exists():  # ensure the selected product exists
-                messages.error(request, "invalid product selection!")
-                return redirect("order_create")
             try:
                 order.save()  # save the order if everything is valid
                 messages.success(request, "order placed successfully!")
                 return redirect("employee_orders")  # redirect to the employee's order list
             except ValueError:  # catch errors if stock is insufficient
                 messages.warning(request, "not enough stock available!")
-    return render(request, "orders/order_form.html", {"form": form, "products": products})
+    selected = form.cleaned_data.get("product") if form.is_bound and form.is_valid() else None  # shown again after a stock error
+    return render(request, "orders/order_form.html", {"form": form, "selected": selected})
+
+@login_required  # place a whole wave of orders in one request (employee only)
+@role_required(allowed_roles=["employee"])
+@require_POST
+def order_bulk_create(request):
+    try:
+        lines = json.loads(request.body)["lines"]  # {"lines": [{"product_id": 1, "quantity": 2}, ...]}
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({"error": "invalid payload!"}, status=400)
+    if not isinstance(lines, list) or not 0 < len(lines) <= MAX_BULK_ORDER_LINES:
+        return JsonResponse({"error": f"send between 1 and {MAX_BULK_ORDER_LINES} lines!"}, status=400)
+    try:
+        results = place_orders(request.user, lines)
+    except InsufficientStock:  # stock kept moving under us, the client can simply retry
+        return JsonResponse({"error": "stock changed while placing the orders, please retry!"}, status=409)
+    accepted = sum(1 for line in results if line["status"] == "accepted")
+    return JsonResponse({"accepted": accepted, "rejected": len(results) - accepted, "lines": results})
 
 @login_required  # view employee’s own orders
 @role_required(allowed_roles=["employee"])
 def employee_orders(request):
-    orders = Order.objects.filter(ordered_by=request.user).order_by("-ordered_at")
-    return render(request, "orders/employee_orders.html", {"orders": orders})
+    cursor = request.GET.get("cursor")
+    orders, next_cursor = keyset_page(order_rows(Order.objects.filter(ordered_by=request.user)), "ordered_at", cursor)
+    return render(request, "orders/employee_orders.html", {"orders": orders, "cursor": cursor, "next_cursor": next_cursor})
 
 @login_required # cancel order (for employees)
 @role_required(allowed_roles=["employee"])
@@ -117,8 +182,25 @@ def cancel_order(request, order_id):
 @login_required  # view all orders (Admins Only)
 @role_required(allowed_roles=["admin"])
 def order_list(request):
-    orders = Order.objects.select_related("product").order_by("-ordered_at")
-    return render(request, "orders/order_list.html", {"orders": orders})
+    cursor = request.GET.get("cursor")
+    orders, next_cursor = keyset_page(order_rows(Order.objects.all(), with_user=True), "ordered_at", cursor)
+    changes_cursor = head_cursor(Order.objects.all(), "updated_at")  # where the page's live polling starts from
+    return render(request, "orders/order_list.html", {"orders": orders, "cursor": cursor, "next_cursor": next_cursor, "changes_cursor": changes_cursor})
+
+@login_required  # orders created or changed since the client's cursor (admin only)
+@role_required(allowed_roles=["admin"])
+def order_changes(request):
+    token = request.GET.get("cursor") or request.headers.get("If-None-Match", "").strip('"')
+    position = decode_cursor(token)
+    if position is None:  # no usable cursor yet, hand out the current head
+        token = head_cursor(Order.objects.all(), "updated_at")
+        return JsonResponse({"cursor": token, "orders": []}, headers={"ETag": f'"{token}"'})
+    orders, next_cursor = rows_after(order_rows(Order.objects.all(), with_user=True), "updated_at", position, MAX_ORDER_CHANGES)
+    if not orders:  # nothing changed since the cursor
+        return HttpResponseNotModified(headers={"ETag": f'"{token}"'})
+    changes = [{"id": order.id, "status": order.status,
+                "html": render_to_string("orders/order_row.html", {"order": order}, request)} for order in orders]
+    return JsonResponse({"cursor": next_cursor, "orders": changes}, headers={"ETag": f'"{next_cursor}"'})
 
 @login_required  # update employee's orders status
 @role_required(allowed_roles=["admin"])
@@ -138,106 +220,160 @@ def update_order_status(request, order_id):
         messages.success(request, f"Order status updated to {new_status.capitalize()}!") # display a success message
     return redirect("order_list")
 
+@login_required  # move selected orders, or all orders matching a filter, to one status (admin only)
+@role_required(allowed_roles=["admin"])
+@require_POST
+def order_bulk_status(request):
+    new_status = request.POST.get("status", "").strip().lower()
+    if new_status not in dict(Order.STATUS_CHOICES):
+        messages.error(request, "Invalid status update!")
+        return redirect("order_list")
+    if request.POST.get("scope") == "filter":  # e.g. every pending order placed up to today
+        try:
+            filters = order_filters(request.POST.get("date_from"), request.POST.get("date_to"), request.POST.get("filter_status"))
+        except ValueError as error:
+            messages.error(request, str(error))
+            return redirect("order_list")
+        if not filters:
+            messages.error(request, "Pick a status or a date range to select orders by!")
+            return redirect("order_list")
+        order_ids = list(Order.objects.filter(**filters).exclude(status=new_status).order_by("id").values_list("id", flat=True)[:MAX_STATUS_CHANGES + 1])
+    else:
+        order_ids = [int(value) for value in request.POST.getlist("orders") if value.isdigit()]
+    if not order_ids:
+        messages.info(request, "No orders to update.")
+        return redirect("order_list")
+    if len(order_ids) > MAX_STATUS_CHANGES:
+        messages.error(request, f"More than {MAX_STATUS_CHANGES} orders selected, narrow the selection!")
+        return redirect("order_list")
+    results = transition_orders(order_ids, new_status)
+    applied = sum(1 for result in results if result["status"] == "applied")
+    failed = [result for result in results if result["status"] == "rejected"]
+    messages.success(request, f"{applied} order(s) updated to {new_status.capitalize()}!")
+    if failed:
+        listed = "; ".join(f"#{result['order_id']}: {result['error']}" for result in failed[:MAX_LISTED_FAILURES])
+        messages.warning(request, f"{len(failed)} order(s) could not be updated: {listed}{' ...' if len(failed) > MAX_LISTED_FAILURES else ''}")
+    return redirect("order_list")
+
 @login_required  # view reports (admin only)
 @role_required(allowed_roles=["admin"])
 def report_list(request):
-    reports = Report.objects.all().order_by("-generated_at") # get reports ordered from last to first
+    with replica_reads():  # read lazily, and only when the cached table fragment has expired
+        reports = Report.objects.all().order_by("-generated_at") # get reports ordered from last to first
+        reports = reports.using(reports.db)
     return render(request, "reports/report_list.html", {"reports": reports})
 
+@login_required  # sales over a week, month, year or custom range, merged from the daily figures (admin only)
+@role_required(allowed_roles=["admin"])
+def sales_report_range(request):
+    period = request.GET.get("period", "month")
+    try:
+        start, end = report_range(period, request.GET.get("start"), request.GET.get("end"))
+        product = int(request.GET["product"]) if request.GET.get("product") else None
+    except ValueError as error:
+        messages.error(request, str(error).capitalize())
+        period, product = "month", None
+        start, end = report_range(period)
+    def build():
+        with replica_reads():
+            return sales_range(start, end, product)
+    sales = regions["reports"].get_or_set(f"sales:{start}:{end}:{product}", build)
+    fmt = request.GET.get("format")
+    if fmt == "json":
+        return JsonResponse(sales)
+    context = {"sales": sales, "start": start, "end": end, "period": period, "periods": PERIODS, "product": product}
+    if fmt == "text":
+        return HttpResponse(render_to_string("reports/sales_report.txt", context), content_type="text/plain; charset=utf-8")
+    return render(request, "reports/sales_range.html", context)
+
 @login_required  # generate sales report (admin only)
 @role_required(allowed_roles=["admin"])
 def generate_sales_report(request):
-    today = now().date()  # today's date
-    # delete any existing report for today to avoid duplicates
-    Report.objects.filter(report_type="sales", generated_at__date=today).delete()
-    generate_daily_sales_report()
-    messages.success(request, "Daily sales report generated successfully!")
+    enqueue_sales_report()  # the report is built by the background worker, not inside this request
+    messages.success(request, "Daily sales report queued, it will appear here shortly!")
     return redirect("report_list")
 
 @login_required  # generate low stock alerts (admin only)
 @role_required(allowed_roles=["admin"])
 def generate_low_stock_alert(request):
-    low_stock_products = Product.objects.filter(quantity__lte=5) # check product's quantity below 5
-    if low_stock_products.exists(): # if true (there is a product's quantity under 5)
-        report_details = "\n".join([f"{product.name}: Only {product.quantity} left!" for product in low_stock_products])
+    # products flagged at write time when they reach their reorder threshold, read through a partial index
+    low_stock_products = list(Product.objects.filter(is_low_stock=True).order_by("name").annotate(available=stock()).values_list("name", "available"))
+    if low_stock_products: # if true (there is a product at or below its threshold)
+        report_details = "\n".join([f"{name}: Only {quantity} left!" for name, quantity in low_stock_products])
         Report.objects.create(report_type="low_stock", details=report_details)
         messages.warning(request, "Low-stock alert generated!")
-    else:  # else (there is not a single product's quantity under 5)
+    else:  # else (there is not a single product at or below its threshold)
         messages.info(request, "All products are sufficiently stocked.")
     return redirect("report_list")
 
 @login_required  # dashboard (admin only)
 @role_required(allowed_roles=["admin"])
 def admin_dashboard(request):
-    first_day_of_month = now().replace(day=1)  # first day of the current month
-    # get filter from request (default: completed orders only)
-    order_filter = request.GET.get("order_filter", "completed")
-    # base query (completed orders only)
-    orders_query = Order.objects.filter(status="completed", ordered_at__gte=first_day_of_month)
-    # if admin selects "all", include admin-canceled orders
-    if order_filter == "all":
-        orders_query = Order.objects.filter(status__in=["completed", "canceled"], ordered_at__gte=first_day_of_month)
-    # get top 5 most ordered products based on the selected filter
-    top_products = (
-        orders_query.values("product__name")
-        .annotate(total_quantity=Sum("quantity"))
-        .order_by("-total_quantity")[:5]
-    )
-    product_names = [item["product__name"] for item in top_products]
-    total_quantities = [item["total_quantity"] for item in top_products]
+    order_filter = request.GET.get("order_filter", "completed")  # completed orders only, or "all" to include canceled ones
     period = request.GET.get("period", "day")
-    if period == "day":  # last 7 days orders
-        time_range = [now().date() - timedelta(days=i) for i in range(6, -1, -1)]
-        time_labels = [date.strftime("%b %d") for date in time_range]
-        time_orders = [
-            Order.objects.filter(ordered_at__date=date, status="completed").count()
-            for date in time_range]
-    elif period == "week":  # Last 4 weeks
-        end_of_week = localdate()  # Get today's date
-        start_of_week = end_of_week - timedelta(weeks=3)  # Start from 4 weeks ago
-        time_range = [start_of_week + timedelta(weeks=i) for i in range(4)]
-        time_labels = [f"Week {i+1}" for i in range(4)]
-        time_orders = [
-            Order.objects.filter(
-                ordered_at__gte=time_range[i],
-                ordered_at__lt=time_range[i+1] if i+1 < len(time_range) else end_of_week + timedelta(days=1),
-                status="completed"  
-            ).count()
-            for i in range(4)
-        ]
-    elif period == "month":  # last 12 months orders
-        time_range = [now().replace(day=1) - timedelta(days=30*i) for i in range(11, -1, -1)]
-        time_labels = [date.strftime("%b %Y") for date in time_range]
-        time_orders = [
-            Order.objects.filter(ordered_at__year=date.year, ordered_at__month=date.month, status="completed").count()
-            for date in time_range]
-    total_reports = Report.objects.count()
-    total_revenue = (
-        Order.objects.filter(status="completed", ordered_at__date=localdate())
-        .aggregate(total_revenue=Sum(F("product__price") * F("quantity")))
-        ["total_revenue"] or 0
-    )
-    pending_orders = Order.objects.filter(status="pending").count()  
-    canceled_orders = Order.objects.filter(status="canceled", ordered_at__gte=now() - timedelta(days=30)).count()  
-    total_orders_last_30_days = Order.objects.filter(ordered_at__gte=now() - timedelta(days=30)).count()   
-    canceled_order_rate = (canceled_orders / total_orders_last_30_days * 100) if total_orders_last_30_days else 0  
-    low_stock_products = Product.objects.filter(quantity__lte=5).count()  
-    context = {
-        "total_products": Product.objects.count(),
-        "total_orders": Order.objects.count(),
-        "total_reports": total_reports,
-        "product_names": json.dumps(product_names),
-        "total_quantities": json.dumps(total_quantities),
-        "time_labels": json.dumps(time_labels),
-        "time_orders": json.dumps(time_orders),
-        "current_period": period,
-        "current_filter": order_filter,
-        "total_revenue": total_revenue,
-        "pending_orders": pending_orders,
-        "canceled_order_rate": canceled_order_rate,
-        "low_stock_products": low_stock_products,}
+    if period not in ("day", "week", "month"):
+        period = "day"
+    stats = get_dashboard(period, order_filter)  # a handful of grouped queries, cached until orders/products change
+    context = dict(stats,
+        product_names=json.dumps(stats["product_names"]),
+        total_quantities=json.dumps(stats["total_quantities"]),
+        time_labels=json.dumps(stats["time_labels"]),
+        time_orders=json.dumps(stats["time_orders"]),
+        current_period=period,
+        current_filter=order_filter,)
     return render(request, "admin_dashboard.html", context)
 
+@login_required  # server-sent events for order and stock changes (admin only, needs the ASGI server)
+async def order_events(request):
+    user = await request.auser()
+    if user.role != "admin":
+        return HttpResponseForbidden("You don't have permission to access this page.")
+    subscription = get_broker().subscribe()  # a queue on this event loop, no thread is held per client
+
+    async def stream():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.get(), EVENT_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:  # client went away
+            subscription.close()
+
+    response = StreamingHttpResponse(stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # keep reverse proxies from buffering the stream
+    return response
+
+@login_required  # stream orders, products or reports as CSV or NDJSON (admin only)
+@role_required(allowed_roles=["admin"])
+def export_data(request, dataset):
+    fmt = request.GET.get("format", "csv")
+    if fmt not in FORMATS:
+        return HttpResponseBadRequest("Unknown export format!")
+    try:
+        queryset = export_queryset(dataset, date_from=request.GET.get("date_from"), date_to=request.GET.get("date_to"),
+            status=request.GET.get("status"), product=request.GET.get("product"))
+    except ValueError as error:
+        return HttpResponseBadRequest(str(error).capitalize())
+    response = StreamingHttpResponse(stream_export(dataset, queryset, fmt), content_type=FORMATS[fmt])
+    response["Content-Disposition"] = f'attachment; filename="{dataset}.{fmt}"'
+    return response
+
+@login_required  # hit/miss counters of the cache regions in this process, for monitoring (admin only)
+@role_required(allowed_roles=["admin"])
+def cache_stats(request):
+    return JsonResponse({name: region.stats() for name, region in regions.items()})
+
+def metrics(request):  # Prometheus scrape of this process's request, job and cache metrics (the token, allowed IPs or admins)
+    allowed = token_matches(request.headers.get("Authorization")) or request.META.get("REMOTE_ADDR") in getattr(settings, "METRICS_ALLOWED_IPS", [])
+    if not allowed and not (request.user.is_authenticated and request.user.role == "admin"):
+        return HttpResponseForbidden("You don't have permission to access this page.")
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
 def custom_login_redirect(request): # login redirection 
     if request.user.is_authenticated:
         if request.user.role == "admin":
@@ -42,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app.metrics.MetricsMiddleware',  # first, so its timings cover the rest of the stack
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -55,7 +56,7 @@ ROOT_URLCONF = 'wms.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'app.metrics.DjangoTemplates',  # the Django backend with render times counted per request
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -77,9 +78,55 @@ WSGI_APPLICATION = 'wms.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'app.backends.sqlite3',  # WAL, busy timeout and cache pragmas, see app/backends/sqlite3/base.py
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    },
+    'replica': {  # the same file over a read-only connection, for dashboard and report reads
+        'ENGINE': 'app.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {'pragmas': {'query_only': 'ON'}},
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+
+DATABASE_ROUTERS = ['app.db.ReadReplicaRouter']
+WMS_READ_REPLICA = 'replica'  # None reads everything from 'default'
+
+
+# Caches
+# Each cache region (see app/caching.py) has its own alias; local memory evicts least recently used
+# entries past MAX_ENTRIES, the file cache is shared by every process on the host.
+# The regions' versions live in the 'versions' file cache whatever a region's backend, so a write in one
+# worker invalidates every worker's local-memory entries as well as the shared ones.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'default',
+    },
+    'versions': {  # each region's current version, see app.caching.Region
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / '.cache' / 'versions',
+        'TIMEOUT': None,
+    },
+    'catalogue': {  # product list fragments
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalogue',
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 2000},
+    },
+    'dashboard': {  # admin dashboard payloads
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'dashboard',
+        'TIMEOUT': 60,
+        'OPTIONS': {'MAX_ENTRIES': 100},
+    },
+    'reports': {  # report list fragments and sales range figures
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / '.cache' / 'reports',
+        'TIMEOUT': 3600,
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
 }
 
 
@@ -125,12 +172,42 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'app.User'
+SCHEDULER_LEASE_SECONDS = 60  # a scheduler leader that misses heartbeats for this long is replaced
+SCHEDULER_MISFIRE_GRACE_SECONDS = 3600  # scheduled runs later than this are dropped, earlier ones still run once
+STOCK_REBALANCE_SECONDS = 60  # how often the scheduler evens out striped products' stock, see manage.py stripe_stock
+ORDER_ARCHIVE_AFTER_DAYS = 365  # completed and canceled orders older than this move to the archive table every night (keep it above 31, the dashboard reads this month's orders from the hot table)
+WMS_EVENT_BROKER = "app.events.LocalBroker"  # pub/sub behind the live order event stream (in-process by default)
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/login/'
 
 AUTHENTICATION_BACKENDS = [
-    'django.contrib.auth.backends.ModelBackend',
+    'app.auth.CachedModelBackend',  # ModelBackend with request.user served from a per-process cache
 ]
+AUTH_USER_CACHE_SIZE = 1024  # users whose rows each process keeps
+AUTH_USER_CACHE_TTL = 300  # seconds a user row is kept; a change in another process applies at once through the 'versions' cache
+
+SLOW_REQUEST_SECONDS = 1.0  # requests and jobs slower than this are logged with their slowest SQL
+# who may scrape /metrics/ besides logged-in admins: a scraper sending "Authorization: Bearer <METRICS_TOKEN>", or these
+# addresses. Behind a reverse proxy on the same host every request comes from 127.0.0.1, so only list addresses without one.
+METRICS_TOKEN = None
+METRICS_ALLOWED_IPS = []
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'plain': {'format': '%(asctime)s %(levelname)s %(name)s: %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'plain'},
+    },
+    'loggers': {
+        'app': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
+# the session lives in the signed cookie itself, so loading it costs no query and no shared cache
+SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
 
 SECURE_BROWSER_XSS_FILTER = True
 X_FRAME_OPTIONS = "DENY"